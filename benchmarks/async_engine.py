@@ -0,0 +1,43 @@
+"""Wall-clock time of CryptoAssets vs AsyncCryptoAssets on a local stub.
+
+Run from the repository root with ``python -m benchmarks.async_engine``.
+"""
+import time
+
+from benchmarks.stub_server import StubServer
+from madcc.utils.crypto_assets import AsyncCryptoAssets, CryptoAssets
+from madcc.utils.fiat_rates import FiatRates
+from madcc.utils.http import pooled_session
+from madcc.utils.price_sources import CoinMarketCapSource
+
+
+def engine(server, cls, **kwargs):
+    session = pooled_session(8)
+    concurrency = kwargs.get('concurrency', 1)
+    config = {'currency_api': server.currency_api}
+    return cls(
+        config, 'btc', 10,
+        CoinMarketCapSource(base_url=server.base_url, session=session, concurrency=concurrency),
+        FiatRates(config['currency_api'], session=session),
+        **kwargs
+    )
+
+
+def main():
+    with StubServer(coins=2000, latency=0.05) as server:
+        print('{:>6} {:>8} {:>6} {:>8} {:>6}'.format('coins', 'sync s', 'reqs', 'async s', 'reqs'))
+        for count in (10, 60, 200):
+            # held coins spread over all ranks, plus two fiat lines
+            crypto_data = [['coin-{}'.format(1 + i * 2000 // count), '1.5'] for i in range(count)]
+            crypto_data += [['eur', '100'], ['usd', '100']]
+            results = list()
+            for ca in (engine(server, CryptoAssets), engine(server, AsyncCryptoAssets, concurrency=8)):
+                server.requests = 0
+                start = time.perf_counter()
+                ca.generate_crypto_table(crypto_data)
+                results += [time.perf_counter() - start, server.requests]
+            print('{:>6} {:>8.3f} {:>6} {:>8.3f} {:>6}'.format(count, *results))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+"""Valuing many crypto files one by one vs as one batch.
+
+Writes ``--files`` crypto files holding 20 coins each out of 300 distinct
+ones, then values them once with a fresh CryptoAssets per file, like
+separate crypto_assets runs, and once with value_crypto_files. The api is a
+StubProcess. Run from the repository root with
+``python -m benchmarks.batch_valuation``.
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from benchmarks.stub_server import StubProcess
+from madcc.utils.batch import find_crypto_files, value_crypto_files
+from madcc.utils.crypto_assets import CryptoAssets
+from madcc.utils.fiat_rates import FiatRates
+from madcc.utils.http import pooled_session
+from madcc.utils.price_sources import CoinMarketCapSource
+
+
+def write_files(directory, count, distinct=300, held=20):
+    random.seed(1)
+    for index in range(count):
+        with open(os.path.join(directory, 'client{:04d}.txt'.format(index)), 'w') as f:
+            f.write('# cryptocurrency\n')
+            for coin in random.sample(range(1, distinct + 1), held):
+                f.write('- coin-{} {:.4f}\n'.format(coin, random.random() * 10))
+            f.write('- eur 100\n')
+
+
+def assets(server):
+    session = pooled_session(8)
+    return CryptoAssets(
+        {'currency_api': server.currency_api}, 'eur', 2,
+        CoinMarketCapSource(base_url=server.base_url, session=session, concurrency=4),
+        FiatRates(server.currency_api, session=session)
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Batch valuation benchmark')
+    parser.add_argument('--files', type=int, default=200)
+    parser.add_argument('--latency', type=float, default=0.01)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    write_files(directory, args.files)
+    paths = find_crypto_files(directory)
+    print('{:<12} {:>8} {:>8}'.format('', 'seconds', 'requests'))
+    with StubProcess(coins=2000, latency=args.latency) as server:
+        server.counters(reset=True)
+        start = time.perf_counter()
+        for path in paths:
+            ca = assets(server)
+            ca.config['crypto_file'] = path
+            ca.generate_portfolio(ca.parse_crypto_file()).render(2)
+        print('{:<12} {:>8.3f} {:>8}'.format('per file', time.perf_counter() - start, server.counters()[0]))
+
+        server.counters(reset=True)
+        start = time.perf_counter()
+        valuation = value_crypto_files(assets(server), paths)
+        for portfolio in valuation.portfolios.values():
+            portfolio.render(2)
+        valuation.total.render(2)
+        print('{:<12} {:>8.3f} {:>8}'.format('batch', time.perf_counter() - start, server.counters()[0]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,44 @@
+"""p50 and p99 quote latency with one spiky upstream, alone and hedged.
+
+The primary stub answers in 30 ms but 10% of its requests take 1.5 s
+longer, the secondary always answers in 80 ms. Run from the repository root
+with ``python -m benchmarks.hedging``.
+"""
+import time
+
+from benchmarks.stub_server import StubServer
+from madcc.utils.http import pooled_session
+from madcc.utils.price_sources import CoinMarketCapSource, HedgedPriceSource
+
+
+def percentiles(source, slugs, runs=100):
+    latencies = list()
+    for _ in range(runs):
+        start = time.perf_counter()
+        source.quotes(slugs, 'eur')
+        latencies.append(time.perf_counter() - start)
+    latencies.sort()
+    return latencies[len(latencies) // 2], latencies[int(len(latencies) * 0.99) - 1], latencies[-1]
+
+
+def main():
+    slugs = ['coin-{}'.format(i) for i in range(1, 11)]
+    with StubServer(latency=0.03, spike_rate=0.1, spike_latency=1.5) as primary, \
+            StubServer(latency=0.08) as secondary:
+        sources = [
+            CoinMarketCapSource(base_url=server.base_url, session=pooled_session(4))
+            for server in (primary, secondary)
+        ]
+        for source in sources:
+            # the listings are cached in practice
+            source.slug_ids = (lambda ids: lambda: ids)(source.slug_ids())
+
+        print('{:>16} {:>8} {:>8} {:>8}'.format('', 'p50 s', 'p99 s', 'max s'))
+        print('{:>16} {:>8.3f} {:>8.3f} {:>8.3f}'.format('primary only', *percentiles(sources[0], slugs)))
+        hedged = HedgedPriceSource(sources, hedge_after=0.15)
+        print('{:>16} {:>8.3f} {:>8.3f} {:>8.3f}'.format('hedged', *percentiles(hedged, slugs)))
+        print(dict((k, dict((x, v[x]) for x in ('calls', 'hedges', 'wins'))) for k, v in hedged.stats.items()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+"""Size and analysis time of a recorded valuation history.
+
+Records six months of hourly snapshots of a 50 coin portfolio, then compares
+reading and analysing the memory-mapped columns with building the same
+statistics from per-snapshot dicts. Run from the repository root with
+``python -m benchmarks.history``.
+"""
+import os
+import random
+import tempfile
+import time
+import timeit
+
+from madcc.utils.history import HistoryStore, analyze, resample
+
+
+def make_history(path, snapshots=24 * 183, coins=50):
+    rng = random.Random(snapshots)
+    prices = [rng.uniform(1, 1000) for _ in range(coins)]
+    store = HistoryStore(path)
+    start = time.time() - snapshots * 3600
+    for i in range(snapshots):
+        prices = [x * rng.uniform(0.98, 1.02) for x in prices]
+        store.record(
+            [['coin-{}'.format(c), 1.0, 0, p, p] for c, p in enumerate(prices)],
+            timestamp=start + i * 3600
+        )
+    return store
+
+
+def with_arrays(store, period):
+    times, symbols, columns = store.read()
+    times, totals = resample(times, columns['total'], period)
+    return analyze(times, symbols, totals)
+
+
+def with_dicts(snapshots):
+    # The same returns, drawdown and drift from one dict per snapshot
+    values = [sum(x.values()) for x in snapshots]
+    returns = [b / a - 1 for a, b in zip(values, values[1:])]
+    peak, drawdown = values[0], 0
+    for value in values:
+        peak = max(peak, value)
+        drawdown = min(drawdown, value / peak - 1)
+    first = dict((k, v / values[0]) for k, v in snapshots[0].items())
+    drift = dict(
+        (k, max(abs(x.get(k, 0) / v - first.get(k, 0)) for x, v in zip(snapshots, values)))
+        for k in snapshots[-1]
+    )
+    return returns, drawdown, drift
+
+
+def main():
+    path = tempfile.mkdtemp()
+    start = time.time()
+    store = make_history(path)
+    record = (time.time() - start) / len(store)
+    size = sum(os.path.getsize(os.path.join(path, x)) for x in os.listdir(path))
+    times, symbols, columns = store.read()
+    snapshots = [dict(zip(symbols, row)) for row in columns['total'].tolist()]
+
+    print('{} snapshots of {} coins, {:.1f} MB on disk, {:.2f} ms per record'.format(
+        len(store), len(symbols), size / 1e6, record * 1000))
+    for period in ('hourly', 'daily'):
+        arrays = min(timeit.repeat(lambda: with_arrays(store, period), number=1, repeat=5))
+        print('{:>8} arrays {:.4f} s'.format(period, arrays))
+    dicts = min(timeit.repeat(lambda: with_dicts(snapshots), number=1, repeat=5))
+    print('{:>8} dicts  {:.4f} s (excluding building the dicts)'.format('hourly', dicts))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+"""Cost of liquidation values for portfolios of many coins.
+
+Fetches the 500 level order books of the held coins from the stub server,
+one at a time and concurrently, then from the book cache, and compares
+walking all books at once with walk_bids against walking them level by
+level in python. Run from the repository root with
+``python -m benchmarks.liquidation``.
+"""
+import time
+
+import numpy as np
+
+from madcc.utils.cache import DiskCache
+from madcc.utils.portfolio import walk_bids
+from madcc.utils.price_sources import KrakenSource
+
+from .stub_server import StubProcess
+
+LATENCY = 0.05
+LEVELS = 500
+
+
+def walk_levels(amounts, books):
+    # The plain loop walk_bids replaces
+    values = list()
+    for amount, (prices, volumes) in zip(amounts, books):
+        left = amount
+        value = 0.0
+        for price, volume in zip(prices.tolist(), volumes.tolist()):
+            taken = min(left, volume)
+            value += taken * price
+            left -= taken
+            if left <= 0:
+                break
+        values.append(value)
+    return values
+
+
+def main():
+    with StubProcess(coins=200, latency=LATENCY) as server:
+        print('{:>6} {:>14} {:>14} {:>10} {:>10} {:>10}'.format(
+            'coins', 'serial ms', 'concurrent ms', 'cached ms', 'walk ms', 'loop ms'))
+        for held in (5, 20, 50):
+            slugs = ['coin-{}'.format(i) for i in range(1, held + 1)]
+            asset_map = dict(('C{}'.format(i), 'coin-{}'.format(i)) for i in range(1, held + 1))
+            timings = list()
+            for concurrency in (1, 8):
+                source = KrakenSource(cache=DiskCache(), asset_map=asset_map, concurrency=concurrency)
+                source.api.uri = server.kraken_url
+                source.asset_pairs()
+                start = time.perf_counter()
+                books = source.books(slugs, 'eur', LEVELS)
+                timings.append(time.perf_counter() - start)
+            start = time.perf_counter()
+            source.books(slugs, 'eur', LEVELS)
+            timings.append(time.perf_counter() - start)
+
+            # large enough to walk through most of every book
+            ordered = [books[x] for x in slugs]
+            amounts = np.array([0.9 * x[1].sum() for x in ordered])
+            start = time.perf_counter()
+            values, _ = walk_bids(amounts, ordered)
+            timings.append(time.perf_counter() - start)
+            start = time.perf_counter()
+            expected = walk_levels(amounts, ordered)
+            timings.append(time.perf_counter() - start)
+            assert np.allclose(values, expected)
+            print('{:>6} {:>14.1f} {:>14.1f} {:>10.3f} {:>10.3f} {:>10.3f}'.format(
+                held, *[1000 * x for x in timings]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,50 @@
+"""Startup cost of resolving held coins from cached listings.
+
+Compares loading the slug to id mapping of 10k coins from the json
+DiskCache, as done without an index, with opening a ListingsIndex and
+looking up the held coins by slug and symbol. Run from the repository root
+with ``python -m benchmarks.listings_index``.
+"""
+import os
+import tempfile
+import time
+
+from madcc.utils.cache import DiskCache
+from madcc.utils.listings_index import ListingsIndex
+
+COINS = 10000
+
+
+def main():
+    tmp = tempfile.mkdtemp()
+    listings = [
+        {'id': i, 'symbol': 'C{}'.format(i), 'website_slug': 'coin-{}'.format(i)} for i in range(1, COINS + 1)
+    ]
+    cache = DiskCache(os.path.join(tmp, 'cache.json'))
+    cache.set('slug_ids', dict((x['website_slug'], x['id']) for x in listings))
+    cache.save()
+    ListingsIndex(os.path.join(tmp, 'listings.idx')).update(listings)
+
+    print('{:>6} {:>12} {:>12} {:>12}'.format('held', 'cache ms', 'slugs ms', 'symbols ms'))
+    for held in (5, 100, 1000):
+        names = ['coin-{}'.format(1 + i * COINS // held) for i in range(held)]
+
+        start = time.perf_counter()
+        slug_ids = DiskCache(cache.path).get('slug_ids')
+        assert all(name in slug_ids for name in names)
+        cached = time.perf_counter() - start
+
+        start = time.perf_counter()
+        index = ListingsIndex(os.path.join(tmp, 'listings.idx'))
+        assert all(index.lookup(name) for name in names)
+        slugs = time.perf_counter() - start
+
+        start = time.perf_counter()
+        index = ListingsIndex(os.path.join(tmp, 'listings.idx'))
+        assert all(index.lookup(name.replace('coin-', 'c')) for name in names)
+        symbols = time.perf_counter() - start
+        print('{:>6} {:>12.3f} {:>12.3f} {:>12.3f}'.format(held, 1000 * cached, 1000 * slugs, 1000 * symbols))
+
+
+if __name__ == '__main__':
+    main()
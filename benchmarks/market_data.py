@@ -0,0 +1,61 @@
+"""Size and read speed of downloaded Kraken trades.
+
+Appends a million synthetic trades in pages of 1000, as the downloader
+does, and reports the size on disk against the raw records and json, then
+the time to read a one hour range against reading everything. Run from the
+repository root with ``python -m benchmarks.market_data``.
+"""
+import json
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from madcc.kraken.market import TRADE_DTYPE, TRADES_PAGE
+from madcc.utils.series import SeriesStore
+
+TRADES = 1000000
+
+
+def synthetic_trades(count):
+    # A random walk of prices, a few trades a second, rounded like Kraken's
+    rng = np.random.RandomState(1)
+    trades = np.zeros(count, TRADE_DTYPE)
+    trades['time'] = np.round(1.6e9 + np.cumsum(rng.exponential(0.3, count)), 4)
+    trades['price'] = np.round(20000 * np.exp(np.cumsum(rng.normal(0, 1e-4, count))), 1)
+    trades['volume'] = np.round(rng.exponential(0.05, count), 8)
+    trades['id'] = np.arange(1, count + 1)
+    trades['side'] = rng.randint(0, 2, count)
+    trades['type'] = rng.randint(0, 2, count)
+    return trades
+
+
+def main():
+    trades = synthetic_trades(TRADES)
+    store = SeriesStore(os.path.join(tempfile.mkdtemp(), 'trades'), TRADE_DTYPE)
+
+    start = time.perf_counter()
+    for i in range(0, TRADES, TRADES_PAGE):
+        store.append(trades[i:i + TRADES_PAGE], str(i))
+    appended = time.perf_counter() - start
+
+    stored = sum(os.path.getsize(os.path.join(store.path, x)) for x in os.listdir(store.path))
+    as_json = len(json.dumps([[str(x['price']), str(x['volume']), float(x['time']), 'bs'[x['side']],
+                               'ml'[x['type']], '', int(x['id'])] for x in trades[:10000]])) * TRADES // 10000
+    print('{} trades appended in {:.2f}s'.format(TRADES, appended))
+    print('{:>10} {:>10} {:>10} {:>8}'.format('json MB', 'raw MB', 'stored MB', 'ratio'))
+    print('{:>10.1f} {:>10.1f} {:>10.1f} {:>8.1f}'.format(
+        as_json / 1e6, trades.nbytes / 1e6, stored / 1e6, trades.nbytes / stored
+    ))
+
+    middle = trades['time'][TRADES // 2]
+    for name, bounds in (('1 hour', (middle, middle + 3600)), ('everything', (None, None))):
+        start = time.perf_counter()
+        for _ in range(5):
+            rows = SeriesStore(store.path, TRADE_DTYPE).read(*bounds)
+        print('{:>10}: {:>8} trades in {:.2f}ms'.format(name, len(rows), 1000 * (time.perf_counter() - start) / 5))
+
+
+if __name__ == '__main__':
+    main()
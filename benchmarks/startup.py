@@ -0,0 +1,46 @@
+"""Startup time of the madcc entrypoints.
+
+Prints the slowest imports of each entrypoint module (python -X importtime)
+and the wall-clock time of its --help path. Run from the repository root
+with ``python -m benchmarks.startup``.
+"""
+import subprocess
+import sys
+import time
+
+MODULES = ('madcc.entrypoints.kraken_limits', 'madcc.entrypoints.crypto_assets')
+
+
+def import_times(module):
+    res = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import {}'.format(module)],
+        stderr=subprocess.PIPE, universal_newlines=True, check=True
+    )
+    times = list()
+    for line in res.stderr.splitlines()[1:]:
+        _, cumulative, name = line.split('|')
+        times.append((int(cumulative), name.strip()))
+    return sorted(times, reverse=True)
+
+
+def run_time(code, repeat=5):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, '-c', code], check=True)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    print('bare interpreter: {:.0f} ms'.format(run_time('pass') * 1000))
+    for module in MODULES:
+        code = 'import sys; sys.argv = ["x", "--help"]; from {} import main; main()'.format(module)
+        print('\n{} --help: {:.0f} ms'.format(module, run_time(code) * 1000))
+        for cumulative, name in import_times(module)[:8]:
+            print('  {:>8.1f} ms  {}'.format(cumulative / 1000, name))
+
+
+if __name__ == '__main__':
+    main()
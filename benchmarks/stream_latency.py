@@ -0,0 +1,66 @@
+"""Quote-to-table latency of pushed Kraken websocket prices.
+
+A KrakenWebSocketStub pushes a new price for one of the held coins, and the
+time until a table including it is rendered is measured, for portfolios of
+5 to 500 coins. For comparison the time of one polled refresh through the
+coinmarketcap stub is shown; polling every ``interval`` seconds adds half
+that interval on average. Run from the repository root with
+``python -m benchmarks.stream_latency``.
+"""
+import time
+
+from benchmarks.stub_server import KrakenWebSocketStub, StubServer
+from madcc.kraken.stream import KrakenTickerStream
+from madcc.utils.cache import DiskCache
+from madcc.utils.crypto_assets import CryptoAssets
+from madcc.utils.fiat_rates import FiatRates
+from madcc.utils.http import pooled_session
+from madcc.utils.price_sources import CoinMarketCapSource, KrakenSource, KrakenStreamSource
+
+UPDATES = 200
+
+
+def percentile(values, share):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * share))]
+
+
+def main():
+    print('{:>6} {:>10} {:>10} {:>10}'.format('coins', 'p50 ms', 'p99 ms', 'poll ms'))
+    with StubServer(coins=2000, latency=0.05) as rest:
+        for count in (5, 50, 500):
+            crypto_data = [['coin-{}'.format(i), '1.5'] for i in range(1, count + 1)]
+            cache = DiskCache()
+            # the asset pairs only change once a day, so they come from the cache
+            cache.set('kraken_ws_pairs', dict(('C{}:ZEUR'.format(i), 'C{}/EUR'.format(i)) for i in range(1, count + 1)))
+            kraken = KrakenSource(cache=cache, asset_map=dict(('C{}'.format(i), 'coin-{}'.format(i)) for i in range(1, count + 1)))
+            fiat_rates = FiatRates(rest.currency_api)
+
+            prices = dict(('C{}/EUR'.format(i), '{:.1f}'.format(100.0 + i)) for i in range(1, count + 1))
+            with KrakenWebSocketStub(prices) as server:
+                stream = KrakenTickerStream(server.url)
+                ca = CryptoAssets({}, 'eur', 2, KrakenStreamSource(kraken, stream), fiat_rates)
+                # subscribes and waits for the first tickers
+                ca.generate_portfolio(crypto_data).render(2)
+                latencies = list()
+                for update in range(UPDATES):
+                    start = time.time()
+                    server.push('C{}/EUR'.format(1 + update % count), '{:.1f}'.format(1000.0 + update))
+                    stream.wait_update(start, 5)
+                    ca.generate_portfolio(crypto_data).render(2)
+                    latencies.append(time.time() - start)
+                stream.stop()
+
+            session = pooled_session(8)
+            polled = CryptoAssets(
+                {}, 'eur', 2, CoinMarketCapSource(base_url=rest.base_url, session=session), fiat_rates
+            )
+            start = time.time()
+            polled.generate_portfolio(crypto_data).render(2)
+            poll = time.time() - start
+            print('{:>6} {:>10.2f} {:>10.2f} {:>10.2f}'.format(
+                count, 1000 * percentile(latencies, 0.5), 1000 * percentile(latencies, 0.99), 1000 * poll))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,52 @@
+"""Time to first row and total time of table vs streamed output.
+
+Values a portfolio spread over all ranks of a local stub api, once rendered
+as a table and once streamed as ndjson. Run from the repository root with
+``python -m benchmarks.streaming_output``.
+"""
+import io
+import time
+
+from benchmarks.stub_server import StubServer
+from madcc.utils.crypto_assets import CryptoAssets
+from madcc.utils.fiat_rates import FiatRates
+from madcc.utils.formats import write_rows
+from madcc.utils.http import pooled_session
+from madcc.utils.price_sources import CoinMarketCapSource
+
+
+class TimedOutput(io.StringIO):
+    # Remembers when the first row was flushed
+    first = None
+
+    def flush(self):
+        if self.first is None:
+            self.first = time.perf_counter()
+
+
+def main():
+    with StubServer(coins=5000, latency=0.05) as server:
+        config = {'currency_api': server.currency_api}
+        session = pooled_session(8)
+        ca = CryptoAssets(
+            config, 'eur', 2,
+            CoinMarketCapSource(base_url=server.base_url, session=session),
+            FiatRates(config['currency_api'], session=session)
+        )
+        print('{:>6} {:>10} {:>10} {:>10}'.format('coins', 'table s', 'first s', 'ndjson s'))
+        for count in (100, 1000, 5000):
+            crypto_data = [['coin-{}'.format(1 + i * 5000 // count), '1.5'] for i in range(count)]
+
+            start = time.perf_counter()
+            ca.generate_portfolio(crypto_data).render(2)
+            table = time.perf_counter() - start
+
+            out = TimedOutput()
+            start = time.perf_counter()
+            write_rows(ca.iter_valuations(crypto_data), 'ndjson', 'eur', out)
+            streamed = time.perf_counter() - start
+            print('{:>6} {:>10.3f} {:>10.3f} {:>10.3f}'.format(count, table, out.first - start, streamed))
+
+
+if __name__ == '__main__':
+    main()
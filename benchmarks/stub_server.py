@@ -0,0 +1,305 @@
+"""Local stand-in for the apis used by the benchmarks.
+
+Serves the coinmarketcap v2 ``listings/``, paged ``ticker/`` and single coin
+``ticker/<id>/`` for a synthetic universe of coins, the currency api
+``convert`` endpoint and the Kraken ``Time``, ``DepositMethods``,
+``WithdrawInfo``, ``AssetPairs`` and ``Depth`` calls, sleeping ``latency`` seconds per request to mimic a
+remote api. Faults can be injected:
+
+- a ``spike_rate`` share of the requests takes ``spike_latency`` seconds
+  longer
+- an ``error_rate`` share of the requests fails with a 503
+- beyond ``rate_limit`` requests per second, requests are refused with a
+  429, or a Kraken rate limit error
+
+StubProcess runs the server in a child process, so it does not add to the
+cpu time and memory of the client being measured. KrakenWebSocketStub
+stands in for the Kraken websocket ticker feed and pushes prices on demand.
+"""
+import base64
+import hashlib
+import json
+import multiprocessing
+import random
+import socket
+import struct
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import StreamRequestHandler, ThreadingMixIn, ThreadingTCPServer
+from urllib.parse import parse_qs, urlparse
+
+
+def make_coins(count):
+    return [
+        {'id': i, 'name': 'Coin {}'.format(i), 'symbol': 'C{}'.format(i),
+         'website_slug': 'coin-{}'.format(i)}
+        for i in range(1, count + 1)
+    ]
+
+
+def ticker(rank, coin, currency):
+    return dict(coin, rank=rank, quotes={currency: {'price': 1000.0 / rank}})
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def _send(self, body, status=200):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _fault(self):
+        # Sleep like a remote api would, returns an injected error status
+        server = self.server
+        with server.lock:
+            server.requests += 1
+            now = time.time()
+            while server.recent and server.recent[0] < now - 1:
+                server.recent.pop(0)
+            limited = server.rate_limit and len(server.recent) >= server.rate_limit
+            if not limited:
+                server.recent.append(now)
+        time.sleep(server.latency + (server.spike_latency if random.random() < server.spike_rate else 0))
+        if limited:
+            server.faults += 1
+            return 429
+        if random.random() < server.error_rate:
+            server.faults += 1
+            return 503
+        return None
+
+    def do_POST(self):
+        self._kraken(parse_qs(self.rfile.read(int(self.headers.get('Content-Length', 0))).decode()))
+
+    def _kraken(self, form):
+        # Kraken calls, public ones come as GET from krakenex 2.2 on
+        fault = self._fault()
+        method = urlparse(self.path).path.split('/')[-1]
+        if fault == 429:
+            return self._send({'error': ['EAPI:Rate limit exceeded']})
+        if fault is not None:
+            return self._send({'error': ['EService:Unavailable']}, fault)
+        if method == 'Time':
+            result = {'unixtime': int(time.time())}
+        elif method == 'DepositMethods':
+            result = [{'method': 'SEPA', 'limit': '10000.00'}, {'method': 'SWIFT', 'limit': '50000.00'}]
+        elif method == 'WithdrawInfo':
+            result = {'method': 'Bitcoin', 'limit': '5.0', 'amount': '1', 'fee': '0.0005'}
+        elif method == 'AssetPairs':
+            # every coin trades against EUR under its symbol
+            result = dict(
+                ('{}ZEUR'.format(x['symbol']), {'base': x['symbol'], 'quote': 'ZEUR',
+                                                'wsname': '{}/EUR'.format(x['symbol'])})
+                for x in self.server.coins
+            )
+        elif method == 'Depth':
+            pair = form['pair'][0]
+            price = 1000.0 / int(pair[1:-4])
+            result = {pair: {
+                'bids': [['{:.8f}'.format(price * (1 - 0.0005 * i)), str(1 + i % 7), 0]
+                         for i in range(int(form.get('count', [100])[0]))],
+                'asks': [],
+            }}
+        else:
+            return self._send({'error': ['EGeneral:Unknown method']}, 404)
+        self._send({'error': [], 'result': result})
+
+    def do_GET(self):
+        if '/0/public/' in self.path:
+            return self._kraken(parse_qs(urlparse(self.path).query))
+        server = self.server
+        fault = self._fault()
+        if fault is not None:
+            return self._send({'error': 'injected'}, fault)
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        currency = query.get('convert', ['USD'])[0].upper()
+        parts = [x for x in url.path.split('/') if x]
+        coins = server.coins
+
+        if parts[-1] == 'convert':
+            body = dict(
+                (pair, {'val': 1.1}) for pair in query.get('q', [''])[0].split(',')
+            )
+        elif parts[-1] == 'listings':
+            body = {'data': coins}
+        elif parts[-1] == 'ticker':
+            start = int(query.get('start', [1])[0])
+            limit = int(query.get('limit', [100])[0])
+            body = {'data': dict(
+                (str(coin['id']), ticker(rank, coin, currency))
+                for rank, coin in enumerate(coins[start - 1:start - 1 + limit], start)
+            )}
+        elif parts[-2] == 'ticker':
+            rank = int(parts[-1])
+            body = {'data': ticker(rank, coins[rank - 1], currency)}
+        else:
+            self.send_error(404)
+            return
+        self._send(body)
+
+
+class StubServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, coins=2000, latency=0.02, spike_rate=0, spike_latency=0,
+                 error_rate=0, rate_limit=None):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), StubHandler)
+        self.coins = make_coins(coins)
+        self.latency = latency
+        self.spike_rate = spike_rate
+        self.spike_latency = spike_latency
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit
+        self.requests = 0
+        self.faults = 0
+        self.recent = list()
+        self.lock = threading.Lock()
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    @property
+    def base_url(self):
+        return 'http://127.0.0.1:{}/v2/'.format(self.port)
+
+    @property
+    def currency_api(self):
+        return 'http://127.0.0.1:{}/api/v6/convert'.format(self.port)
+
+    @property
+    def kraken_url(self):
+        return 'http://127.0.0.1:{}'.format(self.port)
+
+    def __enter__(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
+        self.server_close()
+
+
+def serve(conn, kwargs):
+    # Child process side of StubProcess
+    with StubServer(**kwargs) as server:
+        conn.send(server.port)
+        while True:
+            command = conn.recv()
+            if command == 'stop':
+                break
+            if command == 'reset':
+                server.requests = server.faults = 0
+            conn.send((server.requests, server.faults))
+
+
+class StubProcess(object):
+    """A StubServer in a child process with the same urls and counters."""
+
+    def __init__(self, **kwargs):
+        self.kwargs = kwargs
+
+    def __enter__(self):
+        self.conn, child = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(target=serve, args=(child, self.kwargs), daemon=True)
+        self.process.start()
+        self.port = self.conn.recv()
+        return self
+
+    def __exit__(self, *exc):
+        self.conn.send('stop')
+        self.process.join()
+
+    def counters(self, reset=False):
+        # (requests, injected faults) served so far
+        self.conn.send('reset' if reset else 'counters')
+        return self.conn.recv()
+
+    base_url = StubServer.base_url
+    currency_api = StubServer.currency_api
+    kraken_url = StubServer.kraken_url
+
+
+class WebSocketHandler(StreamRequestHandler):
+    # Just enough of RFC 6455 and the Kraken ticker feed: subscribe
+    # messages are answered with a ticker of every pair
+    def handle(self):
+        key = None
+        for line in iter(self.rfile.readline, b'\r\n'):
+            if line.lower().startswith(b'sec-websocket-key:'):
+                key = line.split(b':', 1)[1].strip()
+        accept = base64.b64encode(hashlib.sha1(key + b'258EAFA5-E914-47DA-95CA-C5AB0DC85B11').digest())
+        self.wfile.write(b'HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\n'
+                         b'Connection: Upgrade\r\nSec-WebSocket-Accept: ' + accept + b'\r\n\r\n')
+        self.pairs = set()
+        with self.server.lock:
+            self.server.clients.append(self)
+        try:
+            while True:
+                head = self.rfile.read(2)
+                if len(head) < 2 or head[0] & 0x0f == 8:
+                    return
+                length = head[1] & 0x7f
+                if length == 126:
+                    length = struct.unpack('>H', self.rfile.read(2))[0]
+                elif length == 127:
+                    length = struct.unpack('>Q', self.rfile.read(8))[0]
+                mask = self.rfile.read(4)
+                payload = bytes(x ^ mask[i % 4] for i, x in enumerate(self.rfile.read(length)))
+                for pair in json.loads(payload.decode())['pair']:
+                    self.pairs.add(pair)
+                    self.send([1, {'c': [self.server.prices[pair], '0.1']}, 'ticker', pair])
+        finally:
+            with self.server.lock:
+                self.server.clients.remove(self)
+
+    def send(self, message):
+        payload = json.dumps(message).encode()
+        if len(payload) < 126:
+            head = struct.pack('>BB', 0x81, len(payload))
+        else:
+            head = struct.pack('>BBH', 0x81, 126, len(payload))
+        with self.server.lock:
+            self.wfile.write(head + payload)
+
+
+class KrakenWebSocketStub(ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, prices):
+        ThreadingTCPServer.__init__(self, ('127.0.0.1', 0), WebSocketHandler)
+        self.prices = prices
+        self.clients = list()
+        self.lock = threading.RLock()
+
+    @property
+    def url(self):
+        return 'ws://127.0.0.1:{}'.format(self.server_address[1])
+
+    def push(self, pair, price):
+        self.prices[pair] = price
+        with self.lock:
+            for client in list(self.clients):
+                if pair in client.pairs:
+                    client.send([1, {'c': [price, '0.1']}, 'ticker', pair])
+
+    def drop(self):
+        with self.lock:
+            for client in list(self.clients):
+                client.connection.shutdown(socket.SHUT_RDWR)
+
+    def __enter__(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
+        self.server_close()
@@ -0,0 +1,155 @@
+"""End-to-end run time, request count and peak memory of madcc.
+
+Runs crypto_assets valuations of 5 to 10k coins, with both engines and
+with injected errors and rate limits, kraken_limits for several accounts,
+and a replay of recorded traffic that leaves only the client side cost.
+The apis are a StubProcess, so the numbers only cover the client. Run from
+the repository root with ``python -m benchmarks.suite``; ``--save`` writes
+the results to a json file and ``--compare`` fails when a result is worse
+than the one in such a file by more than ``--tolerance``.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import requests
+
+from benchmarks.stub_server import StubProcess
+from madcc.kraken.kraken import query_limits
+from madcc.utils.crypto_assets import AsyncCryptoAssets, CryptoAssets
+from madcc.utils.fiat_rates import FiatRates
+from madcc.utils.http import pooled_session, use_cassette
+from madcc.utils.price_sources import CoinMarketCapSource
+
+UNIVERSE = 10000
+SIZES = (5, 100, 1000, 10000)
+
+
+def crypto_data(coins):
+    # held coins spread over all ranks, plus a fiat line
+    data = [['coin-{}'.format(1 + i * UNIVERSE // coins), '1.5'] for i in range(coins)]
+    return data + [['usd', '100']]
+
+
+def valuation(base_url, currency_api, engine, coins, session=None):
+    def run():
+        http = session or pooled_session(8)
+        concurrency = 8 if engine is AsyncCryptoAssets else 1
+        ca = engine(
+            {'currency_api': currency_api}, 'eur', 2,
+            CoinMarketCapSource(base_url=base_url, session=http, concurrency=concurrency),
+            FiatRates(currency_api, session=http)
+        )
+        ca.generate_portfolio(crypto_data(coins)).render(2)
+    return run
+
+
+def kraken_limits(kraken_url, accounts, authdir):
+    def run():
+        authfiles = list()
+        for i in range(accounts):
+            path = os.path.join(authdir, 'account{}.auth'.format(i))
+            with open(path, 'w') as f:
+                f.write('key{}\nc2VjcmV0\n'.format(i))
+            authfiles.append(path)
+        rows = query_limits(authfiles, ['ZEUR', 'ZUSD'], [('XXBT', 'wallet')], api_url=kraken_url)
+        assert all(row[-1] is not False for row in rows), rows
+    return run
+
+
+def measure(run, server=None):
+    # Wall time and counters of one run, then peak memory of a second one
+    if server is not None:
+        server.counters(reset=True)
+    start = time.perf_counter()
+    run()
+    seconds = time.perf_counter() - start
+    requests_made, faults = server.counters() if server is not None else (0, 0)
+    tracemalloc.start()
+    run()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {'seconds': seconds, 'requests': requests_made, 'faults': faults, 'peak_mb': peak / 1e6}
+
+
+def scenarios(latency, sizes):
+    tmp = tempfile.mkdtemp()
+    with StubProcess(coins=UNIVERSE, latency=latency) as server:
+        for coins in sizes:
+            for engine in (CryptoAssets, AsyncCryptoAssets):
+                name = 'crypto_assets {} {}'.format('async' if engine is AsyncCryptoAssets else 'sync', coins)
+                yield name, measure(valuation(server.base_url, server.currency_api, engine, coins), server)
+
+        # record the traffic of one valuation, then replay it without a server
+        coins = sorted(sizes)[len(sizes) // 2]
+        path = os.path.join(tmp, 'cassette.json')
+        session = pooled_session(8)
+        cassette = use_cassette(session, path, 'record')
+        valuation(server.base_url, server.currency_api, CryptoAssets, coins, session)()
+        cassette.save()
+    session = requests.Session()
+    use_cassette(session, path)
+    yield 'crypto_assets replay {}'.format(coins), measure(
+        valuation(server.base_url, server.currency_api, CryptoAssets, coins, session)
+    )
+
+    with StubProcess(coins=UNIVERSE, latency=latency, error_rate=0.05, rate_limit=50) as server:
+        yield 'crypto_assets faults {}'.format(coins), measure(
+            valuation(server.base_url, server.currency_api, AsyncCryptoAssets, coins), server
+        )
+
+    with StubProcess(coins=10, latency=latency) as server:
+        for accounts in (1, 5):
+            yield 'kraken_limits {} accounts'.format(accounts), measure(
+                kraken_limits(server.kraken_url, accounts, tmp), server
+            )
+
+
+def compare(results, baseline, tolerance):
+    # Descriptions of the results worse than their baseline beyond tolerance
+    worse = list()
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        for key in ('seconds', 'peak_mb'):
+            if result[key] > base[key] * (1 + tolerance):
+                worse.append('{} {}: {:.3f} > {:.3f}'.format(name, key, result[key], base[key]))
+        if result['requests'] > base['requests']:
+            worse.append('{} requests: {} > {}'.format(name, result['requests'], base['requests']))
+    return worse
+
+
+def main():
+    parser = argparse.ArgumentParser(description='End-to-end benchmarks of madcc')
+    parser.add_argument('--sizes', default=','.join(str(x) for x in SIZES))
+    parser.add_argument('--latency', type=float, default=0.01)
+    parser.add_argument('--save')
+    parser.add_argument('--compare')
+    parser.add_argument('--tolerance', type=float, default=0.25)
+    args = parser.parse_args()
+
+    results = dict()
+    print('{:<32} {:>8} {:>8} {:>7} {:>8}'.format('', 'seconds', 'requests', 'faults', 'peak MB'))
+    for name, result in scenarios(args.latency, [int(x) for x in args.sizes.split(',')]):
+        results[name] = result
+        print('{:<32} {seconds:>8.3f} {requests:>8} {faults:>7} {peak_mb:>8.1f}'.format(name, **result))
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=1, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as f:
+            worse = compare(results, json.load(f), args.tolerance)
+        for line in worse:
+            print('REGRESSION ' + line)
+        if worse:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+"""CPU time of valuing and rendering large aggregated holdings exports.
+
+Compares the numpy column Portfolio with the previous list based table
+build, and render_table with tabulate for the resulting tables. Run from the
+repository root with ``python -m benchmarks.table_columns``.
+"""
+import timeit
+
+from tabulate import tabulate
+
+from madcc.utils.crypto_assets import CryptoAssets
+from madcc.utils.portfolio import render_table
+
+from .table_indexing import make_data
+
+
+def list_table(ca, crypto_data, ticker_data):
+    # The previous row by row build_crypto_table
+    portfolio_total = 0
+    prices = dict(
+        (x['website_slug'], x['quotes'][ca.currency.upper()]['price']) for x in ticker_data
+    )
+    table = list()
+    for symbol, amount in ca.aggregate_holdings(crypto_data).items():
+        price = prices[symbol]
+        total = amount * float(price)
+        portfolio_total += total
+        table.append([symbol, amount, price, total])
+    for idx, val in enumerate(table):
+        table[idx].insert(-2, round(val[3] / (portfolio_total / 100), 2))
+    table.sort(key=lambda x: x[4], reverse=True)
+    table.append(['total', None, None, None, portfolio_total])
+    return table
+
+
+def best(func, repeat=3):
+    return min(timeit.repeat(func, number=1, repeat=repeat))
+
+
+def main():
+    ca = CryptoAssets({'currency_api': None}, 'eur', 2, price_source=object(), fiat_rates=object())
+    print('{:>7} {:>7} {:>10} {:>10} {:>10} {:>10}'.format(
+        'lines', 'coins', 'columns s', 'lists s', 'render s', 'tabulate s'))
+    for lines, coins in ((1000, 100), (20000, 5000), (100000, 20000)):
+        crypto_data, ticker_data = make_data(lines, coins)
+        columns = best(lambda: ca.build_portfolio(crypto_data, ticker_data))
+        lists = best(lambda: list_table(ca, crypto_data, ticker_data))
+        headers, table = ca.build_crypto_table(crypto_data, ticker_data)
+        render = best(lambda: render_table(headers, table, '.2f'))
+        if len(table) <= 5000:
+            slow = '{:>10.4f}'.format(best(lambda: tabulate(table, headers=headers, floatfmt='.2f')))
+        else:
+            # takes several seconds per run
+            slow = '{:>10}'.format('-')
+        print('{:>7} {:>7} {:>10.4f} {:>10.4f} {:>10.4f} {}'.format(
+            lines, len(table) - 1, columns, lists, render, slow))
+
+
+if __name__ == '__main__':
+    main()
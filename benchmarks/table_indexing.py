@@ -0,0 +1,45 @@
+"""CPU time of build_crypto_table for growing holdings files.
+
+Compares the indexed table build with the previous per-row linear scan of
+the ticker data. Run from the repository root with
+``python -m benchmarks.table_indexing``.
+"""
+import random
+import timeit
+
+from madcc.utils.crypto_assets import CryptoAssets
+
+
+def make_data(lines, coins=2000):
+    ticker_data = [
+        {'website_slug': 'coin-{}'.format(i), 'quotes': {'EUR': {'price': 1000.0 / i}}}
+        for i in range(1, coins + 1)
+    ]
+    rng = random.Random(lines)
+    crypto_data = [['coin-{}'.format(rng.randint(1, coins)), '1.5'] for _ in range(lines)]
+    return crypto_data, ticker_data
+
+
+def linear_scan(ca, crypto_data, ticker_data):
+    # The pre-indexing lookup: scan all ticker data for every row
+    for line in crypto_data:
+        [x['quotes'][ca.currency.upper()]['price'] for x in ticker_data if x['website_slug'] == line[0]][0]
+
+
+def main():
+    ca = CryptoAssets({'currency_api': None}, 'eur', 2, price_source=object(), fiat_rates=object())
+    print('{:>8} {:>12} {:>12}'.format('lines', 'indexed s', 'scan s'))
+    for lines in (10, 1000, 100000):
+        crypto_data, ticker_data = make_data(lines)
+        indexed = min(timeit.repeat(lambda: ca.build_crypto_table(crypto_data, ticker_data), number=1, repeat=3))
+        if lines <= 1000:
+            scan = '{:>12.4f}'.format(min(timeit.repeat(
+                lambda: linear_scan(ca, crypto_data, ticker_data), number=1, repeat=3)))
+        else:
+            # would take minutes
+            scan = '{:>12}'.format('-')
+        print('{:>8} {:>12.4f} {}'.format(lines, indexed, scan))
+
+
+if __name__ == '__main__':
+    main()
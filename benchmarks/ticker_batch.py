@@ -0,0 +1,40 @@
+"""Wall-clock time of per-coin vs batched ticker retrieval.
+
+Run from the repository root with ``python -m benchmarks.ticker_batch``.
+"""
+import time
+
+import requests
+
+from benchmarks.stub_server import StubServer
+from madcc.utils.price_sources import CoinMarketCapSource
+
+
+def per_coin(source, slugs, currency):
+    # The pre-batching behaviour: listings plus one ticker call per coin
+    ids = [x['id'] for x in source.listings() if x['website_slug'] in slugs]
+    return [source._get('ticker/{}/'.format(i), params={'convert': currency})['data'] for i in ids]
+
+
+def batched(source, slugs, currency):
+    return source.quotes(slugs, currency)
+
+
+def main():
+    with StubServer(coins=2000, latency=0.02) as server:
+        source = CoinMarketCapSource(base_url=server.base_url, session=requests.Session())
+        print('{:>6} {:>12} {:>6} {:>12} {:>6}'.format('coins', 'per-coin s', 'reqs', 'batched s', 'reqs'))
+        for count in (5, 10, 30, 60, 120):
+            # held coins spread over the top 300 ranks
+            slugs = ['coin-{}'.format(1 + i * 300 // count) for i in range(count)]
+            results = list()
+            for func in (per_coin, batched):
+                server.requests = 0
+                start = time.perf_counter()
+                func(source, slugs, 'eur')
+                results += [time.perf_counter() - start, server.requests]
+            print('{:>6} {:>12.3f} {:>6} {:>12.3f} {:>6}'.format(count, *results))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,33 @@
+"""Cost of traced calls with tracing disabled and enabled.
+
+Times a trivial function called directly, through ``traced`` with the
+tracer disabled and with it enabled. Run from the repository root with
+``python -m benchmarks.tracing_overhead``.
+"""
+import timeit
+
+from madcc.utils.tracing import TRACER, traced
+
+
+def work(x):
+    return x + 1
+
+
+traced_work = traced('work')(work)
+
+
+def main():
+    number = 1000000
+    plain = timeit.timeit(lambda: work(1), number=number)
+    TRACER.enabled = False
+    disabled = timeit.timeit(lambda: traced_work(1), number=number)
+    TRACER.enabled = True
+    enabled = timeit.timeit(lambda: traced_work(1), number=number)
+    TRACER.enabled = False
+    print('{:>10} {:>10}'.format('', 'ns/call'))
+    for name, seconds in (('plain', plain), ('disabled', disabled), ('enabled', enabled)):
+        print('{:>10} {:>10.0f}'.format(name, 1e9 * seconds / number))
+
+
+if __name__ == '__main__':
+    main()
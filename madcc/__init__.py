@@ -1 +1,8 @@
-from . import kraken
+import importlib
+
+
+def __getattr__(name):
+    # Import subpackages on first use so importing madcc stays cheap
+    if name in ('kraken', 'utils'):
+        return importlib.import_module('.' + name, __name__)
+    raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
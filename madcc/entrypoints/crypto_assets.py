@@ -1,15 +1,170 @@
 #!/usr/bin/env python
-from ..utils.crypto_assets import CryptoAssets, CURRENCIES
-
+import functools
 import json
 import sys
+import time
+from collections import OrderedDict
 
 from clint import resources
 from clint.arguments import Args
-from tabulate import tabulate
+
+USAGE = """usage: crypto_assets [--currency CUR[,CUR...] | CUR] [--max-age SECONDS] [--offline]
+                     [--async] [--kraken] [--record] [--format json|ndjson|csv]
+                     [--watch SECONDS | --serve PORT] [--profile [text|json|prometheus]]
+                     [--liquidation]
+       crypto_assets history [--currency CUR] [--period hourly|daily] [--days DAYS]
+       crypto_assets batch DIR|GLOB... [--currency CUR] [--processes N]
+
+Look up the value of the crypto assets listed in the crypto notes file, or
+with --kraken of the balances of the Kraken account, synced to a local store.
+With --record every valuation is added to the history of its currency, which
+the history command reports returns, drawdowns and allocation drift of.
+--format streams the assets of a single currency as soon as they are priced,
+in order of arrival and without percentages, ending with the total; coins
+that cannot be priced are left out of it and reported on stderr.
+The batch command values every crypto file in the directories or matching
+the globs with one set of prices, and totals them.
+--liquidation adds what selling every coin into the bids of its Kraken order
+book would realize, and the slippage against its price, to the table of a
+single currency. Coins Kraken has no market for count at their price.
+--profile prints the time spent in the hot paths and the http traffic per
+host to stderr when done, with --serve the server exposes them on /trace."""
+
+
+def watch(ca, interval, iterations=None, history=None):
+    # Refresh the table every interval seconds, only printing the rows that
+    # changed since the previous refresh. The crypto file is only re-parsed
+    # when it changed and only quotes past their ttl are fetched again.
+    # Every refresh is recorded when a history store is given.
+    import requests
+    from ..utils.portfolio import render_table
+
+    previous = dict()
+    count = 0
+    while iterations is None or count < iterations:
+        if count:
+            time.sleep(interval)
+        count += 1
+        crypto_data = ca.parse_crypto_file()
+        if not crypto_data:
+            continue
+        try:
+            headers, crypto_table = ca.generate_crypto_table(crypto_data)
+        except (requests.RequestException, ValueError) as e:
+            # network errors, failing price sources or missing exchange
+            # rates, the next refresh tries again
+            print('Unable to refresh prices: {}'.format(e))
+            continue
+        except KeyError as e:
+            print('Unable to refresh prices: no price for {}'.format(e.args[0]))
+            continue
+        ca.cache.save()
+        if history is not None:
+            history.record(crypto_table)
+        changed = [row for row in crypto_table if previous.get(row[0]) != row]
+        previous = dict((row[0], row) for row in crypto_table)
+        if changed:
+            print(time.strftime('%Y-%m-%d %H:%M:%S'))
+            print(render_table(headers, changed, '.{}f'.format(ca.decimals)))
+
+
+def tee_rows(rows, kept):
+    # Pass rows on while keeping them
+    for row in rows:
+        kept.append(row)
+        yield row
+
+
+def history_report(store, period='daily', days=None, decimals=2):
+    # Summary and allocation tables of the recorded history of a currency
+    from tabulate import tabulate
+    from ..utils.history import analyze, resample
+
+    times, symbols, columns = store.read()
+    if not len(times):
+        return 'No history recorded yet, run crypto_assets with --record'
+    times, totals = resample(times, columns['total'], period)
+    since = times[-1] - days * 86400 if days is not None else None
+    result = analyze(times, symbols, totals, since)
+    if result is None:
+        return 'Not enough {} snapshots to compare'.format(period)
+    stats, allocation = result
+
+    summary = [
+        ['period', '{} - {}'.format(
+            time.strftime('%Y-%m-%d %H:%M', time.localtime(stats['start'])),
+            time.strftime('%Y-%m-%d %H:%M', time.localtime(stats['end'])))],
+        ['start value', '{:.{}f}'.format(stats['start value'], decimals)],
+        ['end value', '{:.{}f}'.format(stats['end value'], decimals)],
+    ]
+    for key in ('return %', 'volatility %', 'max drawdown %', 'current drawdown %'):
+        summary.append([key, '{:.2f}'.format(stats[key])])
+    allocation.sort(key=lambda x: x[2], reverse=True)
+    return '\n\n'.join([
+        tabulate(summary),
+        tabulate(allocation, headers=['symbol', 'start %', 'end %', 'drift %', 'max deviation %'],
+                 floatfmt='.2f'),
+    ])
+
+
+def batch_report(valuation, decimals=2):
+    # The table of every valued file, the table of all of them together,
+    # then the files that could not be valued
+    parts = ['{}\n{}'.format(path, portfolio.render(decimals))
+             for path, portfolio in valuation.portfolios.items()]
+    if valuation.total is not None:
+        parts.append('all {} files\n{}'.format(len(valuation.portfolios), valuation.total.render(decimals)))
+    parts.extend('{}: {}'.format(path, error) for path, error in valuation.errors.items())
+    return '\n\n'.join(parts)
+
+
+def get_decimals(currency):
+    if currency.lower() == 'btc':
+        return 10
+    else:
+        return 2
 
 
 def main():
+    args = Args()
+    if '--help' in args.grouped or '-h' in args.grouped:
+        return USAGE
+
+    # numpy, krakenex, requests, websocket and tabulate are only imported
+    # when actually needed, keeping --help fast
+    from ..utils.tracing import TRACER, export, profile_format
+
+    profile = profile_format(args)
+    if profile is None:
+        return run(args)
+    TRACER.enabled = True
+    try:
+        return run(args)
+    finally:
+        sys.stderr.write(export(profile) + '\n')
+
+
+def run(args):
+    import requests
+    from ..kraken import KrakenStore, KrakenUtils
+    from ..kraken.stream import KrakenTickerStream
+    from ..utils.batch import find_crypto_files, value_crypto_files
+    from ..utils.cache import DiskCache
+    from ..utils.crypto_assets import AsyncCryptoAssets, CryptoAssets, CURRENCIES
+    from ..utils.fiat_rates import FiatRates
+    from ..utils.formats import FORMATS, write_rows
+    from ..utils.history import HistoryStore
+    from ..utils.http import pooled_session
+    from ..utils.listings_index import ListingsIndex
+    from ..utils.portfolio import render_table
+    from ..utils.portfolio_server import PortfolioServer, PortfolioService
+    from ..utils.price_sources import (CachedPriceSource, CoinMarketCapSource, FileSource,
+                                       HedgedPriceSource, KrakenSource, KrakenStreamSource)
+
+    fmt = next(iter(args.grouped.get('--format', [])), None)
+    if fmt is not None and fmt not in FORMATS:
+        return USAGE
+
     resources.init('madtech', 'madcc')
     if not resources.user.read('config.json'):
         config = dict()
@@ -17,6 +172,15 @@ def main():
         config['crypto_assets']['crypto_file'] = resources.user.path + '/crypto.txt'
         config['crypto_assets']['currency'] = 'eur'
         config['crypto_assets']['currency_api'] = 'https://free.currencyconverterapi.com/api/v6/convert'
+        config['crypto_assets']['cache_size'] = 5000
+        config['crypto_assets']['listings_ttl'] = 86400
+        config['crypto_assets']['quotes_ttl'] = 300
+        config['crypto_assets']['rates_ttl'] = 3600
+        config['crypto_assets']['concurrency'] = 8
+        config['crypto_assets']['retries'] = 3
+        config['crypto_assets']['timeout'] = 30
+        config['crypto_assets']['price_sources'] = ['coinmarketcap', 'kraken']
+        config['crypto_assets']['hedge_after'] = 1.0
 
         configfile = resources.user.open('config.json', 'w')
         configfile.write(json.dumps(config, sort_keys=True, indent=4))
@@ -24,27 +188,202 @@ def main():
         configfile = resources.user.open('config.json', 'r')
         config = json.loads(configfile.read())
 
-    args = Args()
-
-    if next(iter(args.grouped.get('--currency', [])), '').upper() in CURRENCIES:
-        currency = next(iter(args.grouped.get('--currency', [])), '')
+    currencies = next(iter(args.grouped.get('--currency', [])), '').split(',')
+    if all(x.upper() in CURRENCIES for x in currencies):
+        currency = currencies[0]
     elif str(args.last or '').upper() in CURRENCIES:
         currency = args.last
+        currencies = [currency]
     else:
         currency = config['crypto_assets']['currency'].lower()
+        currencies = [currency]
+
+    decimals = get_decimals(currency)
+    history_path = '{}/history/{}'.format(resources.user.path, currency.lower())
+
+    if args.get(0) == 'history':
+        days = next(iter(args.grouped.get('--days', [])), None)
+        return history_report(
+            HistoryStore(history_path),
+            next(iter(args.grouped.get('--period', [])), 'daily'),
+            float(days) if days is not None else None,
+            decimals
+        )
+
+    history = None
+    if '--record' in args.grouped or config['crypto_assets'].get('record_history'):
+        history = HistoryStore(history_path)
+
+    offline = '--offline' in args.grouped
+    use_async = '--async' in args.grouped
+    concurrency = config['crypto_assets'].get('concurrency', 8)
+    timeout = config['crypto_assets'].get('timeout', 30)
+    max_age = next(iter(args.grouped.get('--max-age', [])), None)
+    if max_age is not None:
+        max_age = int(max_age)
+    else:
+        max_age = config['crypto_assets'].get('quotes_ttl', 300)
 
-    if currency == 'btc':
-        decimals = 10
+    cache = DiskCache(
+        resources.user.path + '/cache.json',
+        config['crypto_assets'].get('cache_size', 5000)
+    )
+    session = pooled_session(concurrency, config['crypto_assets'].get('retries', 3))
+    kraken = KrakenSource(
+        session=session, timeout=timeout, cache=cache,
+        asset_map=config['crypto_assets'].get('kraken_assets')
+    )
+    backends = {
+        'coinmarketcap': CoinMarketCapSource(
+            session=session, timeout=timeout, cache=cache,
+            listings_ttl=config['crypto_assets'].get('listings_ttl', 86400),
+            concurrency=concurrency if use_async else 1,
+            index=ListingsIndex(resources.user.path + '/listings.idx')
+        ),
+        'kraken': kraken,
+        # pushed prices, only connects when used
+        'kraken_stream': KrakenStreamSource(
+            kraken, KrakenTickerStream(timeout=timeout),
+            max_age=config['crypto_assets'].get('stream_max_age', 60)
+        ),
+        'file': FileSource(config['crypto_assets'].get('price_file', resources.user.path + '/prices.json')),
+    }
+    names = config['crypto_assets'].get('price_sources', ['coinmarketcap'])
+    unknown = [x for x in names if x not in backends]
+    if unknown or not names:
+        return 'Unknown price sources: {}, use {}'.format(', '.join(unknown), ', '.join(sorted(backends)))
+    if len(names) > 1:
+        source = HedgedPriceSource(
+            [backends[x] for x in names], hedge_after=config['crypto_assets'].get('hedge_after', 1.0)
+        )
     else:
-        decimals = 2
+        source = backends[names[0]]
+    # the stream is live already, a quote cache in front of it would only
+    # serve its prices up to quotes_ttl late
+    if offline or 'kraken_stream' not in names:
+        price_source = CachedPriceSource(source, cache, ttl=max_age, offline=offline)
+    else:
+        price_source = source
+    fiat_rates = FiatRates(
+        config['crypto_assets']['currency_api'], session=session, timeout=timeout,
+        cache=cache, ttl=config['crypto_assets'].get('rates_ttl', 3600), offline=offline,
+        fallback=kraken if 'kraken' in names or 'kraken_stream' in names else None
+    )
+
+    if use_async:
+        engine = functools.partial(AsyncCryptoAssets, concurrency=concurrency)
+    else:
+        engine = CryptoAssets
+    ca = engine(config['crypto_assets'], currency, decimals, price_source, fiat_rates, cache)
+
+    if args.get(0) == 'batch':
+        if fmt is not None or len(currencies) > 1:
+            return 'Batch valuations are tables of a single currency'
+        paths = list(OrderedDict.fromkeys(
+            path for pattern in args.grouped['_'].all[1:] for path in find_crypto_files(pattern)
+        ))
+        if not paths:
+            return 'No crypto files found'
+        processes = next(iter(args.grouped.get('--processes', [])), None)
+        try:
+            valuation = value_crypto_files(
+                ca, paths, config['crypto_assets'].get('crypto_sections'),
+                int(processes) if processes is not None else None
+            )
+        except (requests.RequestException, ValueError) as e:
+            cache.save()
+            return 'Unable to retrieve prices: {}'.format(e)
+        cache.save()
+        return batch_report(valuation, decimals)
+
+    port = next(iter(args.grouped.get('--serve', [])), None)
+    if port is not None:
+        service = PortfolioService(
+            lambda currency: engine(config['crypto_assets'], currency, get_decimals(currency),
+                                    price_source, fiat_rates, cache),
+            max_age=max_age
+        )
+        server = PortfolioServer(
+            (config['crypto_assets'].get('server_host', '127.0.0.1'), int(port)), service, currency
+        )
+        print('Serving on http://{}:{}/portfolio/{}'.format(server.server_address[0], server.server_address[1], currency))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+        return None
 
-    ca = CryptoAssets(config['crypto_assets'], currency, decimals)
-    crypto_data = ca.parse_crypto_file()
+    interval = next(iter(args.grouped.get('--watch', [])), None)
+    if interval is not None:
+        try:
+            watch(ca, float(interval), history=history)
+        except KeyboardInterrupt:
+            pass
+        return None
+
+    liquidation = '--liquidation' in args.grouped
+    if liquidation and (fmt is not None or len(currencies) > 1):
+        return 'Liquidation values are only shown in tables of a single currency'
+
+    if '--kraken' in args.grouped:
+        store = KrakenStore(resources.user.path + '/kraken.sqlite')
+        if not offline:
+            KrakenUtils().sync(store)
+        crypto_data = ca.kraken_holdings(store)
+        store.close()
+    else:
+        crypto_data = ca.parse_crypto_file()
     if not crypto_data:
         return False
 
-    headers, crypto_table = ca.generate_crypto_table(crypto_data)
-    return tabulate(crypto_table, headers=headers, floatfmt='.{}f'.format(decimals))
+    if fmt is not None:
+        if len(currencies) > 1:
+            return 'Only one currency can be used with --format'
+        valuations = list()
+        rows = ca.iter_valuations(crypto_data)
+        try:
+            write_rows(rows if history is None else tee_rows(rows, valuations), fmt, currency, sys.stdout)
+        except KeyError as e:
+            # the output is finished with the total of the priced assets,
+            # an incomplete snapshot is not worth recording
+            sys.stderr.write('Unable to price {}\n'.format(e.args[0]))
+            history = None
+        except (requests.RequestException, ValueError) as e:
+            sys.stderr.write('Unable to retrieve prices: {}\n'.format(e))
+            history = None
+        if history is not None:
+            history.record([[symbol, amount, None, price, total] for symbol, amount, price, total in valuations])
+        cache.save()
+        return None
+
+    try:
+        if len(currencies) > 1:
+            headers, crypto_table = ca.generate_multi_currency_table(crypto_data, currencies)
+        elif liquidation:
+            headers, crypto_table = ca.generate_crypto_table(crypto_data, kraken)
+        else:
+            headers, crypto_table = ca.generate_crypto_table(crypto_data)
+    except KeyError as e:
+        # coins none of the price sources know, e.g. new Kraken assets
+        # without a kraken_assets mapping
+        cache.save()
+        return 'Unable to price {}'.format(e.args[0])
+    except (requests.RequestException, ValueError) as e:
+        # network errors, failing price sources or missing exchange rates
+        cache.save()
+        return 'Unable to retrieve prices: {}'.format(e)
+    if len(currencies) > 1:
+        floatfmt = ['', '.{}f'.format(max(get_decimals(x) for x in currencies)), '.2f']
+        for x in currencies:
+            floatfmt += ['.{}f'.format(get_decimals(x))] * 2
+    else:
+        floatfmt = '.{}f'.format(decimals)
+        if history is not None:
+            history.record(crypto_table)
+    cache.save()
+    return render_table(headers, crypto_table, floatfmt)
 
 
 if __name__ == "__main__":  # pragma: no cover
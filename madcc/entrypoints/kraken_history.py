@@ -0,0 +1,57 @@
+import sys
+
+from clint.arguments import Args
+
+USAGE = """usage: kraken_history PAIR... [--dir DIR] [--interval MINUTES[,MINUTES...]]
+                      [--since TIMESTAMP] [--no-trades] [--concurrency N]
+                      [--profile [text|json|prometheus]]
+
+Download the public trade and candle history of Kraken pairs, such as XBTEUR,
+into compressed series under DIR, by default the madcc user directory. Runs
+resume where the last one stopped and only fetch newer data. The first run
+downloads all trades of a pair, or those since the unix TIMESTAMP. Kraken serves
+just the last 720 candles of an interval, so --interval downloads are only
+complete when run at least that often."""
+
+
+def main():
+    args = Args()
+    if '--help' in args.grouped or '-h' in args.grouped or not args.grouped['_'].all:
+        return USAGE
+
+    from ..utils.tracing import TRACER, export, profile_format
+
+    profile = profile_format(args)
+    if profile is None:
+        return history(args)
+    TRACER.enabled = True
+    try:
+        return history(args)
+    finally:
+        sys.stderr.write(export(profile) + '\n')
+
+
+def history(args):
+    from clint import resources
+    from tabulate import tabulate
+    from ..kraken.market import KrakenDownloader
+
+    root = next(iter(args.grouped.get('--dir', [])), None)
+    if root is None:
+        resources.init('madtech', 'madcc')
+        root = resources.user.path + '/market'
+    intervals = [int(x) for x in next(iter(args.grouped.get('--interval', [])), '1').split(',')]
+    concurrency = int(next(iter(args.grouped.get('--concurrency', [])), 4))
+    since = int(next(iter(args.grouped.get('--since', [])), 0))
+    pairs = list(args.grouped['_'].all)
+
+    downloader = KrakenDownloader(root, concurrency=concurrency, since=since)
+    added = downloader.download(pairs, '--no-trades' not in args.grouped, intervals)
+    return tabulate(
+        [(pair, series, count) for pair in pairs for series, count in sorted(added[pair].items())],
+        headers=['pair', 'series', 'new rows']
+    )
+
+
+if __name__ == "__main__":  # pragma: no cover
+    print(main())
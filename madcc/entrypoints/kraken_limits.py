@@ -1,13 +1,57 @@
-from ..kraken.kraken import KrakenUtils
+import os
+import sys
+
+from clint.arguments import Args
+
+USAGE = """usage: kraken_limits [--auth FILE...] [--deposit ASSET,...] [--withdraw ASSET:KEY,...]
+                     [--account-concurrency N] [--profile [text|json|prometheus]]
+
+Show the current deposit and withdraw limits on Kraken. --profile prints the
+time spent in every Kraken query and the http traffic to stderr when done."""
 
 
 def main(authfile=None):
-    k = KrakenUtils(authfile=authfile)
-    deposit_limit = k.deposit_limit()
-    withdraw_limit = k.withdraw_limit()
+    args = Args()
+    if '--help' in args.grouped or '-h' in args.grouped:
+        return USAGE
+
+    # krakenex, requests and tabulate are only imported when actually
+    # needed, keeping --help fast
+    from ..utils.tracing import TRACER, export, profile_format
+
+    profile = profile_format(args)
+    if profile is None:
+        return limits(args, authfile)
+    TRACER.enabled = True
+    try:
+        return limits(args, authfile)
+    finally:
+        sys.stderr.write(export(profile) + '\n')
+
+
+def limits(args, authfile=None):
+    from tabulate import tabulate
+    from ..kraken.kraken import query_limits
+
+    authfiles = [authfile] if authfile else list(args.grouped.get('--auth', [])) or [None]
+    deposits = next(iter(args.grouped.get('--deposit', [])), 'ZEUR').split(',')
+    withdrawals = [
+        tuple(x.split(':', 1))
+        for x in next(iter(args.grouped.get('--withdraw', [])), 'XXBT:gdax').split(',')
+    ]
+    concurrency = int(next(iter(args.grouped.get('--account-concurrency', [])), 1))
+
+    rows = query_limits(authfiles, deposits, withdrawals, concurrency)
+    if len(authfiles) == 1 and deposits == ['ZEUR'] and withdrawals == [('XXBT', 'gdax')]:
+        deposit_limit = rows[0][4]
+        withdraw_limit = rows[-1][4]
+        return 'deposit max: {} EUR\nwithdraw max: {} BTC'.format(deposit_limit,
+                                                                  withdraw_limit)
 
-    return 'deposit max: {} EUR\nwithdraw max: {} BTC'.format(deposit_limit,
-                                                              withdraw_limit)
+    return tabulate(
+        [(os.path.basename(x[0] or 'kraken.auth'),) + tuple(x[1:]) for x in rows],
+        headers=['account', 'type', 'asset', 'method', 'limit']
+    )
 
 
 if __name__ == "__main__":  # pragma: no cover
@@ -1 +1,2 @@
 from .kraken import KrakenUtils
+from .store import KrakenStore
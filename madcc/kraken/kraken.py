@@ -1,26 +1,173 @@
 #!/usr/bin/env python
 
-import json
 import os
+import random
 import sys
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 
 import krakenex
 import requests
 from clint import resources
 
+from ..utils.http import pooled_session
+from ..utils.tracing import instrument, span
+
+# Private call counter limit and decay per second for each verification tier,
+# and a conservative model of the roughly one call per second public limit
+RATE_TIERS = {
+    'starter': (15, 0.33),
+    'intermediate': (20, 0.5),
+    'pro': (20, 1.0),
+    'public': (5, 1.0),
+}
+# Calls that increase the counter by more than the default of 1
+CALL_COSTS = {
+    'Ledgers': 2,
+    'QueryLedgers': 2,
+    'TradesHistory': 2,
+    'QueryTrades': 2,
+}
+# Errors worth retrying, anything else is returned to the caller as is
+RETRY_ERRORS = (
+    'EAPI:Rate limit exceeded',
+    'EGeneral:Temporary lockout',
+    'EService:Unavailable',
+    'EService:Busy',
+)
+
+
+class KrakenScheduler(object):
+    """Pace and retry kraken api calls.
+
+    Private calls are delayed so the modelled call counter of the api key
+    never exceeds the limit of its tier. Failed calls are retried with
+    exponential backoff and full jitter, and calls, retries, errors and
+    total latency are recorded per endpoint in ``stats``.
+    """
+
+    def __init__(self, tier='starter', backoff=0.5, max_backoff=30,
+                 clock=time.monotonic, sleep=time.sleep):
+        self.max_counter, self.decay = RATE_TIERS[tier]
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.clock = clock
+        self.sleep = sleep
+        self.counter = 0
+        self.updated = clock()
+        self.stats = defaultdict(lambda: {'calls': 0, 'retries': 0, 'errors': 0, 'latency': 0.0})
+        self._lock = threading.Lock()
+
+    def acquire(self, method):
+        # Reserve room for a private call, waiting until the counter has
+        # decayed far enough to fit it
+        cost = CALL_COSTS.get(method, 1)
+        with self._lock:
+            now = self.clock()
+            self.counter = max(0, self.counter - (now - self.updated) * self.decay)
+            self.updated = now
+            self.counter += cost
+            wait = (self.counter - self.max_counter) / self.decay
+        if wait > 0:
+            self.sleep(wait)
+
+    def _count(self, method, key, value=1):
+        # the scheduler is shared by thread pools, so stats are updated
+        # under the lock like the counter
+        with self._lock:
+            self.stats[method][key] += value
+
+    def call(self, query, method, data=None, private=True, retry=5):
+        res = None
+        for attempt in range(0, retry):
+            if attempt:
+                self._count(method, 'retries')
+                self.sleep(random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt)))
+            if private:
+                self.acquire(method)
+            self._count(method, 'calls')
+            start = self.clock()
+            try:
+                # krakenex adds the nonce to data, so hand it a fresh copy
+                res = query(method, dict(data or {}))
+            except (ValueError, requests.RequestException):
+                res = None
+            finally:
+                self._count(method, 'latency', self.clock() - start)
+
+            if res is None:
+                self._count(method, 'errors')
+                continue
+            if not res['error']:
+                return res
+            self._count(method, 'errors')
+            if 'EAPI:Rate limit exceeded' in res['error']:
+                # our model drifted from the real counter, assume it is full
+                with self._lock:
+                    self.counter = self.max_counter
+            if not any(x in RETRY_ERRORS for x in res['error']):
+                return res
+
+        return res
+
+
+class NonceCounter(object):
+    """Strictly increasing nonces based on the time in ms.
+
+    krakenex uses the plain time in ms, which repeats when calls are made
+    from several threads within the same ms. Kraken checks nonces per api
+    key, so every KrakenUtils of a key shares one counter, see ``nonces``.
+    """
+
+    def __init__(self):
+        self.last = 0
+        self._lock = threading.Lock()
+
+    def __call__(self):
+        with self._lock:
+            self.last = max(self.last + 1, int(1000 * time.time()))
+            return self.last
+
+
+_nonces = dict()
+_schedulers = dict()
+_shared_lock = threading.Lock()
+
+
+def nonces(api_key):
+    # The NonceCounter of an api key
+    with _shared_lock:
+        return _nonces.setdefault(api_key, NonceCounter())
+
+
+def schedulers(api_key):
+    # The KrakenScheduler of an api key; Kraken keeps one call counter per
+    # key, so every KrakenUtils of the key paces its calls on the same model
+    with _shared_lock:
+        if api_key not in _schedulers:
+            _schedulers[api_key] = KrakenScheduler()
+        return _schedulers[api_key]
+
 
 class KrakenUtils(object):
-    def __init__(self, authfile=None):
+    def __init__(self, authfile=None, session=None, scheduler=None, api_url=None):
         self._auth_file = authfile
         self._set_auth()
         if not self.api_key or not self.api_secret:
             print('No api key or secret found')
             sys.exit(1)
         self.api = krakenex.API(key=self.api_key, secret=self.api_secret)
-        if not self.api_live():
-            # TODO: use logging instead of print
-            print('Kraken API failure')
-            sys.exit(1)
+        if api_url is not None:
+            self.api.uri = api_url
+        if session is not None:
+            session.headers.update(self.api.session.headers)
+            self.api.session = session
+        instrument(self.api.session)
+        self.api._nonce = nonces(self.api_key)
+        self.scheduler = scheduler or schedulers(self.api_key)
+        self._live_checked = False
 
     # def _init_auth_file(self):
     #     """Create default auth file if it does not exist."""
@@ -51,38 +198,133 @@ class KrakenUtils(object):
                 self.api_key, self.api_secret = resources.user.read('kraken.auth').splitlines()
 
     def api_live(self):
-        res = self.api.query_public('Time')
+        try:
+            with span('kraken.Time'):
+                res = self.api.query_public('Time')
+        except (ValueError, requests.RequestException):
+            return False
         if res['error']:
             return False
         else:
             return True
 
-    def deposit_limit(self, retry=5):
-        for i in range(0, retry):
-            try:
-                res = self.api.query_private('DepositMethods', {'asset': 'ZEUR'})
-            except json.decoder.JSONDecodeError as err:
-                continue
-            else:
-                if res['error']:
-                    # print(','.join(res['error']))
-                    continue
-                limit = res['result'][0]['limit']
-                return limit
+    def query_private(self, method, data=None, retry=5):
+        # Scheduled private query, returns False when it did not succeed.
+        # Rather than probing the api before every run, only the first
+        # failing call checks whether the api is up at all.
+        with span('kraken.' + method):
+            res = self.scheduler.call(self.api.query_private, method, data, retry=retry)
+        if not res or res['error']:
+            # TODO: use logging instead of print
+            # print(','.join(res['error']))
+            if not self._live_checked:
+                self._live_checked = True
+                if not self.api_live():
+                    print('Kraken API failure')
+                    sys.exit(1)
+            return False
+        self._live_checked = True
+        return res
 
-        return False
+    def deposit_limit(self, retry=5, asset='ZEUR'):
+        res = self.deposit_limits(asset, retry)
+        if not res:
+            return False
+        return res[0][1]
 
-    def withdraw_limit(self, retry=5):
-        for i in range(0, retry):
-            try:
-                res = self.api.query_private('WithdrawInfo', {'asset': 'XXBT', 'key': 'gdax', 'amount': 1})
-            except json.decoder.JSONDecodeError as err:
-                continue
-            else:
-                if res['error']:
-                    # print(','.join(res['error']))
-                    continue
-                limit = res['result']['limit']
-                return limit
-
-        return False
+    def deposit_limits(self, asset, retry=5):
+        # List of (method, limit) for every deposit method of asset
+        res = self.query_private('DepositMethods', {'asset': asset}, retry)
+        if not res:
+            return False
+        return [(x.get('method'), x['limit']) for x in res['result']]
+
+    def withdraw_limit(self, retry=5, asset='XXBT', key='gdax'):
+        res = self.query_private('WithdrawInfo', {'asset': asset, 'key': key, 'amount': 1}, retry)
+        if not res:
+            return False
+        return res['result']['limit']
+
+    def sync(self, store):
+        # Incrementally copy balances, ledger entries and trades into a
+        # KrakenStore, returns the number of new entries per table
+        res = self.query_private('Balance')
+        if res:
+            store.set_balances(res['result'])
+        return {
+            'ledger': self._sync_pages(store, 'Ledgers', 'ledger', 'ledger'),
+            'trades': self._sync_pages(store, 'TradesHistory', 'trades', 'trades'),
+        }
+
+    def _sync_pages(self, store, method, key, table):
+        # Entries come newest first in pages of 50, only those after the
+        # stored cursor are requested and each page is written as it
+        # arrives. The cursor moves to the newest entry once all pages are
+        # in, so an interrupted sync simply starts over.
+        cursor = store.cursor(table)
+        newest = None
+        added = 0
+        ofs = 0
+        while True:
+            data = {'ofs': ofs}
+            if cursor:
+                data['start'] = cursor
+            res = self.query_private(method, data)
+            if not res:
+                return False
+            entries = res['result'][key]
+            if not entries:
+                break
+            if newest is None:
+                newest = max(entries, key=lambda x: entries[x]['time'])
+            added += store.add(table, entries)
+            ofs += len(entries)
+            if ofs >= res['result']['count']:
+                break
+
+        if newest is not None:
+            store.set_cursor(table, newest)
+        return added
+
+
+def query_limits(authfiles, deposits=('ZEUR',), withdrawals=(('XXBT', 'gdax'),),
+                 account_concurrency=1, session=None, api_url=None):
+    """Query deposit and withdraw limits of several accounts in parallel.
+
+    Returns rows of (authfile, 'deposit' or 'withdraw', asset, method or
+    withdrawal key, limit). All accounts share one session and talk to
+    ``api_url`` instead of the Kraken api if it is given. Every account
+    runs at most ``account_concurrency`` queries at a time; raise it only
+    for api keys with a nonce window, as parallel calls on one key can
+    arrive with out of order nonces. For the same reason auth files of the
+    same api key are queried one after the other.
+    """
+    session = session or pooled_session(max(1, len(authfiles) * account_concurrency))
+    accounts = [KrakenUtils(authfile, session=session, api_url=api_url) for authfile in authfiles]
+    by_key = dict()
+    for authfile, account in zip(authfiles, accounts):
+        by_key.setdefault(account.api_key, []).append((authfile, account))
+
+    def key_limits(group):
+        return [row for authfile, account in group for row in account_limits(authfile, account)]
+
+    def account_limits(authfile, account):
+        with ThreadPoolExecutor(account_concurrency) as pool:
+            deposit_jobs = [(asset, pool.submit(account.deposit_limits, asset)) for asset in deposits]
+            withdraw_jobs = [
+                (asset, key, pool.submit(account.withdraw_limit, 5, asset, key))
+                for asset, key in withdrawals
+            ]
+            rows = list()
+            for asset, future in deposit_jobs:
+                for method, limit in future.result() or [(None, False)]:
+                    rows.append((authfile, 'deposit', asset, method, limit))
+            for asset, key, future in withdraw_jobs:
+                rows.append((authfile, 'withdraw', asset, key, future.result()))
+        return rows
+
+    with ThreadPoolExecutor(max(1, len(by_key))) as pool:
+        rows = [row for group in pool.map(key_limits, by_key.values()) for row in group]
+    # in the order of authfiles, whatever the grouping
+    order = dict((authfile, index) for index, authfile in reversed(list(enumerate(authfiles))))
+    return sorted(rows, key=lambda row: order[row[0]])
@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import krakenex
+import numpy as np
+
+from ..utils.series import SeriesStore
+from ..utils.tracing import instrument, span
+from .kraken import KrakenScheduler
+
+TRADE_DTYPE = np.dtype([
+    ('time', '<f8'),
+    ('price', '<f8'),
+    ('volume', '<f8'),
+    ('id', '<u8'),
+    ('side', 'u1'),
+    ('type', 'u1'),
+])
+OHLC_DTYPE = np.dtype([
+    ('time', '<f8'),
+    ('open', '<f8'),
+    ('high', '<f8'),
+    ('low', '<f8'),
+    ('close', '<f8'),
+    ('vwap', '<f8'),
+    ('volume', '<f8'),
+    ('count', '<u4'),
+])
+# Trades returns at most this many trades per call
+TRADES_PAGE = 1000
+
+
+def trade_rows(trades):
+    # [price, volume, time, b/s, m/l, misc(, trade id)] lists as records
+    rows = np.zeros(len(trades), TRADE_DTYPE)
+    for i, x in enumerate(trades):
+        rows[i] = (x[2], x[0], x[1], x[6] if len(x) > 6 else 0, x[3] == 's', x[4] == 'l')
+    return rows
+
+
+def ohlc_rows(candles):
+    # [time, open, high, low, close, vwap, volume, count] lists as records
+    rows = np.zeros(len(candles), OHLC_DTYPE)
+    for i, x in enumerate(candles):
+        rows[i] = tuple(float(y) for y in x[:7]) + (x[7],)
+    return rows
+
+
+class KrakenDownloader(object):
+    """Keep local copies of the public Kraken trade and candle history.
+
+    Every pair gets a SeriesStore per series under ``root``: ``trades`` and
+    ``ohlc-<interval>``. Each page is committed together with the cursor
+    of the next one, so an interrupted download resumes where it stopped
+    and a later run only fetches what is newer than the stored data.
+    Trades without a stored cursor are paged forward from ``since``, a unix
+    timestamp, by default the very first trade of the pair. Pairs are
+    downloaded ``concurrency`` at a time, all calls paced by one
+    KrakenScheduler on the public rate limit.
+    """
+
+    def __init__(self, root, api=None, scheduler=None, concurrency=4, timeout=30, since=0):
+        self.root = root
+        self.since = since
+        self.api = api or krakenex.API()
+        instrument(self.api.session)
+        self.scheduler = scheduler or KrakenScheduler('public')
+        self.concurrency = concurrency
+        self.timeout = timeout
+
+    def store(self, pair, series):
+        if series == 'trades':
+            return SeriesStore(os.path.join(self.root, pair, 'trades'), TRADE_DTYPE)
+        return SeriesStore(os.path.join(self.root, pair, series), OHLC_DTYPE)
+
+    def _query(self, method, data):
+        # public calls take from the same modelled counter as private ones,
+        # only with the limit of the public tier
+        with span('kraken.' + method):
+            res = self.scheduler.call(
+                lambda m, d: self.api.query_public(m, d, timeout=self.timeout), method, data
+            )
+        if not res:
+            raise ValueError('Kraken API failure')
+        if res['error']:
+            raise ValueError(', '.join(res['error']))
+        result = res['result']
+        last = result.pop('last')
+        # the result is keyed by the full pair name, which can differ from
+        # the requested one
+        return next(iter(result.values()), []), last
+
+    def trades(self, pair):
+        """Download the trades of pair since the last run, returns how many."""
+        store = self.store(pair, 'trades')
+        # without a since Kraken only returns the latest trades
+        cursor = store.cursor
+        if cursor is None:
+            cursor = str(self.since)
+        added = 0
+        while True:
+            trades, last = self._query('Trades', {'pair': pair, 'since': cursor})
+            store.append(trade_rows(trades), str(last))
+            added += len(trades)
+            if len(trades) < TRADES_PAGE or str(last) == cursor:
+                return added
+            cursor = str(last)
+
+    def ohlc(self, pair, interval=1):
+        """Download the closed candles of pair since the last run.
+
+        Kraken only serves the most recent 720 candles of an interval, so
+        runs further apart than that leave a gap.
+        """
+        store = self.store(pair, 'ohlc-{}'.format(interval))
+        data = {'pair': pair, 'interval': interval}
+        if store.cursor is not None:
+            data['since'] = store.cursor
+        candles, last = self._query('OHLC', data)
+        # the last candle is still open and changes until its interval ends
+        rows = ohlc_rows(candles[:-1])
+        stored = store.last_time()
+        if stored is not None:
+            rows = rows[rows['time'] > stored]
+        if len(rows):
+            store.append(rows, str(int(rows['time'][-1])))
+        return len(rows)
+
+    def download(self, pairs, trades=True, intervals=(1,)):
+        """Download the series of all pairs, ``concurrency`` pairs at a time.
+
+        Returns the number of new rows per pair and series, or the error
+        message for series that could not be downloaded.
+        """
+        def pair_series(pair):
+            added = dict()
+            jobs = [('trades', self.trades, ())] if trades else []
+            jobs += [('ohlc-{}'.format(x), self.ohlc, (x,)) for x in intervals]
+            for series, download, args in jobs:
+                try:
+                    added[series] = download(pair, *args)
+                except ValueError as e:
+                    added[series] = str(e)
+            return added
+
+        with ThreadPoolExecutor(max(1, min(self.concurrency, len(pairs)))) as pool:
+            return dict(zip(pairs, pool.map(pair_series, pairs)))
@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+import sqlite3
+import time
+
+# Kraken asset codes and the coinmarketcap slugs they are priced with
+KRAKEN_ASSETS = {
+    'XXBT': 'bitcoin',
+    'XBT.M': 'bitcoin',
+    'XETH': 'ethereum',
+    'XETC': 'ethereum-classic',
+    'XLTC': 'litecoin',
+    'XXRP': 'ripple',
+    'XXLM': 'stellar',
+    'XXMR': 'monero',
+    'XXDG': 'dogecoin',
+    'XZEC': 'zcash',
+    'XREP': 'augur',
+    'XMLN': 'melon',
+    'BCH': 'bitcoin-cash',
+    'DASH': 'dash',
+    'EOS': 'eos',
+    'GNO': 'gnosis-gno',
+    'USDT': 'tether',
+    'ADA': 'cardano',
+    'DOT': 'polkadot',
+    'ZEUR': 'eur',
+    'ZUSD': 'usd',
+}
+# Suffixes of staked, opted in, bonded and flexible balances of an asset
+KRAKEN_STAKING_SUFFIXES = ('S', 'M', 'F', 'B', 'P')
+# Assets only held staked, and the asset they are priced as
+KRAKEN_STAKED_ASSETS = {
+    'ETH2': 'XETH',
+}
+# Balances that cannot be traded, like fee credits
+KRAKEN_UNTRADED = {'KFEE'}
+
+
+def kraken_slug(asset, assets=KRAKEN_ASSETS):
+    # Slug of a Kraken asset code, staked balances like DOT.S or ETH2.S
+    # are priced as their base asset
+    if asset in assets:
+        return assets[asset]
+    base, _, suffix = asset.partition('.')
+    if suffix in KRAKEN_STAKING_SUFFIXES:
+        base = KRAKEN_STAKED_ASSETS.get(base, base)
+        for code in (base, 'X' + base, 'Z' + base):
+            if code in assets:
+                return assets[code]
+    return asset.lower()
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS balances (
+    asset TEXT PRIMARY KEY,
+    amount REAL NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS ledger (
+    id TEXT PRIMARY KEY,
+    refid TEXT,
+    time REAL NOT NULL,
+    type TEXT,
+    subtype TEXT,
+    aclass TEXT,
+    asset TEXT NOT NULL,
+    amount REAL,
+    fee REAL,
+    balance REAL
+);
+CREATE INDEX IF NOT EXISTS ledger_asset_time ON ledger (asset, time);
+CREATE INDEX IF NOT EXISTS ledger_time ON ledger (time);
+CREATE TABLE IF NOT EXISTS trades (
+    id TEXT PRIMARY KEY,
+    ordertxid TEXT,
+    pair TEXT NOT NULL,
+    time REAL NOT NULL,
+    type TEXT,
+    ordertype TEXT,
+    price REAL,
+    cost REAL,
+    fee REAL,
+    vol REAL
+);
+CREATE INDEX IF NOT EXISTS trades_pair_time ON trades (pair, time);
+CREATE INDEX IF NOT EXISTS trades_time ON trades (time);
+CREATE TABLE IF NOT EXISTS sync_state (
+    name TEXT PRIMARY KEY,
+    cursor TEXT NOT NULL
+);
+"""
+
+COLUMNS = {
+    'ledger': ('refid', 'time', 'type', 'subtype', 'aclass', 'asset', 'amount', 'fee', 'balance'),
+    'trades': ('ordertxid', 'pair', 'time', 'type', 'ordertype', 'price', 'cost', 'fee', 'vol'),
+}
+
+
+class KrakenStore(object):
+    """Local sqlite copy of a Kraken account's balances, ledger and trades."""
+
+    def __init__(self, path):
+        self.path = path
+        self.db = sqlite3.connect(path)
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def cursor(self, table):
+        # Id of the newest synced entry of table, if any
+        row = self.db.execute('SELECT cursor FROM sync_state WHERE name = ?', (table,)).fetchone()
+        return row[0] if row else None
+
+    def set_cursor(self, table, cursor):
+        with self.db:
+            self.db.execute('INSERT OR REPLACE INTO sync_state VALUES (?, ?)', (table, cursor))
+
+    def add(self, table, entries):
+        # Insert a page of api entries keyed by id, returns the number of new ones
+        columns = COLUMNS[table]
+        with self.db:
+            before = self.db.total_changes
+            self.db.executemany(
+                'INSERT OR IGNORE INTO {} (id, {}) VALUES (?, {})'.format(
+                    table, ', '.join(columns), ', '.join('?' * len(columns))),
+                ([key] + [entry.get(x) for x in columns] for key, entry in entries.items())
+            )
+            return self.db.total_changes - before
+
+    def set_balances(self, balances):
+        now = time.time()
+        with self.db:
+            self.db.execute('DELETE FROM balances')
+            self.db.executemany(
+                'INSERT INTO balances VALUES (?, ?, ?)',
+                ((asset, float(amount), now) for asset, amount in balances.items())
+            )
+
+    def balances(self):
+        return self.db.execute('SELECT asset, amount FROM balances ORDER BY asset').fetchall()
+
+    def ledger(self, asset=None, since=None):
+        # Ledger entries, optionally of one asset and/or from a time on
+        query = 'SELECT id, time, type, asset, amount, fee, balance FROM ledger WHERE 1'
+        params = list()
+        if asset is not None:
+            query += ' AND asset = ?'
+            params.append(asset)
+        if since is not None:
+            query += ' AND time >= ?'
+            params.append(since)
+        return self.db.execute(query + ' ORDER BY time', params)
+
+    def holdings(self, asset_map=None):
+        # Non zero balances of tradable assets as crypto_data lines of
+        # [slug, amount]
+        assets = dict(KRAKEN_ASSETS, **(asset_map or {}))
+        return [
+            [kraken_slug(asset, assets), repr(amount)]
+            for asset, amount in self.balances() if amount > 0 and asset not in KRAKEN_UNTRADED
+        ]
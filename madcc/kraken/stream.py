@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+import json
+import threading
+import time
+
+import websocket
+
+WS_URL = 'wss://ws.kraken.com'
+
+
+class KrakenTickerStream(object):
+    """Latest trade prices of subscribed Kraken pairs, pushed over a websocket.
+
+    A daemon thread keeps a connection to the public ticker feed open and
+    reconnects with exponential backoff, resubscribing all pairs, when it
+    drops. A connection without any message, heartbeats included, for
+    ``timeout`` seconds counts as dropped. Pairs are websocket names such as
+    ``XBT/EUR``; ``prices`` maps them to the last price and when it arrived.
+    """
+
+    def __init__(self, url=WS_URL, timeout=10, backoff=1, max_backoff=30, connect=None):
+        self.url = url
+        self.timeout = timeout
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.connect = connect or websocket.create_connection
+        self.pairs = set()
+        self.prices = dict()
+        self.errors = dict()
+        self.connects = 0
+        self.messages = 0
+        self._cond = threading.Condition()
+        self._ws = None
+        self._thread = None
+        self._stopped = threading.Event()
+
+    def _subscribe(self, ws, pairs):
+        ws.send(json.dumps({'event': 'subscribe', 'pair': sorted(pairs), 'subscription': {'name': 'ticker'}}))
+
+    def subscribe(self, pairs):
+        # Start receiving the prices of pairs, connecting on first use
+        with self._cond:
+            new = set(pairs) - self.pairs
+            self.pairs |= new
+            ws = self._ws
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='kraken-ticker', daemon=True)
+                self._thread.start()
+        if new and ws is not None:
+            try:
+                self._subscribe(ws, new)
+            except (OSError, websocket.WebSocketException):
+                # subscribed again after the reconnect
+                pass
+
+    def wait(self, pairs, timeout=None, max_age=None):
+        # Prices of pairs, waiting up to timeout seconds for all of them to
+        # have a price or a subscription error. Prices that arrived more
+        # than max_age seconds ago, e.g. before the connection dropped, do
+        # not count.
+        def fresh(pair):
+            return pair in self.prices and (max_age is None or time.time() - self.prices[pair][1] <= max_age)
+
+        with self._cond:
+            self._cond.wait_for(lambda: all(fresh(x) or x in self.errors for x in pairs), timeout)
+            return dict((x, self.prices[x][0]) for x in pairs if fresh(x))
+
+    def wait_update(self, after, timeout=None):
+        # Wait up to timeout seconds for a price that arrived after the time
+        # after, returns whether one did
+        with self._cond:
+            return self._cond.wait_for(
+                lambda: any(received > after for _, received in self.prices.values()), timeout
+            )
+
+    def stop(self):
+        self._stopped.set()
+        with self._cond:
+            ws = self._ws
+        if ws is not None:
+            ws.close()
+        if self._thread is not None:
+            self._thread.join(self.timeout)
+
+    def _run(self):
+        delay = self.backoff
+        while not self._stopped.is_set():
+            try:
+                ws = self.connect(self.url, timeout=self.timeout)
+            except (OSError, websocket.WebSocketException):
+                self._stopped.wait(delay)
+                delay = min(2 * delay, self.max_backoff)
+                continue
+            # pairs subscribed from now on are sent by subscribe itself
+            with self._cond:
+                self._ws = ws
+                self.connects += 1
+                pairs = set(self.pairs)
+            try:
+                if pairs:
+                    self._subscribe(ws, pairs)
+                while not self._stopped.is_set():
+                    message = ws.recv()
+                    if not message:
+                        break
+                    self._handle(json.loads(message))
+                    delay = self.backoff
+            except (OSError, ValueError, websocket.WebSocketException):
+                pass
+            finally:
+                with self._cond:
+                    self._ws = None
+                ws.close()
+            self._stopped.wait(delay)
+            delay = min(2 * delay, self.max_backoff)
+
+    def _handle(self, data):
+        # Ticker updates are [channel id, ticker, 'ticker', pair], events
+        # such as heartbeats and subscription status are objects
+        with self._cond:
+            self.messages += 1
+            if isinstance(data, dict):
+                if data.get('event') == 'subscriptionStatus' and data.get('status') == 'error':
+                    self.errors[data.get('pair')] = data.get('errorMessage')
+                    self._cond.notify_all()
+            elif len(data) >= 4 and data[-2] == 'ticker':
+                self.prices[data[-1]] = (float(data[1]['c'][0]), time.time())
+                self._cond.notify_all()
@@ -1 +1,8 @@
-from . import crypto_assets
+import importlib
+
+
+def __getattr__(name):
+    # Import crypto_assets on first use so importing madcc.utils stays cheap
+    if name == 'crypto_assets':
+        return importlib.import_module('.' + name, __name__)
+    raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+import glob
+import os
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+from .crypto_assets import iter_crypto_sections
+from .tracing import traced
+
+# Below this many files starting a process pool costs more than it saves
+POOL_MIN_FILES = 128
+
+
+class BatchValuation(object):
+    """Portfolios of many crypto files valued with one price snapshot.
+
+    ``portfolios`` maps the path of every valued file to its Portfolio, in
+    the order of the files, and ``errors`` maps the paths that could not be
+    valued to the reason. ``total`` is the Portfolio of all valued files
+    together, or None when there are none.
+    """
+
+    def __init__(self, portfolios, errors, total):
+        self.portfolios = portfolios
+        self.errors = errors
+        self.total = total
+
+
+def find_crypto_files(pattern):
+    # The files in a directory, or matching a glob pattern, sorted by path
+    if os.path.isdir(pattern):
+        pattern = os.path.join(pattern, '*')
+    return sorted(x for x in glob.glob(pattern) if os.path.isfile(x))
+
+
+def parse_file(path, sections=None):
+    # Asset lines of a crypto file, None when it can not be read
+    try:
+        with open(path) as f:
+            return [line for _, line in iter_crypto_sections(f, sections)]
+    except (IOError, UnicodeDecodeError):
+        return None
+
+
+@traced('parse_crypto_files')
+def parse_crypto_files(paths, sections=None, processes=None):
+    """Parse many crypto files, in a pool of ``processes`` if there are many.
+
+    Returns the asset lines of every path in order, or None for the files
+    that can not be read. With a single process, by default one per cpu,
+    or fewer than ``POOL_MIN_FILES`` files they are parsed in this process.
+    """
+    workers = processes or os.cpu_count() or 1
+    if workers == 1 or len(paths) < POOL_MIN_FILES:
+        return [parse_file(path, sections) for path in paths]
+    with ProcessPoolExecutor(workers) as pool:
+        chunksize = max(1, len(paths) // (4 * workers))
+        return list(pool.map(parse_file, paths, [sections] * len(paths), chunksize=chunksize))
+
+
+@traced('value_crypto_files')
+def value_crypto_files(ca, paths, sections=None, processes=None):
+    """Value many crypto files at once with the settings of CryptoAssets ``ca``.
+
+    The quotes of the union of the coins held in all files, and the fiat
+    rates they need, are retrieved once, so the number of requests depends
+    on the distinct coins and not on the number of files.
+    """
+    errors = OrderedDict()
+    holdings = OrderedDict()
+    for path, crypto_data in zip(paths, parse_crypto_files(paths, sections, processes)):
+        if crypto_data is None:
+            errors[path] = 'Unable to open crypto_data file'
+        elif not crypto_data:
+            errors[path] = 'No assets found'
+        else:
+            holdings[path] = crypto_data
+
+    combined = [line for crypto_data in holdings.values() for line in crypto_data]
+    if not combined:
+        return BatchValuation(OrderedDict(), errors, None)
+    quotes = ca.quote_prices(ca.retrieve_ticker_data(combined))
+    ca.fiat_rates.fetch(ca.fiat_pairs(combined))
+
+    portfolios = OrderedDict()
+    valued = list()
+    for path, crypto_data in holdings.items():
+        unpriced = ca.unpriced(crypto_data, quotes)
+        if unpriced:
+            errors[path] = 'Unable to price {}'.format(', '.join(unpriced))
+            continue
+        portfolios[path] = ca.value_holdings(crypto_data, quotes)
+        valued.extend(crypto_data)
+    total = ca.value_holdings(valued, quotes) if valued else None
+    return BatchValuation(portfolios, errors, total)
@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+
+class DiskCache(object):
+    """Small json backed key/value store with a max age per read.
+
+    Entries are kept in least recently used order and the oldest ones are
+    evicted once more than ``max_entries`` are stored. Changes are only
+    written to disk on ``save()``, and without a ``path`` entries only live
+    in memory. Access is serialized so one cache can be shared by threads.
+    """
+
+    def __init__(self, path=None, max_entries=5000):
+        self.path = path
+        self.max_entries = max_entries
+        self._entries = None
+        self._dirty = False
+        self._lock = threading.RLock()
+
+    @property
+    def entries(self):
+        if self._entries is None:
+            self._entries = OrderedDict()
+            if self.path is None:
+                return self._entries
+            try:
+                with open(self.path) as f:
+                    self._entries = json.load(f, object_pairs_hook=OrderedDict)
+            except (IOError, ValueError):
+                pass
+        return self._entries
+
+    def get(self, key, max_age=None, default=None):
+        # max_age of None accepts an entry of any age
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return default
+            stored, value = entry
+            if max_age is not None and time.time() - stored > max_age:
+                return default
+            # a read reorders the entries, but on its own is not worth
+            # rewriting the file for
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self.entries[key] = [time.time(), value]
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+            self._dirty = True
+
+    def save(self):
+        with self._lock:
+            if not self._dirty or self.path is None:
+                return
+            # every process writes its own temporary file, so concurrent
+            # runs never replace the cache with a half written one; the
+            # last one to finish wins
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(self.path)),
+                                            prefix=os.path.basename(self.path), suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'w') as f:
+                    json.dump(self.entries, f)
+                os.replace(tmp_path, self.path)
+            except OSError:
+                # the cache is only an optimization, the next save tries again
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                return
+            self._dirty = False
@@ -1,108 +1,300 @@
 #!/usr/bin/env python
-import re
+import asyncio
+import os
 import sys
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
-import requests
-from coinmarketcap import Market
-from tabulate import tabulate
+import numpy as np
 
+from .fiat_rates import FiatRates
+from .http import pooled_session
+from .portfolio import Portfolio, render_table
+from .price_sources import CoinMarketCapSource
+from .tracing import traced
+
+FIAT_CURRENCIES = ('EUR', 'USD')
 MISSING_CURRENCIES = ('BTC', 'USD')
 CURRENCIES = ('AUD', 'BRL', 'CAD', 'CHF', 'CLP', 'CNY', 'CZK', 'DKK', 'EUR',
               'GBP', 'HKD', 'HUF', 'IDR', 'ILS', 'INR', 'JPY', 'KRW', 'MXN',
               'MYR', 'NOK', 'NZD', 'PHP', 'PKR', 'PLN', 'RUB', 'SEK', 'SGD',
               'THB', 'TRY', 'TWD', 'ZAR') + MISSING_CURRENCIES
+SECTION_HEADING = '# cryptocurrency'
+
+
+def iter_crypto_sections(lines, names=None):
+    # Yield (section name, asset line) for the asset lines of the
+    # '# cryptocurrency [name]' sections in lines. Without names only the
+    # first section is read, otherwise the named ones; either way reading
+    # stops at the closing heading of the last wanted section.
+    wanted = None if names is None else set(names)
+    section = None
+    for line in lines:
+        if line.startswith('#'):
+            if section is not None:
+                if not wanted:
+                    return
+                section = None
+            heading = line.rstrip()
+            if heading == SECTION_HEADING or heading.startswith(SECTION_HEADING + ' '):
+                name = heading[len(SECTION_HEADING):].strip()
+                if wanted is None or name in wanted:
+                    section = name
+                    if wanted is not None:
+                        wanted.discard(name)
+        elif section is not None and line.startswith('-'):
+            yield section, line.strip('- \n').split()
 
 
 class CryptoAssets:
-    def __init__(self, config, currency, decimals):
+    def __init__(self, config, currency, decimals, price_source=None, fiat_rates=None,
+                 cache=None):
         self.config = config
         self.currency = currency
         self.decimals = decimals
+        self.cache = cache
+        self.price_source = price_source or CoinMarketCapSource()
+        self.fiat_rates = fiat_rates or FiatRates(config['currency_api'])
 
+    @traced('convert')
     def convert(self, symbol, amount):
         # Covert fiat currencies from symbol to configured currency
-        # TODO: do something when api fails
+        rate = self.fiat_price(symbol)
+        return([symbol, amount, rate, amount * rate])
+
+    @traced('fiat_price')
+    def fiat_price(self, symbol):
+        # Price of one unit of fiat currency symbol in configured currency
         if symbol.upper() == self.currency.upper():
-            return([symbol, amount, 1, amount])
-        else:
-            convert_pair = '{}_{}'.format(symbol.upper(), self.currency.upper())
-            res = requests.get(
-                self.config['currency_api'],
-                params={
-                    'q': convert_pair,
-                    'compact': 'y'
-                }
-            )
-            res.raise_for_status()
-            rate = res.json()[convert_pair]['val']
-            return([symbol, amount, rate, amount * rate])
+            return 1
+        return self.fiat_rates.rate(symbol, self.currency)
 
+    @traced('parse_crypto_file')
     def parse_crypto_file(self):
-        # Parse crypto note file for assets and amounts
-        m = re.compile(r'%s.*?%s' % ('# cryptocurrency', '#'), re.S)
-        try:
-            with open(self.config['crypto_file']) as f:
-                crypto_data = list()
-                res = m.search(f.read())
-                for line in res.group(0).split('\n'):
-                    if line.startswith('-'):
-                        crypto_data.append(line.strip('- \n').split())
-            return crypto_data
+        # Parse crypto note file for assets and amounts, reusing the cached
+        # result for as long as the file's mtime and size are unchanged
+        crypto_file = self.config['crypto_file']
+        sections = self.config.get('crypto_sections')
+        stat = None
+        if self.cache is not None:
+            key = 'parsed:{}:{}'.format(crypto_file, ','.join(sections or []))
+            try:
+                stat = os.stat(crypto_file)
+            except OSError:
+                pass
+            else:
+                cached = self.cache.get(key)
+                if cached and cached['mtime'] == stat.st_mtime and cached['size'] == stat.st_size:
+                    return cached['data']
 
+        try:
+            with open(crypto_file) as f:
+                crypto_data = [line for _, line in iter_crypto_sections(f, sections)]
         except IOError as e:
-            print('Unable to open crypto_data file: {}'.format(self.config['crypto_file']))
+            print('Unable to open crypto_data file: {}'.format(crypto_file))
             return False
 
+        if stat is not None:
+            self.cache.set(key, {'mtime': stat.st_mtime, 'size': stat.st_size, 'data': crypto_data})
+        return crypto_data
+
+    def kraken_holdings(self, store):
+        # Holdings from a synced KrakenStore, as an alternative to the
+        # crypto notes file. Kraken asset codes are mapped to slugs, extra
+        # mappings can be set in the kraken_assets config option.
+        return store.holdings(self.config.get('kraken_assets'))
+
+    @traced('retrieve_ticker_data')
     def retrieve_ticker_data(self, crypto_data):
-        # Retrieve list of specified ticker data from coinmarketcap
-        # TODO: do something when api call fails
-        coinmarketcap = Market()
-        listings = coinmarketcap.listings()
-        ticker_data = list()
-        for idnum in [x['id'] for x in listings['data'] if x['website_slug'] in [z[0] for z in crypto_data]]:
-            ticker_data.append(coinmarketcap.ticker(
-                idnum,
-                convert=self.currency)['data']
-            )
+        # Retrieve list of specified ticker data from the price source
+        slugs = [x for x in self.aggregate_holdings(crypto_data) if x.upper() not in FIAT_CURRENCIES]
+        return list(self.price_source.quotes(slugs, self.currency).values())
+
+    def aggregate_holdings(self, crypto_data):
+        # Sum the amounts of all lines holding the same asset, in file order
+        holdings = OrderedDict()
+        for line in crypto_data:
+            holdings[line[0]] = holdings.get(line[0], 0) + float(line[1])
+        return holdings
 
-        return ticker_data
+    def fiat_pairs(self, crypto_data):
+        # Currency pairs needed to convert the fiat lines of crypto_data
+        return [(x, self.currency) for x in self.aggregate_holdings(crypto_data) if x.upper() in FIAT_CURRENCIES]
 
-    def generate_crypto_table(self, crypto_data):
-        # Generate list of lists with crypto_data to display
+    @traced('generate_portfolio')
+    def generate_portfolio(self, crypto_data):
+        # Retrieve prices and value crypto_data as a Portfolio
         if not crypto_data:
             return False
         ticker_data = self.retrieve_ticker_data(crypto_data)
-        portfolio_total = 0
-        headers = [
-            'symbol', 'amount', '%',
-            '{} price'.format(self.currency), '{} total'.format(self.currency)
+        # Fetch the rates of all fiat lines at once instead of per line
+        self.fiat_rates.fetch(self.fiat_pairs(crypto_data))
+        return self.build_portfolio(crypto_data, ticker_data)
+
+    def iter_valuations(self, crypto_data):
+        # Yield [symbol, amount, price, total] for every held asset as soon
+        # as it is priced: fiat lines first, then coins in the order their
+        # quotes arrive
+        holdings = self.aggregate_holdings(crypto_data)
+        self.fiat_rates.fetch(self.fiat_pairs(crypto_data))
+        pending = list()
+        for symbol, amount in holdings.items():
+            if symbol.upper() in FIAT_CURRENCIES:
+                price = float(self.fiat_price(symbol))
+                yield [symbol, amount, price, amount * price]
+            else:
+                pending.append(symbol)
+
+        unpriced = set(pending)
+        for slug, ticker in self.price_source.iter_quotes(pending, self.currency):
+            if slug in unpriced:
+                unpriced.discard(slug)
+                price = float(ticker['quotes'][self.currency.upper()]['price'])
+                yield [slug, holdings[slug], price, holdings[slug] * price]
+        if unpriced:
+            raise KeyError(', '.join(sorted(unpriced)))
+
+    @traced('generate_crypto_table')
+    def generate_crypto_table(self, crypto_data, depth=None):
+        # Generate list of lists with crypto_data to display, with the
+        # liquidation value on the order books of depth if given
+        portfolio = self.generate_portfolio(crypto_data)
+        if portfolio is False:
+            return False
+        if depth is not None:
+            self.liquidate(portfolio, depth)
+        return portfolio.headers, portfolio.table()
+
+    @traced('liquidate')
+    def liquidate(self, portfolio, depth):
+        # Value the coins of portfolio at the bids of depth, a KrakenSource,
+        # in one batch of order books. Fiat holdings realize their value.
+        slugs = [x for x in portfolio.symbols if x.upper() not in FIAT_CURRENCIES]
+        cash = [x for x in portfolio.symbols if x.upper() in FIAT_CURRENCIES]
+        portfolio.liquidate(depth.books(slugs, self.currency), cash)
+        return portfolio
+
+    @traced('build_portfolio')
+    def build_portfolio(self, crypto_data, ticker_data):
+        # Combine crypto_data with already retrieved prices into columns
+        return self.value_holdings(crypto_data, self.quote_prices(ticker_data))
+
+    def quote_prices(self, ticker_data):
+        # Map the slugs of ticker data to their price in the currency
+        return dict(
+            (x['website_slug'], x['quotes'][self.currency.upper()]['price']) for x in ticker_data
+        )
+
+    def unpriced(self, crypto_data, quotes):
+        # Held coins quote_prices has no price for
+        return [
+            x for x in self.aggregate_holdings(crypto_data)
+            if x.upper() not in FIAT_CURRENCIES and x not in quotes
+        ]
+
+    def value_holdings(self, crypto_data, quotes):
+        # Portfolio of crypto_data with the coin prices of quotes
+        holdings = self.aggregate_holdings(crypto_data)
+        symbols = list(holdings)
+        prices = [
+            self.fiat_price(symbol) if symbol.upper() in FIAT_CURRENCIES else quotes[symbol]
+            for symbol in symbols
         ]
+        return Portfolio(
+            self.currency, symbols,
+            np.fromiter(holdings.values(), float, len(symbols)),
+            np.fromiter(prices, float, len(symbols))
+        )
+
+    def build_crypto_table(self, crypto_data, ticker_data):
+        # Combine crypto_data with already retrieved prices into a table
+        portfolio = self.build_portfolio(crypto_data, ticker_data)
+        return portfolio.headers, portfolio.table()
+
+    @traced('generate_multi_currency_table')
+    def generate_multi_currency_table(self, crypto_data, currencies):
+        # Generate one table with a price and total column per currency,
+        # retrieving the quotes of all currencies concurrently. Rows are
+        # ordered, and percentages computed, by the first currency.
+        if not crypto_data:
+            return False
+        assets = [
+            CryptoAssets(self.config, currency, self.decimals, self.price_source,
+                         self.fiat_rates, self.cache)
+            for currency in currencies
+        ]
+        self.fiat_rates.fetch(pair for ca in assets for pair in ca.fiat_pairs(crypto_data))
+
+        # coinmarketcap includes USD quotes for every converted currency, so
+        # USD only needs its own pass when it is the only currency or when
+        # the source only returned the currency asked for, like Kraken does
+        fetching = [ca for ca in assets if ca.currency.upper() != 'USD'] or assets
+        with ThreadPoolExecutor(len(fetching)) as pool:
+            ticker_data = list(pool.map(lambda ca: ca.retrieve_ticker_data(crypto_data), fetching))
+        by_currency = dict(zip([ca.currency for ca in fetching], ticker_data))
+        for ca in assets:
+            if ca.currency not in by_currency:
+                if all('USD' in x['quotes'] for x in ticker_data[0]):
+                    by_currency[ca.currency] = ticker_data[0]
+                else:
+                    by_currency[ca.currency] = ca.retrieve_ticker_data(crypto_data)
+        tables = [ca.build_crypto_table(crypto_data, by_currency[ca.currency]) for ca in assets]
+
+        headers = tables[0][0][:3]
+        for table_headers, _ in tables:
+            headers += table_headers[3:]
+        rows = [dict((row[0], row) for row in table) for _, table in tables]
         table = list()
-        for line in crypto_data:
-            symbol = line[0]
-            amount = float(line[1])
-            if symbol.upper() in ('EUR', 'USD'):
-                outcome = self.convert(symbol, amount)
-                table.append(outcome)
-                portfolio_total += outcome[3]
-                continue
-            price = [x['quotes'][self.currency.upper()]['price'] for x in ticker_data if x['website_slug'] == symbol][0]
-            total = amount * float(price)
-            portfolio_total += total
-            table.append([symbol, amount, price, total])
-
-        for idx, val in enumerate(table):
-            table[idx].insert(-2, round(val[3] / (portfolio_total / 100), 2))
-
-        table.sort(key=lambda x: x[4], reverse=True)
-        table.append([
-            'total', None, None,
-            None, portfolio_total
-        ])
+        for row in tables[0][1]:
+            table.append(row[:3] + [x for index in rows for x in index[row[0]][3:]])
 
         return headers, table
 
 
+class AsyncCryptoAssets(CryptoAssets):
+    """CryptoAssets that retrieves quotes and fiat rates concurrently.
+
+    The api clients are blocking, so asyncio drives them through a thread
+    pool while they share one pooled session with retries. ``concurrency``
+    bounds both the thread pool and the connection pool, and also the
+    number of ticker pages requested at once.
+    """
+
+    def __init__(self, config, currency, decimals, price_source=None, fiat_rates=None,
+                 cache=None, concurrency=8, timeout=30, retries=3):
+        self.concurrency = concurrency
+        if price_source is None or fiat_rates is None:
+            session = pooled_session(concurrency, retries)
+            price_source = price_source or CoinMarketCapSource(
+                session=session, timeout=timeout, concurrency=concurrency
+            )
+            fiat_rates = fiat_rates or FiatRates(
+                config['currency_api'], session=session, timeout=timeout
+            )
+        CryptoAssets.__init__(self, config, currency, decimals, price_source, fiat_rates, cache)
+
+    async def generate_portfolio_async(self, crypto_data):
+        if not crypto_data:
+            return False
+        loop = asyncio.get_event_loop()
+        with ThreadPoolExecutor(self.concurrency) as pool:
+            ticker_data, _ = await asyncio.gather(
+                loop.run_in_executor(pool, self.retrieve_ticker_data, crypto_data),
+                loop.run_in_executor(pool, self.fiat_rates.fetch, self.fiat_pairs(crypto_data))
+            )
+        return self.build_portfolio(crypto_data, ticker_data)
+
+    async def generate_crypto_table_async(self, crypto_data):
+        portfolio = await self.generate_portfolio_async(crypto_data)
+        if portfolio is False:
+            return False
+        return portfolio.headers, portfolio.table()
+
+    @traced('generate_portfolio')
+    def generate_portfolio(self, crypto_data):
+        return asyncio.run(self.generate_portfolio_async(crypto_data))
+
+
 def demo():
     currency = 'usd'
     decimals = 2
@@ -115,7 +307,7 @@ def demo():
 
     ca = CryptoAssets(config, currency, decimals)
     headers, crypto_table = ca.generate_crypto_table(crypto_data)
-    return tabulate(crypto_table, headers=headers, floatfmt='.{}f'.format(decimals))
+    return render_table(headers, crypto_table, '.{}f'.format(decimals))
 
 
 if __name__ == "__main__":  # pragma: no cover
@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+import requests
+
+from .cache import DiskCache
+from .tracing import traced
+
+
+class FiatRates(object):
+    """Exchange rates between fiat currencies from the currency api.
+
+    Rates are kept for ``ttl`` seconds in the given DiskCache, or in a
+    memory only one when there is none. A fetched pair also
+    answers its inverse, and pairs the api does not offer directly are
+    derived through USD. In ``offline`` mode cached rates of any age are
+    used and the api is never called. When the api fails the rates are
+    asked from ``fallback``, e.g. a KrakenSource, if one is given.
+    """
+
+    def __init__(self, api_url, session=None, cache=None, ttl=3600,
+                 offline=False, max_pairs=2, timeout=30, fallback=None):
+        self.api_url = api_url
+        self.session = session or requests.Session()
+        self.timeout = timeout
+        self.cache = cache if cache is not None else DiskCache()
+        self.ttl = None if offline else ttl
+        self.offline = offline
+        # the free currency api accepts at most two pairs per request
+        self.max_pairs = max_pairs
+        self.fallback = fallback
+
+    def _lookup(self, base, quote):
+        if base == quote:
+            return 1
+        for pair, inverse in (('{}_{}'.format(base, quote), False),
+                              ('{}_{}'.format(quote, base), True)):
+            rate = self.cache.get('rate:' + pair, self.ttl)
+            if rate is not None:
+                return 1 / rate if inverse else rate
+        return None
+
+    @traced('fiat_rates.fetch')
+    def fetch(self, pairs):
+        # Fetch all unknown (base, quote) pairs in as few requests as possible
+        if self.offline:
+            return
+        missing = sorted(set(
+            '{}_{}'.format(base.upper(), quote.upper()) for base, quote in pairs
+            if self._lookup(base.upper(), quote.upper()) is None
+        ))
+        for i in range(0, len(missing), self.max_pairs):
+            try:
+                rates = self._fetch_api(missing[i:i + self.max_pairs])
+            except (ValueError, requests.RequestException):
+                if self.fallback is None:
+                    raise
+                # the api is down, get all remaining pairs from the fallback
+                rates = self.fallback.rates([tuple(x.split('_')) for x in missing[i:]])
+                for pair, rate in rates.items():
+                    self.cache.set('rate:' + pair, rate)
+                return
+            for pair, rate in rates.items():
+                self.cache.set('rate:' + pair, rate)
+
+    def _fetch_api(self, pairs):
+        res = self.session.get(
+            self.api_url,
+            params={
+                'q': ','.join(pairs),
+                'compact': 'y'
+            },
+            timeout=self.timeout
+        )
+        res.raise_for_status()
+        return dict((pair, data['val']) for pair, data in res.json().items())
+
+    def rate(self, base, quote):
+        base, quote = base.upper(), quote.upper()
+        rate = self._lookup(base, quote)
+        if rate is None:
+            self.fetch([(base, quote)])
+            rate = self._lookup(base, quote)
+        if rate is None and 'USD' not in (base, quote):
+            self.fetch([(base, 'USD'), ('USD', quote)])
+            to_usd = self._lookup(base, 'USD')
+            from_usd = self._lookup('USD', quote)
+            if to_usd is not None and from_usd is not None:
+                rate = to_usd * from_usd
+                self.cache.set('rate:{}_{}'.format(base, quote), rate)
+        if rate is None:
+            raise ValueError('No exchange rate for {}_{}'.format(base, quote))
+
+        return rate
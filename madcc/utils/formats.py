@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+import csv
+import json
+
+FIELDS = ('symbol', 'currency', 'amount', 'price', 'total')
+
+
+def write_ndjson(rows, currency, out):
+    # One json object per asset, then one for the portfolio total
+    total = 0.0
+    try:
+        for symbol, amount, price, value in rows:
+            total += value
+            out.write(json.dumps(dict(zip(FIELDS, (symbol, currency, amount, price, value)))) + '\n')
+            out.flush()
+    finally:
+        out.write(json.dumps(dict(zip(FIELDS, ('total', currency, None, None, total)))) + '\n')
+    return total
+
+
+def write_json(rows, currency, out):
+    # A single document, written an asset at a time
+    total = 0.0
+    out.write('{{"currency": {}, "assets": ['.format(json.dumps(currency)))
+    try:
+        for index, (symbol, amount, price, value) in enumerate(rows):
+            total += value
+            out.write('{}\n  {}'.format(',' if index else '', json.dumps(
+                dict(zip(('symbol', 'amount', 'price', 'total'), (symbol, amount, price, value)))
+            )))
+            out.flush()
+    finally:
+        out.write('\n], "total": {}}}\n'.format(json.dumps(total)))
+    return total
+
+
+def write_csv(rows, currency, out):
+    total = 0.0
+    writer = csv.writer(out, lineterminator='\n')
+    writer.writerow(FIELDS)
+    try:
+        for symbol, amount, price, value in rows:
+            total += value
+            writer.writerow((symbol, currency, repr(amount), repr(price), repr(value)))
+            out.flush()
+    finally:
+        writer.writerow(('total', currency, '', '', repr(total)))
+    return total
+
+
+FORMATS = {
+    'json': write_json,
+    'ndjson': write_ndjson,
+    'csv': write_csv,
+}
+
+
+def write_rows(rows, fmt, currency, out):
+    """Stream iter_valuations rows to ``out`` in a machine readable format.
+
+    Every row is written and flushed as soon as it arrives, numbers are
+    written as json numbers or python float reprs and round-trip exactly.
+    Returns the portfolio total. When ``rows`` raises, the output is still
+    finished with the total of the rows written so far before the error is
+    passed on, so it stays parseable.
+    """
+    return FORMATS[fmt](rows, currency, out)
@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+import json
+import os
+import struct
+import time
+
+import numpy as np
+
+from .tracing import traced
+
+# One record per held asset per snapshot
+ROW_FORMAT = '<IIddd'
+ROW_DTYPE = np.dtype([
+    ('snapshot', '<u4'),
+    ('symbol', '<u4'),
+    ('amount', '<f8'),
+    ('price', '<f8'),
+    ('total', '<f8'),
+])
+PERIODS = {'hourly': 3600, 'daily': 86400}
+
+
+class HistoryStore(object):
+    """Append-only columnar history of valued crypto tables.
+
+    A directory holds ``times.f8`` with one timestamp per snapshot,
+    ``rows.bin`` with fixed size (snapshot, symbol, amount, price, total)
+    records and ``symbols.json`` mapping symbol numbers to names. Appending
+    needs no numpy arrays, reading memory-maps both data files.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.times_path = os.path.join(path, 'times.f8')
+        self.rows_path = os.path.join(path, 'rows.bin')
+        self.symbols_path = os.path.join(path, 'symbols.json')
+
+    def symbols(self):
+        try:
+            with open(self.symbols_path) as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return list()
+
+    def __len__(self):
+        try:
+            return os.path.getsize(self.times_path) // 8
+        except OSError:
+            return 0
+
+    def committed_rows(self, snapshots):
+        # Number of records in rows.bin that belong to the first snapshots,
+        # rows are written in snapshot order so that is a binary search
+        try:
+            records = os.path.getsize(self.rows_path) // ROW_DTYPE.itemsize
+        except OSError:
+            return 0
+        if not records:
+            return 0
+        rows = np.memmap(self.rows_path, dtype=ROW_DTYPE, mode='r', shape=(records,))
+        count = int(np.searchsorted(rows['snapshot'], snapshots))
+        del rows
+        return count
+
+    @traced('history.record')
+    def record(self, table, timestamp=None):
+        # Append the asset rows of a generate_crypto_table table
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+        symbols = self.symbols()
+        index = dict((x, i) for i, x in enumerate(symbols))
+        snapshot = len(self)
+        rows = list()
+        for row in table:
+            if row[0] == 'total':
+                continue
+            if row[0] not in index:
+                index[row[0]] = len(symbols)
+                symbols.append(row[0])
+            rows.append(struct.pack(ROW_FORMAT, snapshot, index[row[0]], row[1], row[3], row[4]))
+
+        with open(self.symbols_path, 'w') as f:
+            json.dump(symbols, f)
+        # rows first, a snapshot only counts once its timestamp is written.
+        # Rows of an interrupted record carry this snapshot number too, so
+        # they are cut off first instead of being merged into this one.
+        committed = self.committed_rows(snapshot)
+        with open(self.rows_path, 'ab') as f:
+            f.truncate(committed * ROW_DTYPE.itemsize)
+            f.write(b''.join(rows))
+        with open(self.times_path, 'ab') as f:
+            f.write(struct.pack('<d', time.time() if timestamp is None else timestamp))
+
+    def read(self):
+        # Return times, symbols and a snapshots x symbols matrix per column
+        snapshots = len(self)
+        symbols = self.symbols()
+        if not snapshots:
+            return np.zeros(0), symbols, dict()
+        times = np.memmap(self.times_path, dtype='<f8', mode='r', shape=(snapshots,))
+        records = os.path.getsize(self.rows_path) // ROW_DTYPE.itemsize
+        rows = np.memmap(self.rows_path, dtype=ROW_DTYPE, mode='r', shape=(records,))
+        rows = rows[rows['snapshot'] < snapshots]
+
+        columns = dict()
+        for name in ('amount', 'price', 'total'):
+            matrix = np.zeros((snapshots, len(symbols)))
+            matrix[rows['snapshot'], rows['symbol']] = rows[name]
+            columns[name] = matrix
+        return np.asarray(times), symbols, columns
+
+
+def resample(times, matrix, period):
+    # Keep the last snapshot of every hour or day
+    buckets = np.floor_divide(times, PERIODS[period])
+    last = np.append(buckets[1:] != buckets[:-1], True)
+    return times[last], matrix[last]
+
+
+def analyze(times, symbols, totals, since=None):
+    """Returns, drawdown and allocation drift of a totals history.
+
+    Returns a dict with the portfolio statistics and a list of
+    (symbol, start weight, end weight, drift, max deviation) per asset.
+    """
+    if since is not None:
+        keep = times >= since
+        times, totals = times[keep], totals[keep]
+    if len(times) < 2:
+        return None
+
+    value = totals.sum(axis=1)
+    returns = value[1:] / value[:-1] - 1
+    peak = np.maximum.accumulate(value)
+    drawdown = value / peak - 1
+    weights = totals / value[:, None]
+    deviation = np.abs(weights - weights[0]).max(axis=0)
+
+    stats = {
+        'start': times[0],
+        'end': times[-1],
+        'start value': value[0],
+        'end value': value[-1],
+        'return %': (value[-1] / value[0] - 1) * 100,
+        'volatility %': returns.std() * 100,
+        'max drawdown %': drawdown.min() * 100,
+        'current drawdown %': drawdown[-1] * 100,
+    }
+    allocation = [
+        (symbol, weights[0, i] * 100, weights[-1, i] * 100,
+         (weights[-1, i] - weights[0, i]) * 100, deviation[i] * 100)
+        for i, symbol in enumerate(symbols)
+    ]
+    return stats, allocation
@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+import json
+import os
+import threading
+from collections import defaultdict
+from urllib.parse import parse_qsl, urlencode
+
+import requests
+from requests.adapters import BaseAdapter, HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from urllib3.util.retry import Retry
+
+from .tracing import instrument
+
+# Headers that describe the encoding on the wire rather than the content
+WIRE_HEADERS = ('content-encoding', 'content-length', 'transfer-encoding', 'connection')
+
+
+def pooled_session(pool_size=8, retries=3, backoff=0.3):
+    """Return a requests.Session meant to be shared by all api clients.
+
+    The connection pool holds ``pool_size`` connections per host and
+    idempotent requests are retried with exponential backoff on connection
+    errors and on 429 and 5xx responses. Its traffic shows up in the
+    tracing http counters.
+    """
+    retry = Retry(
+        total=retries,
+        backoff_factor=backoff,
+        status_forcelist=(429, 500, 502, 503, 504),
+    )
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return instrument(session)
+
+
+class Cassette(object):
+    """Http interactions recorded to, or replayed from, a json file.
+
+    Requests are matched on method, url and body. A ``nonce`` form field is
+    left out of the match, so signed krakenex calls replay as well. Every
+    match replays its responses in recorded order and keeps repeating the
+    last one.
+    """
+
+    def __init__(self, path, mode='replay'):
+        if mode not in ('record', 'replay'):
+            raise ValueError('Unknown cassette mode: {}'.format(mode))
+        self.path = path
+        self.mode = mode
+        self.interactions = defaultdict(list)
+        self._played = defaultdict(int)
+        self._lock = threading.Lock()
+        if mode == 'replay':
+            with open(path) as f:
+                self.interactions.update(json.load(f))
+
+    @staticmethod
+    def key(request):
+        body = request.body or ''
+        if isinstance(body, bytes):
+            body = body.decode('utf-8', 'replace')
+        fields = parse_qsl(body, keep_blank_values=True)
+        if fields:
+            body = urlencode(sorted(x for x in fields if x[0] != 'nonce'))
+        return '{} {} {}'.format(request.method, request.url, body).rstrip()
+
+    def record(self, request, response):
+        with self._lock:
+            self.interactions[self.key(request)].append({
+                'status': response.status_code,
+                'reason': response.reason,
+                'headers': dict(
+                    (k, v) for k, v in response.headers.items() if k.lower() not in WIRE_HEADERS
+                ),
+                'body': response.content.decode('utf-8'),
+            })
+
+    def play(self, request):
+        key = self.key(request)
+        with self._lock:
+            recorded = self.interactions.get(key)
+            if not recorded:
+                raise requests.ConnectionError('No recorded response for {}'.format(key), request=request)
+            interaction = recorded[min(self._played[key], len(recorded) - 1)]
+            self._played[key] += 1
+
+        response = requests.Response()
+        response.status_code = interaction['status']
+        response.reason = interaction['reason']
+        response.headers = CaseInsensitiveDict(interaction['headers'])
+        response._content = interaction['body'].encode('utf-8')
+        response.encoding = 'utf-8'
+        response.url = request.url
+        response.request = request
+        return response
+
+    def save(self):
+        with self._lock:
+            with open(self.path + '.tmp', 'w') as f:
+                json.dump(self.interactions, f, indent=1, sort_keys=True)
+            os.replace(self.path + '.tmp', self.path)
+
+
+class CassetteAdapter(BaseAdapter):
+    # Send through adapter while recording, or answer from the cassette
+    def __init__(self, cassette, adapter=None):
+        BaseAdapter.__init__(self)
+        self.cassette = cassette
+        self.adapter = adapter
+
+    def send(self, request, **kwargs):
+        if self.cassette.mode == 'replay':
+            return self.cassette.play(request)
+        response = self.adapter.send(request, **kwargs)
+        self.cassette.record(request, response)
+        return response
+
+    def close(self):
+        if self.adapter is not None:
+            self.adapter.close()
+
+
+def use_cassette(session, path, mode='replay'):
+    """Record the http traffic of session to path, or replay it from there.
+
+    Works for any client that takes a session, including krakenex through
+    its ``session`` attribute. Returns the Cassette; call its ``save`` once
+    done recording.
+    """
+    cassette = Cassette(path, mode)
+    for prefix in ('http://', 'https://'):
+        session.mount(prefix, CassetteAdapter(cassette, session.get_adapter(prefix + 'x')))
+    return cassette
@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+from collections import namedtuple
+
+Coin = namedtuple('Coin', ['id', 'slug', 'symbol', 'rank'])
+View = namedtuple('View', ['data', 'count', 'slots', 'updated', 'slug_table', 'symbol_table', 'strings'])
+
+# magic, version, coin count, hash slots, time of the last complete update
+HEADER = struct.Struct('<4sIIId')
+# id, rank, offset of slug and symbol in the strings, slug and symbol length
+ENTRY = struct.Struct('<IIIHH')
+SLOT = struct.Struct('<I')
+MAGIC = b'MCIX'
+VERSION = 1
+
+
+class ListingsIndex(object):
+    """Compact file of the id, slug, symbol and rank of every listed coin.
+
+    The file holds fixed size entries, two open addressing hash tables of
+    slugs and of upper case symbols, and the strings, so it is mapped into
+    memory and looked up in O(1) without reading or parsing all of it.
+    Symbols shared by several coins resolve to the best ranked one. Updates
+    rewrite the file atomically, merges that change nothing are skipped.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.RLock()
+        self._view = None
+        self._loaded = False
+
+    def _load(self):
+        # The view is swapped in one assignment, so readers in other threads
+        # see either the old or the new file
+        view = None
+        try:
+            with open(self.path, 'rb') as f:
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (IOError, ValueError):
+            data = None
+        if data is not None and len(data) >= HEADER.size and HEADER.unpack_from(data)[:2] == (MAGIC, VERSION):
+            _, _, count, slots, updated = HEADER.unpack_from(data)
+            slug_table = HEADER.size + count * ENTRY.size
+            view = View(data, count, slots, updated, slug_table, slug_table + slots * SLOT.size,
+                        slug_table + 2 * slots * SLOT.size)
+        self._view = view
+        self._loaded = True
+
+    @property
+    def view(self):
+        if not self._loaded:
+            with self._lock:
+                if not self._loaded:
+                    self._load()
+        return self._view
+
+    def __len__(self):
+        view = self.view
+        return view.count if view is not None else 0
+
+    def __iter__(self):
+        view = self.view
+        for index in range(view.count if view is not None else 0):
+            yield self._coin(view, index)
+
+    @property
+    def updated(self):
+        view = self.view
+        return view.updated if view is not None else 0.0
+
+    def age(self):
+        return time.time() - self.updated
+
+    def _coin(self, view, index):
+        data = view.data
+        id, rank, offset, slug_len, symbol_len = ENTRY.unpack_from(data, HEADER.size + index * ENTRY.size)
+        start = view.strings + offset
+        return Coin(
+            id, data[start:start + slug_len].decode(),
+            data[start + slug_len:start + slug_len + symbol_len].decode(), rank
+        )
+
+    def _find(self, table, key, field):
+        view = self.view
+        if view is None or not key:
+            return None
+        offset = getattr(view, table)
+        mask = view.slots - 1
+        slot = zlib.crc32(key.encode()) & mask
+        while True:
+            index = SLOT.unpack_from(view.data, offset + slot * SLOT.size)[0]
+            if not index:
+                return None
+            coin = self._coin(view, index - 1)
+            if coin[field] == key:
+                return coin
+            slot = (slot + 1) & mask
+
+    def by_slug(self, slug):
+        return self._find('slug_table', slug, 1)
+
+    def by_symbol(self, symbol):
+        return self._find('symbol_table', symbol.upper(), 2)
+
+    def lookup(self, name):
+        # A coin by slug, e.g. bitcoin, or else by symbol, e.g. btc
+        return self.by_slug(name) or self.by_symbol(name)
+
+    def update(self, listings, complete=True):
+        """Store coinmarketcap listings or ticker data.
+
+        A complete update replaces the index and resets its age, otherwise
+        the coins are merged into it. Ranks missing from the listings are
+        kept from the index. Returns whether any coin changed.
+        """
+        with self._lock:
+            current = dict((coin.id, coin) for coin in self)
+            coins = dict() if complete else dict(current)
+            for x in listings:
+                old = current.get(x['id'])
+                coins[x['id']] = Coin(
+                    x['id'], x['website_slug'], x['symbol'].upper(),
+                    x.get('rank') or (old.rank if old is not None else 0)
+                )
+            changed = coins != current
+            if changed or complete:
+                self._write(sorted(coins.values()), time.time() if complete else self.updated)
+            return changed
+
+    def _write(self, coins, updated):
+        slots = 8
+        while slots < 2 * len(coins):
+            slots *= 2
+        mask = slots - 1
+        slug_table = [0] * slots
+        symbol_table = [0] * slots
+
+        def insert(table, key, index):
+            slot = zlib.crc32(key) & mask
+            while table[slot]:
+                slot = (slot + 1) & mask
+            table[slot] = index + 1
+
+        entries = bytearray()
+        strings = bytearray()
+        slugs = set()
+        for index, coin in enumerate(coins):
+            slug, symbol = coin.slug.encode(), coin.symbol.encode()
+            entries += ENTRY.pack(coin.id, coin.rank, len(strings), len(slug), len(symbol))
+            strings += slug + symbol
+            if slug not in slugs:
+                slugs.add(slug)
+                insert(slug_table, slug, index)
+        # unranked coins last, then the oldest listing first
+        symbols = set()
+        for index in sorted(range(len(coins)), key=lambda i: (coins[i].rank or 1 << 32, coins[i].id)):
+            symbol = coins[index].symbol.encode()
+            if symbol not in symbols:
+                symbols.add(symbol)
+                insert(symbol_table, symbol, index)
+
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, VERSION, len(coins), slots, updated))
+            f.write(entries)
+            f.write(struct.pack('<{}I'.format(slots), *slug_table))
+            f.write(struct.pack('<{}I'.format(slots), *symbol_table))
+            f.write(strings)
+        os.replace(tmp_path, self.path)
+        self._load()
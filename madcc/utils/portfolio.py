@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+import numpy as np
+
+from .tracing import traced
+
+
+class Portfolio(object):
+    """Valued holdings as columns, ordered by total value.
+
+    ``symbols`` is a list and ``amounts``, ``prices``, ``totals`` and
+    ``percentages`` are numpy arrays in the same order, ``total`` is the
+    value of the whole portfolio. ``table`` returns the rows of the classic
+    generate_crypto_table format. After ``liquidate`` the rows also hold
+    what selling each holding realizes and its slippage in percent.
+    """
+
+    def __init__(self, currency, symbols, amounts, prices):
+        self.currency = currency
+        totals = amounts * prices
+        # summed in holdings order, so the total matches a running sum
+        self.total = float(totals.cumsum()[-1]) if len(totals) else 0.0
+        order = np.argsort(-totals, kind='stable')
+        self.symbols = [symbols[i] for i in order]
+        self.amounts = amounts[order]
+        self.prices = prices[order]
+        self.totals = totals[order]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            self.percentages = np.round(self.totals / (self.total / 100), 2)
+        self.liquidation = None
+        self.slippage = None
+
+    def __len__(self):
+        return len(self.symbols)
+
+    @property
+    def headers(self):
+        headers = [
+            'symbol', 'amount', '%',
+            '{} price'.format(self.currency), '{} total'.format(self.currency)
+        ]
+        if self.liquidation is not None:
+            headers += ['{} liquidation'.format(self.currency), 'slippage %']
+        return headers
+
+    def liquidate(self, books, cash=()):
+        # Value every holding at what selling it into its bids in books,
+        # (prices, volumes) per symbol, realizes. Symbols in cash realize
+        # their total, others without a book are left nan.
+        held = [i for i, x in enumerate(self.symbols) if x in books]
+        values, _ = walk_bids(self.amounts[held], [books[self.symbols[i]] for i in held])
+        self.liquidation = np.full(len(self), np.nan)
+        self.liquidation[held] = values
+        cash = [i for i, x in enumerate(self.symbols) if x in cash]
+        self.liquidation[cash] = self.totals[cash]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            self.slippage = np.round(100 - self.liquidation / (self.totals / 100), 2)
+
+    @property
+    def liquidation_total(self):
+        # Holdings without a book count at their total
+        return float(np.where(np.isnan(self.liquidation), self.totals, self.liquidation).sum())
+
+    def rows(self):
+        # Asset rows of [symbol, amount, %, price, total] with python floats,
+        # followed by liquidation and slippage once liquidated
+        columns = [self.symbols, self.amounts.tolist(), self.percentages.tolist(),
+                   self.prices.tolist(), self.totals.tolist()]
+        if self.liquidation is not None:
+            for column in (self.liquidation, self.slippage):
+                columns.append([None if x != x else x for x in column.tolist()])
+        return [list(row) for row in zip(*columns)]
+
+    def table(self):
+        total = ['total', None, None, None, self.total]
+        if self.liquidation is not None:
+            liquidation = self.liquidation_total
+            total += [liquidation, round(100 - liquidation / (self.total / 100), 2) if self.total else None]
+        return self.rows() + [total]
+
+    def render(self, decimals):
+        return render_table(self.headers, self.table(), '.{}f'.format(decimals))
+
+
+def walk_bids(amounts, books):
+    """Proceeds of selling every amount into its book, and how much is sold.
+
+    ``books`` has a (prices, volumes) pair of arrays of bids, best first,
+    per amount. An amount larger than its book only sells what the book
+    holds. All books are walked at once with running sums over their
+    concatenated levels. Within every book volumes are taken relative to
+    the amount and prices to the best bid, so the sums stay exact whether
+    the coins are worth a fraction of a cent or thousands.
+    """
+    amounts = np.asarray(amounts, float)
+    sizes = np.fromiter((len(x[0]) for x in books), np.intp, len(books))
+    if not sizes.sum():
+        return np.zeros(len(amounts)), np.zeros(len(amounts))
+    ends = np.cumsum(sizes)
+    starts = ends - sizes
+    owner = np.repeat(np.arange(len(books)), sizes)
+    prices = np.concatenate([np.asarray(x[0], float) for x in books])
+    volumes = np.concatenate([np.asarray(x[1], float) for x in books])
+    best = prices[np.minimum(starts, len(prices) - 1)]
+
+    # a level larger than the whole amount fills it on its own
+    fractions = np.minimum(volumes / np.where(amounts > 0, amounts, 1)[owner], 1)
+    filled = np.concatenate([[0], np.cumsum(fractions)])
+    proceeds = np.concatenate([[0], np.cumsum(fractions * prices / best[owner])])
+
+    # first level at which the running fill reaches the whole amount
+    target = filled[starts] + 1
+    index = np.maximum(np.searchsorted(filled[1:], target - 1e-12), starts)
+    exhausted = index >= ends
+    index = np.minimum(index, ends)
+    level = np.minimum(index, len(prices) - 1)
+    rest = np.where(exhausted, 0, target - filled[index])
+    sold = np.where(exhausted, filled[index] - filled[starts], 1)
+    value = proceeds[index] - proceeds[starts] + rest * prices[level] / best
+    return value * best * amounts, sold * amounts
+
+
+@traced('render_table')
+def render_table(headers, table, floatfmt):
+    # The output of tabulate's simple format for a text column followed by
+    # float columns, without tabulate's type detection of every cell.
+    # floatfmt is one format for all columns or a list with one per column.
+    if isinstance(floatfmt, str):
+        floatfmt = [floatfmt] * len(headers)
+    columns = [[str(row[0]) for row in table]]
+    for index in range(1, len(headers)):
+        fmt = '{:' + floatfmt[index] + '}'
+        columns.append(['' if row[index] is None else fmt.format(row[index]) for row in table])
+    widths = [max([len(header) + 2] + [len(x) for x in column]) for header, column in zip(headers, columns)]
+
+    def line(cells):
+        return '  '.join(
+            [cells[0].ljust(widths[0])] + [x.rjust(width) for x, width in zip(cells[1:], widths[1:])]
+        )
+
+    lines = [line(headers), '  '.join('-' * width for width in widths)]
+    lines.extend(line(row) for row in zip(*columns))
+    return '\n'.join(lines)
@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+import json
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+from .crypto_assets import CURRENCIES
+from .tracing import TRACER
+
+
+class PortfolioService(object):
+    """Serve generate_crypto_table results per currency.
+
+    ``factory`` returns a CryptoAssets for a currency. A result is reused
+    for ``max_age`` seconds, and requests for a currency that is already
+    being computed wait for that computation instead of starting another.
+    """
+
+    def __init__(self, factory, max_age=60, latency_window=1000):
+        self.factory = factory
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._inflight = dict()
+        self._results = dict()
+        self._latencies = deque(maxlen=latency_window)
+        self.counters = {'requests': 0, 'hits': 0, 'coalesced': 0, 'fetches': 0, 'errors': 0}
+
+    def _compute(self, currency):
+        ca = self.factory(currency)
+        crypto_data = ca.parse_crypto_file()
+        if not crypto_data:
+            raise ValueError('No crypto data found')
+        headers, table = ca.generate_crypto_table(crypto_data)
+        if ca.cache is not None:
+            ca.cache.save()
+        return {'currency': currency, 'headers': headers, 'rows': table}
+
+    def table(self, currency):
+        start = time.time()
+        owner = False
+        with self._lock:
+            self.counters['requests'] += 1
+            cached = self._results.get(currency)
+            if cached and start - cached[0] <= self.max_age:
+                self.counters['hits'] += 1
+                future = None
+            elif currency in self._inflight:
+                self.counters['coalesced'] += 1
+                future = self._inflight[currency]
+            else:
+                self.counters['fetches'] += 1
+                future = self._inflight[currency] = Future()
+                owner = True
+
+        try:
+            if future is None:
+                return cached[1]
+            if owner:
+                try:
+                    result = self._compute(currency)
+                except Exception as e:
+                    future.set_exception(e)
+                else:
+                    with self._lock:
+                        self._results[currency] = (time.time(), result)
+                    future.set_result(result)
+                finally:
+                    with self._lock:
+                        del self._inflight[currency]
+            return future.result()
+        except Exception:
+            with self._lock:
+                self.counters['errors'] += 1
+            raise
+        finally:
+            with self._lock:
+                self._latencies.append(time.time() - start)
+
+    def metrics(self):
+        with self._lock:
+            metrics = dict(self.counters)
+            latencies = sorted(self._latencies)
+        served = metrics['hits'] + metrics['coalesced'] + metrics['fetches']
+        metrics['hit_rate'] = (metrics['hits'] + metrics['coalesced']) / served if served else 0
+        if latencies:
+            metrics['latency'] = {
+                'avg': sum(latencies) / len(latencies),
+                'p50': latencies[len(latencies) // 2],
+                'p99': latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))],
+                'max': latencies[-1],
+            }
+        return metrics
+
+
+class PortfolioHandler(BaseHTTPRequestHandler):
+    # GET /portfolio/<currency> for a table, /metrics for service metrics and
+    # /trace for the spans of a --profile run, ?format=prometheus for text
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status, body):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _send_text(self, status, text):
+        payload = text.encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        service = self.server.service
+        path, _, query = self.path.partition('?')
+        parts = [x for x in path.split('/') if x]
+        if parts == ['metrics']:
+            return self._send(200, service.metrics())
+        if parts == ['trace']:
+            if 'format=prometheus' in query.split('&'):
+                return self._send_text(200, TRACER.to_prometheus())
+            return self._send(200, TRACER.to_json())
+        if not parts or parts[0] != 'portfolio' or len(parts) > 2:
+            return self._send(404, {'error': 'Not found'})
+
+        currency = parts[1].lower() if len(parts) == 2 else self.server.currency
+        if currency.upper() not in CURRENCIES:
+            return self._send(404, {'error': 'Unknown currency: {}'.format(currency)})
+        try:
+            return self._send(200, service.table(currency))
+        except Exception as e:
+            return self._send(502, {'error': str(e)})
+
+
+class PortfolioServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, service, currency):
+        HTTPServer.__init__(self, address, PortfolioHandler)
+        self.service = service
+        self.currency = currency
@@ -0,0 +1,573 @@
+#!/usr/bin/env python
+import json
+import threading
+import time
+from collections import defaultdict, deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+
+import krakenex
+import numpy as np
+import requests
+
+from ..kraken.kraken import KrakenScheduler
+from ..kraken.store import KRAKEN_ASSETS
+from ..kraken.stream import KrakenTickerStream
+from .tracing import instrument, span, traced
+
+# Kraken asset codes of the currencies coins can be priced in
+KRAKEN_CURRENCIES = {
+    'AUD': 'ZAUD',
+    'BTC': 'XXBT',
+    'CAD': 'ZCAD',
+    'CHF': 'CHF',
+    'EUR': 'ZEUR',
+    'GBP': 'ZGBP',
+    'JPY': 'ZJPY',
+    'USD': 'ZUSD',
+}
+
+
+class PriceSource(object):
+    """Interface for anything that can price a list of held coins.
+
+    Implementations return a dict mapping ``website_slug`` to coinmarketcap
+    style ticker data, i.e. a dict containing at least ``website_slug`` and
+    ``quotes[CURRENCY]['price']``. ``iter_quotes`` yields the same data as
+    (slug, ticker) pairs, as soon as each coin is priced.
+    """
+
+    def quotes(self, slugs, currency):
+        raise NotImplementedError
+
+    def iter_quotes(self, slugs, currency):
+        return iter(self.quotes(slugs, currency).items())
+
+
+class CoinMarketCapSource(PriceSource):
+    """Batched quotes from the coinmarketcap v2 api.
+
+    The ticker endpoint returns at most ``PAGE_SIZE`` coins per call, ordered
+    by rank, so instead of requesting every coin separately we walk the
+    ticker pages and stop as soon as every held slug has been seen. With a
+    ``concurrency`` above one, that many pages are requested at a time.
+
+    With a ``ListingsIndex`` the listings are only downloaded into the index
+    when it is empty, refreshed in the background once it is older than
+    ``listings_ttl`` and updated with the coins of every ticker page. Held
+    coins can then also be given by symbol, and are returned by that name.
+    """
+    BASE_URL = 'https://api.coinmarketcap.com/v2/'
+    PAGE_SIZE = 100
+
+    def __init__(self, base_url=BASE_URL, session=None, timeout=30,
+                 cache=None, listings_ttl=86400, concurrency=1, index=None):
+        self.base_url = base_url
+        self.session = session or requests.Session()
+        self.timeout = timeout
+        self.cache = cache
+        self.listings_ttl = listings_ttl
+        self.concurrency = concurrency
+        self.index = index
+        self._refresh = None
+        self._refresh_lock = threading.Lock()
+
+    def _get(self, endpoint, params=None):
+        res = self.session.get(self.base_url + endpoint, params=params,
+                               timeout=self.timeout)
+        res.raise_for_status()
+        return res.json()
+
+    @traced('coinmarketcap.listings')
+    def listings(self):
+        return self._get('listings/')['data']
+
+    def slug_ids(self):
+        # Only the slug to id mapping of the listings is needed, so that is
+        # what gets cached instead of the whole listings payload
+        if self.cache is not None:
+            slug_ids = self.cache.get('slug_ids', self.listings_ttl)
+            if slug_ids is not None:
+                return slug_ids
+        slug_ids = dict((x['website_slug'], x['id']) for x in self.listings())
+        if self.cache is not None:
+            self.cache.set('slug_ids', slug_ids)
+        return slug_ids
+
+    def listings_index(self):
+        if not len(self.index):
+            self.index.update(self.listings())
+        elif self.index.age() > self.listings_ttl:
+            self.refresh_index()
+        return self.index
+
+    def refresh_index(self):
+        # Download the listings into the index in a thread, unless already
+        # doing so. The thread is not a daemon so a short run still waits
+        # for the refresh to finish before exiting.
+        with self._refresh_lock:
+            if self._refresh is None or not self._refresh.is_alive():
+                self._refresh = threading.Thread(target=self._refresh_index, name='listings-refresh')
+                self._refresh.start()
+            return self._refresh
+
+    def _refresh_index(self):
+        try:
+            self.index.update(self.listings())
+        except (ValueError, requests.RequestException):
+            # the stale index keeps working, the next run tries again
+            pass
+
+    def wanted(self, names):
+        # Map the slugs of the listed coins among names to the names used
+        # for them, and return the number of listed coins
+        if self.index is None:
+            slug_ids = self.slug_ids()
+            return dict((x, [x]) for x in set(names) if x in slug_ids), len(slug_ids)
+        index = self.listings_index()
+        wanted = defaultdict(list)
+        for name in set(names):
+            coin = index.lookup(name)
+            if coin is not None:
+                wanted[coin.slug].append(name)
+        return wanted, len(index)
+
+    @traced('coinmarketcap.ticker_page')
+    def ticker_page(self, start, currency):
+        return self._get('ticker/', params={
+            'start': start,
+            'limit': self.PAGE_SIZE,
+            'convert': currency.upper()
+        })['data']
+
+    def quotes(self, slugs, currency):
+        return dict(self.iter_quotes(slugs, currency))
+
+    def iter_quotes(self, slugs, currency):
+        wanted, count = self.wanted(slugs)
+        pending = set(wanted)
+        starts = list(range(1, count + 1, self.PAGE_SIZE))
+        seen = list()
+        while pending and starts:
+            wave, starts = starts[:self.concurrency], starts[self.concurrency:]
+            if len(wave) > 1:
+                with ThreadPoolExecutor(len(wave)) as pool:
+                    pages = list(pool.map(lambda start: self.ticker_page(start, currency), wave))
+            else:
+                pages = [self.ticker_page(start, currency) for start in wave]
+            for page in pages:
+                seen.extend(page.values())
+                for ticker in page.values():
+                    slug = ticker['website_slug']
+                    if slug in pending:
+                        pending.discard(slug)
+                        for name in wanted[slug]:
+                            yield name, ticker if name == slug else dict(ticker, website_slug=name)
+                if len(page) < self.PAGE_SIZE:
+                    starts = list()
+        if self.index is not None and seen:
+            self.index.update(seen, complete=False)
+
+
+class KrakenSource(PriceSource):
+    """Last trade prices from the Kraken public Ticker endpoint.
+
+    Held slugs are mapped to Kraken assets with ``KRAKEN_ASSETS`` plus
+    ``asset_map``, and priced through the asset pair against the currency,
+    or its inverse. Coins Kraken does not trade are left out. The asset
+    pairs are looked up once per ``pairs_ttl``, after that a single Ticker
+    call prices all held coins. ``books`` fetches the order books of held
+    coins, ``concurrency`` at a time, and keeps them for ``book_ttl``
+    seconds.
+    """
+
+    def __init__(self, session=None, timeout=30, cache=None, pairs_ttl=86400, asset_map=None,
+                 book_ttl=10, concurrency=8):
+        self.api = krakenex.API()
+        if session is not None:
+            self.api.session = session
+        instrument(self.api.session)
+        self.timeout = timeout
+        self.cache = cache
+        self.pairs_ttl = pairs_ttl
+        self.book_ttl = book_ttl
+        self.concurrency = concurrency
+        self.scheduler = KrakenScheduler()
+        self._books = dict()
+        self.assets = dict()
+        for asset, slug in sorted(dict(KRAKEN_ASSETS, **(asset_map or {})).items()):
+            # staked variants like XBT.M share the slug of the plain asset
+            if '.' not in asset:
+                self.assets.setdefault(slug, asset)
+
+    def _query(self, method, data=None):
+        with span('kraken.' + method):
+            res = self.api.query_public(method, data, timeout=self.timeout)
+        if res['error']:
+            raise ValueError(', '.join(res['error']))
+        return res['result']
+
+    def asset_pairs(self, websocket=False):
+        # 'BASE:QUOTE' asset codes to pair name, or to the websocket name of
+        # the pair, dark pool pairs left out
+        key = 'kraken_ws_pairs' if websocket else 'kraken_pairs'
+        if self.cache is not None:
+            pairs = self.cache.get(key, self.pairs_ttl)
+            if pairs is not None:
+                return pairs
+        result = self._query('AssetPairs')
+        pairs = dict(
+            ('{}:{}'.format(x['base'], x['quote']), name)
+            for name, x in result.items() if not name.endswith('.d')
+        )
+        ws_pairs = dict(
+            ('{}:{}'.format(x['base'], x['quote']), x['wsname'])
+            for name, x in result.items() if not name.endswith('.d') and 'wsname' in x
+        )
+        if self.cache is not None:
+            self.cache.set('kraken_pairs', pairs)
+            self.cache.set('kraken_ws_pairs', ws_pairs)
+        return ws_pairs if websocket else pairs
+
+    def lookup(self, wanted, websocket=False):
+        # Map the pair names of the (base, quote) asset code pairs Kraken has
+        # a market for to those pairs and whether the market is inverse
+        pairs = self.asset_pairs(websocket)
+        lookup = dict()
+        for base, quote in wanted:
+            if '{}:{}'.format(base, quote) in pairs:
+                lookup.setdefault(pairs['{}:{}'.format(base, quote)], []).append((base, quote, False))
+            elif '{}:{}'.format(quote, base) in pairs:
+                lookup.setdefault(pairs['{}:{}'.format(quote, base)], []).append((base, quote, True))
+        return lookup
+
+    def held_pairs(self, slugs, currency):
+        # (asset, currency) asset code pair of every held slug Kraken lists
+        quote = KRAKEN_CURRENCIES.get(currency.upper())
+        if quote is None:
+            return dict()
+        return dict(((self.assets[slug], quote), slug) for slug in slugs if slug in self.assets)
+
+    def prices(self, wanted):
+        # Price of each (base, quote) asset code pair Kraken has a market for
+        lookup = self.lookup(wanted)
+        if not lookup:
+            return dict()
+
+        prices = dict()
+        for name, ticker in self._query('Ticker', {'pair': ','.join(sorted(lookup))}).items():
+            price = float(ticker['c'][0])
+            for base, quote, inverse in lookup.get(name, []):
+                prices[(base, quote)] = 1 / price if inverse else price
+        return prices
+
+    def quotes(self, slugs, currency):
+        wanted = self.held_pairs(slugs, currency)
+        if not wanted:
+            return dict()
+        return dict(
+            (wanted[pair], {'website_slug': wanted[pair], 'quotes': {currency.upper(): {'price': price}}})
+            for pair, price in self.prices(wanted).items()
+        )
+
+    def depth(self, name, count=500):
+        # Bids and asks of a pair as arrays of [price, volume] levels, None
+        # when they could not be fetched. Rate limit errors are retried with
+        # backoff, but calls are not paced.
+        cached = self._books.get((name, count))
+        if cached is not None and time.monotonic() - cached[0] < self.book_ttl:
+            return cached[1]
+        with span('kraken.Depth'):
+            res = self.scheduler.call(
+                lambda method, data: self.api.query_public(method, data, timeout=self.timeout),
+                'Depth', {'pair': name, 'count': count}, private=False
+            )
+        if not res or res['error']:
+            return None
+        book = next(iter(res['result'].values()))
+        book = dict(
+            (side, np.array([x[:2] for x in book[side]], float).reshape(-1, 2)) for side in ('bids', 'asks')
+        )
+        self._books[(name, count)] = (time.monotonic(), book)
+        return book
+
+    @traced('kraken.books')
+    def books(self, slugs, currency, count=500):
+        """Bids for the held coins of slugs, as arrays of prices and volumes.
+
+        Prices are in currency per coin and best first, markets quoted the
+        other way around are converted from their asks. Coins without a
+        market or whose book could not be fetched are left out.
+        """
+        wanted = self.held_pairs(slugs, currency)
+        if not wanted:
+            return dict()
+        lookup = self.lookup(wanted)
+        if not lookup:
+            return dict()
+        with ThreadPoolExecutor(min(self.concurrency, len(lookup))) as pool:
+            fetched = dict(zip(lookup, pool.map(lambda name: self.depth(name, count), lookup)))
+
+        books = dict()
+        for name, book in fetched.items():
+            if book is None:
+                continue
+            for base, quote, inverse in lookup[name]:
+                levels = book['asks' if inverse else 'bids']
+                if inverse:
+                    # selling the coin buys the quote asset at the asks
+                    books[wanted[(base, quote)]] = (1 / levels[:, 0], levels[:, 0] * levels[:, 1])
+                else:
+                    books[wanted[(base, quote)]] = (levels[:, 0], levels[:, 1])
+        return books
+
+    def rates(self, pairs):
+        # Fiat exchange rates as FiatRates stores them, e.g. {'EUR_USD': 1.1}
+        wanted = dict(
+            ((KRAKEN_CURRENCIES[base], KRAKEN_CURRENCIES[quote]), '{}_{}'.format(base, quote))
+            for base, quote in pairs if base in KRAKEN_CURRENCIES and quote in KRAKEN_CURRENCIES
+        )
+        if not wanted:
+            return dict()
+        return dict((wanted[pair], price) for pair, price in self.prices(wanted).items())
+
+
+class KrakenStreamSource(PriceSource):
+    """Quotes pushed by the Kraken websocket ticker feed.
+
+    Held coins are resolved to pairs like ``KrakenSource`` does. The first
+    quotes of a pair subscribe to it and wait up to ``wait`` seconds for its
+    ticker, after that quotes are answered from memory without any request.
+    Prices older than ``max_age`` seconds, such as the last ones seen before
+    the feed dropped, are waited for again and left out when they do not
+    arrive, so a hedged source asks another backend for them.
+    """
+
+    def __init__(self, kraken, stream=None, wait=5, max_age=60):
+        self.kraken = kraken
+        self.stream = stream or KrakenTickerStream()
+        self.wait = wait
+        self.max_age = max_age
+
+    def quotes(self, slugs, currency):
+        wanted = self.kraken.held_pairs(slugs, currency)
+        if not wanted:
+            return dict()
+        lookup = self.kraken.lookup(wanted, websocket=True)
+        self.stream.subscribe(lookup)
+        quotes = dict()
+        for name, price in self.stream.wait(lookup, self.wait, self.max_age).items():
+            for base, quote, inverse in lookup[name]:
+                slug = wanted[(base, quote)]
+                quotes[slug] = {
+                    'website_slug': slug, 'quotes': {currency.upper(): {'price': 1 / price if inverse else price}}
+                }
+        return quotes
+
+
+class FileSource(PriceSource):
+    """Quotes from a local json file of ``{CURRENCY: {slug: price}}``.
+
+    Serves as an offline backend, e.g. for coins no other source lists.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return dict()
+
+    def quotes(self, slugs, currency):
+        prices = self._load().get(currency.upper(), {})
+        return dict(
+            (slug, {'website_slug': slug, 'quotes': {currency.upper(): {'price': prices[slug]}}})
+            for slug in slugs if slug in prices
+        )
+
+
+class HedgedPriceSource(PriceSource):
+    """Ask several price sources, fastest first, tolerating slow or failing ones.
+
+    Sources are ranked by their median latency over the last ``window``
+    calls, sources that failed within ``cooldown`` seconds last. The best one is asked first;
+    when it has not answered after ``hedge_after`` seconds the next one is
+    asked as well and the first answer wins, when it fails the next one is
+    asked straight away. Coins a source could not price are asked from the
+    sources still running, then from the remaining sources. Calls run in
+    daemon threads, so a slow call abandoned once every coin is priced does
+    not hold up anything, and per source counters are kept in ``stats``.
+    Coins still unpriced after a source failed raise ``ValueError``, as
+    that source may well have known them.
+    """
+
+    def __init__(self, sources, hedge_after=1.0, cooldown=60, window=20, clock=time.monotonic):
+        self.sources = list(sources)
+        self.hedge_after = hedge_after
+        self.cooldown = cooldown
+        self.clock = clock
+        self.stats = defaultdict(lambda: {
+            'calls': 0, 'failures': 0, 'hedges': 0, 'wins': 0, 'latency': None, 'failed_at': None
+        })
+        self._latencies = defaultdict(lambda: deque(maxlen=window))
+        self._lock = threading.Lock()
+        self._names = dict()
+        for index, source in enumerate(self.sources):
+            name = type(source).__name__
+            self._names[id(source)] = name if name not in self._names.values() else '{}-{}'.format(name, index)
+
+    def name(self, source):
+        # Stats key of source, its class name unless several share a class
+        return self._names[id(source)]
+
+    def ranked(self):
+        now = self.clock()
+
+        def score(source):
+            stats = self.stats[self.name(source)]
+            failed = stats['failed_at'] is not None and now - stats['failed_at'] < self.cooldown
+            return (failed, stats['latency'] or 0)
+        with self._lock:
+            return sorted(self.sources, key=score)
+
+    def _call(self, source, slugs, currency):
+        stats = self.stats[self.name(source)]
+        start = self.clock()
+        with self._lock:
+            stats['calls'] += 1
+        try:
+            result = source.quotes(slugs, currency)
+        except Exception:
+            with self._lock:
+                stats['failures'] += 1
+                stats['failed_at'] = self.clock()
+            raise
+        latencies = self._latencies[self.name(source)]
+        with self._lock:
+            # a median is not thrown off by the odd slow call, hedging is
+            # what takes care of those
+            latencies.append(self.clock() - start)
+            stats['latency'] = sorted(latencies)[len(latencies) // 2]
+            stats['failed_at'] = None
+        return result
+
+    def _start(self, source, slugs, currency):
+        future = Future()
+
+        def run():
+            try:
+                future.set_result(self._call(source, slugs, currency))
+            except Exception as e:
+                future.set_exception(e)
+        threading.Thread(target=run, daemon=True).start()
+        return future
+
+    def _race(self, candidates, slugs, currency):
+        # Quotes of the first sources to answer, hedging and failing over
+        # through candidates, with the sources that were started and the
+        # last error. When the first answer leaves coins unpriced, the
+        # sources still running are waited for as well; they are only
+        # abandoned once every coin has a quote.
+        waiting = list(candidates)
+        running = dict()
+        started = list()
+        result = None
+        error = None
+        done = None
+        while waiting or running:
+            if waiting and (not running or not done):
+                source = waiting.pop(0)
+                running[self._start(source, slugs, currency)] = source
+                started.append(source)
+            done, _ = wait(running, self.hedge_after if waiting else None, FIRST_COMPLETED)
+            if not done:
+                with self._lock:
+                    self.stats[self.name(waiting[0])]['hedges'] += 1
+                continue
+            for future in done:
+                source = running.pop(future)
+                if future.exception() is not None:
+                    error = future.exception()
+                    continue
+                if result is None:
+                    with self._lock:
+                        self.stats[self.name(source)]['wins'] += 1
+                    result = dict()
+                for slug, ticker in future.result().items():
+                    result.setdefault(slug, ticker)
+            if result is not None and (not running or all(x in result for x in slugs)):
+                break
+        return result, started, error
+
+    def quotes(self, slugs, currency):
+        pending = set(slugs)
+        ticker_data = dict()
+        asked = list()
+        error = None
+        while pending:
+            candidates = [x for x in self.ranked() if x not in asked]
+            if not candidates:
+                break
+            result, started, race_error = self._race(candidates, sorted(pending), currency)
+            asked.extend(started)
+            error = race_error or error
+            for slug, ticker in (result or {}).items():
+                if slug in pending:
+                    pending.discard(slug)
+                    ticker_data[slug] = ticker
+        if error is not None and not ticker_data:
+            raise error
+        # coins left unpriced are only unknown when every source that was
+        # asked for them answered
+        if pending and error is not None:
+            raise ValueError('No quotes for {}, not every price source answered: {}'.format(
+                ', '.join(sorted(pending)), error
+            ))
+        return ticker_data
+
+
+class CachedPriceSource(PriceSource):
+    """Serve quotes from a DiskCache, only asking ``source`` for stale coins.
+
+    Coins the source does not know are cached as well, so they do not
+    trigger a lookup on every run. In ``offline`` mode cached quotes of any
+    age are used and ``source`` is never called.
+    """
+    _missing = object()
+
+    def __init__(self, source, cache, ttl=300, offline=False):
+        self.source = source
+        self.cache = cache
+        self.ttl = ttl
+        self.offline = offline
+
+    def quotes(self, slugs, currency):
+        return dict(self.iter_quotes(slugs, currency))
+
+    def iter_quotes(self, slugs, currency):
+        # Cached quotes come first, then the stale ones as the source
+        # yields them
+        max_age = None if self.offline else self.ttl
+        stale = list()
+        for slug in set(slugs):
+            ticker = self.cache.get(self._key(slug, currency), max_age, self._missing)
+            if ticker is self._missing:
+                stale.append(slug)
+            elif ticker is not None:
+                yield slug, ticker
+
+        if stale and not self.offline:
+            unknown = set(stale)
+            for slug, ticker in self.source.iter_quotes(stale, currency):
+                unknown.discard(slug)
+                self.cache.set(self._key(slug, currency), ticker)
+                yield slug, ticker
+            for slug in unknown:
+                self.cache.set(self._key(slug, currency), None)
+
+    @staticmethod
+    def _key(slug, currency):
+        return 'quote:{}:{}'.format(currency.lower(), slug)
@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+import json
+import os
+import zlib
+
+import numpy as np
+
+# One record per compressed chunk: time range, position in chunks.bin, rows
+INDEX_DTYPE = np.dtype([
+    ('start', '<f8'),
+    ('end', '<f8'),
+    ('offset', '<u8'),
+    ('size', '<u4'),
+    ('rows', '<u4'),
+])
+
+
+class SeriesStore(object):
+    """Append-only, compressed series of numpy records ordered by ``time``.
+
+    Records are gathered in an uncompressed tail file until ``chunk_rows``
+    of them are compressed into ``chunks.bin``: column by column, with the
+    bytes of every value shuffled so zlib sees the slowly changing high
+    bytes together. ``chunks.idx`` holds the time range and position of
+    every chunk. Both the index and the tail are memory-mapped, so a range
+    read only decompresses the chunks it overlaps.
+
+    ``meta.json`` is written last and is the commit point of an append:
+    data past what it counts is left over from an interrupted append and
+    ignored, then overwritten. It also keeps a ``cursor`` to resume from.
+    """
+
+    def __init__(self, path, dtype, chunk_rows=4096):
+        self.path = path
+        self.dtype = np.dtype(dtype)
+        self.chunk_rows = chunk_rows
+        self.meta_path = os.path.join(path, 'meta.json')
+        self.chunks_path = os.path.join(path, 'chunks.bin')
+        self.index_path = os.path.join(path, 'chunks.idx')
+
+    def meta(self):
+        try:
+            with open(self.meta_path) as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return {'chunks': 0, 'tail': 0, 'rows': 0, 'size': 0, 'cursor': None}
+
+    def _tail_path(self, chunks):
+        # a new tail file per chunk count, so rolling the tail into a chunk
+        # never touches the committed tail
+        return os.path.join(self.path, 'tail.{}.bin'.format(chunks))
+
+    @property
+    def cursor(self):
+        return self.meta()['cursor']
+
+    def __len__(self):
+        return self.meta()['rows']
+
+    def _index(self, meta):
+        if not meta['chunks']:
+            return np.zeros(0, INDEX_DTYPE)
+        return np.memmap(self.index_path, dtype=INDEX_DTYPE, mode='r', shape=(meta['chunks'],))
+
+    def _tail(self, meta):
+        if not meta['tail']:
+            return np.zeros(0, self.dtype)
+        return np.memmap(self._tail_path(meta['chunks']), dtype=self.dtype, mode='r', shape=(meta['tail'],))
+
+    def last_time(self):
+        # Time of the newest record, None when empty
+        meta = self.meta()
+        if meta['tail']:
+            return float(self._tail(meta)['time'][-1])
+        if meta['chunks']:
+            return float(self._index(meta)['end'][-1])
+        return None
+
+    def _compress(self, rows):
+        columns = list()
+        for name in self.dtype.names:
+            column = np.ascontiguousarray(rows[name])
+            columns.append(column.view(np.uint8).reshape(len(rows), column.itemsize).T.tobytes())
+        return zlib.compress(b''.join(columns), 6)
+
+    def _decompress(self, data, rows):
+        data = zlib.decompress(data)
+        result = np.empty(rows, self.dtype)
+        offset = 0
+        for name in self.dtype.names:
+            size = self.dtype[name].itemsize
+            shuffled = np.frombuffer(data, np.uint8, rows * size, offset).reshape(size, rows)
+            result[name] = shuffled.T.copy().view(self.dtype[name]).reshape(rows)
+            offset += rows * size
+        return result
+
+    def append(self, rows, cursor=None):
+        """Add records newer than the stored ones and commit ``cursor``."""
+        rows = np.asarray(rows, self.dtype)
+        meta = self.meta()
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+
+        chunks = meta['chunks']
+        if meta['tail'] + len(rows) < self.chunk_rows:
+            with open(self._tail_path(chunks), 'ab') as f:
+                f.truncate(meta['tail'] * self.dtype.itemsize)
+                f.write(rows.tobytes())
+            tail = meta['tail'] + len(rows)
+            old_tail = None
+        else:
+            pending = np.concatenate([self._tail(meta), rows])
+            full = len(pending) // self.chunk_rows
+            size = meta['size']
+            records = np.zeros(full, INDEX_DTYPE)
+            with open(self.chunks_path, 'ab') as f:
+                f.truncate(size)
+                for i in range(full):
+                    block = pending[i * self.chunk_rows:(i + 1) * self.chunk_rows]
+                    data = self._compress(block)
+                    f.write(data)
+                    records[i] = (block['time'][0], block['time'][-1], size, len(data), len(block))
+                    size += len(data)
+            with open(self.index_path, 'ab') as f:
+                f.truncate(chunks * INDEX_DTYPE.itemsize)
+                f.write(records.tobytes())
+            with open(self._tail_path(chunks + full), 'wb') as f:
+                f.write(pending[full * self.chunk_rows:].tobytes())
+            old_tail = self._tail_path(chunks)
+            meta['size'] = size
+            chunks += full
+            tail = len(pending) - full * self.chunk_rows
+
+        meta.update(chunks=chunks, tail=tail, rows=meta['rows'] + len(rows))
+        if cursor is not None:
+            meta['cursor'] = cursor
+        tmp_path = self.meta_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, self.meta_path)
+        if old_tail is not None and os.path.exists(old_tail):
+            os.remove(old_tail)
+
+    def read(self, start=None, end=None):
+        """Records with ``start <= time < end``, either bound may be None."""
+        meta = self.meta()
+        index = self._index(meta)
+        first = 0 if start is None else int(np.searchsorted(index['end'], start, 'left'))
+        last = len(index) if end is None else int(np.searchsorted(index['start'], end, 'left'))
+        parts = list()
+        if last > first:
+            data = np.memmap(self.chunks_path, dtype=np.uint8, mode='r', shape=(meta['size'],))
+            for record in index[first:last]:
+                parts.append(self._decompress(data[record['offset']:record['offset'] + record['size']],
+                                              int(record['rows'])))
+        parts.append(np.asarray(self._tail(meta)))
+        rows = np.concatenate(parts)
+        lo = 0 if start is None else np.searchsorted(rows['time'], start, 'left')
+        hi = len(rows) if end is None else np.searchsorted(rows['time'], end, 'left')
+        return rows[lo:hi]
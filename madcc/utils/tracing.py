@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+import functools
+import json
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import urlparse
+
+from tabulate import tabulate
+
+
+class Tracer(object):
+    """Timed spans and http traffic of a run, for profiling and monitoring.
+
+    Disabled tracers record nothing and traced calls only pay for checking
+    ``enabled``. Spans are aggregated per name into calls, total and max
+    seconds; http responses per host into requests, errors, bytes sent and
+    received, and seconds.
+    """
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.spans = dict()
+            self.http = dict()
+
+    def record(self, name, seconds):
+        with self._lock:
+            span = self.spans.get(name)
+            if span is None:
+                span = self.spans[name] = {'calls': 0, 'seconds': 0.0, 'max': 0.0}
+            span['calls'] += 1
+            span['seconds'] += seconds
+            span['max'] = max(span['max'], seconds)
+
+    @contextmanager
+    def span(self, name):
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def record_response(self, response, *args, **kwargs):
+        # requests response hook, see instrument
+        if not self.enabled:
+            return
+        body = response.request.body if response.request is not None else None
+        netloc = urlparse(response.url).netloc
+        with self._lock:
+            host = self.http.get(netloc)
+            if host is None:
+                host = self.http[netloc] = {
+                    'requests': 0, 'errors': 0, 'bytes_sent': 0, 'bytes_received': 0, 'seconds': 0.0
+                }
+            host['requests'] += 1
+            host['errors'] += response.status_code >= 400
+            host['bytes_sent'] += len(body.encode() if isinstance(body, str) else body or b'')
+            host['bytes_received'] += len(response.content)
+            host['seconds'] += response.elapsed.total_seconds() if response.elapsed else 0
+
+    def to_json(self):
+        with self._lock:
+            return {
+                'spans': dict((k, dict(v)) for k, v in self.spans.items()),
+                'http': dict((k, dict(v)) for k, v in self.http.items()),
+            }
+
+    def to_prometheus(self, prefix='madcc'):
+        data = self.to_json()
+        metrics = (
+            ('span_calls_total', 'counter', 'spans', 'span', 'calls'),
+            ('span_seconds_total', 'counter', 'spans', 'span', 'seconds'),
+            ('span_seconds_max', 'gauge', 'spans', 'span', 'max'),
+            ('http_requests_total', 'counter', 'http', 'host', 'requests'),
+            ('http_errors_total', 'counter', 'http', 'host', 'errors'),
+            ('http_sent_bytes_total', 'counter', 'http', 'host', 'bytes_sent'),
+            ('http_received_bytes_total', 'counter', 'http', 'host', 'bytes_received'),
+            ('http_seconds_total', 'counter', 'http', 'host', 'seconds'),
+        )
+        lines = list()
+        for name, kind, group, label, key in metrics:
+            lines.append('# TYPE {}_{} {}'.format(prefix, name, kind))
+            for value_name, values in sorted(data[group].items()):
+                lines.append('{}_{}{{{}="{}"}} {}'.format(
+                    prefix, name, label, value_name.replace('"', '\\"'), values[key]))
+        return '\n'.join(lines) + '\n'
+
+    def report(self):
+        # Plain text breakdown, slowest spans first
+        data = self.to_json()
+        spans = sorted(data['spans'].items(), key=lambda x: x[1]['seconds'], reverse=True)
+        hosts = sorted(data['http'].items())
+        return '\n\n'.join([
+            tabulate(
+                [(name, x['calls'], x['seconds'], 1000 * x['seconds'] / x['calls'], 1000 * x['max'])
+                 for name, x in spans],
+                headers=['span', 'calls', 'total s', 'avg ms', 'max ms'], floatfmt='.3f'
+            ),
+            tabulate(
+                [(host, x['requests'], x['errors'], x['bytes_sent'], x['bytes_received'], x['seconds'])
+                 for host, x in hosts],
+                headers=['host', 'requests', 'errors', 'sent', 'received', 'total s'], floatfmt='.3f'
+            ),
+        ])
+
+
+TRACER = Tracer()
+
+
+def traced(name):
+    # Decorator recording every call of the function as a span of name
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not TRACER.enabled:
+                return func(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                TRACER.record(name, time.perf_counter() - start)
+        return wrapper
+    return decorate
+
+
+def span(name):
+    return TRACER.span(name)
+
+
+def instrument(session):
+    # Count the http traffic of a requests session
+    if TRACER.record_response not in session.hooks['response']:
+        session.hooks['response'].append(TRACER.record_response)
+    return session
+
+
+EXPORTS = ('text', 'json', 'prometheus')
+
+
+def profile_format(args):
+    # The export format of a --profile flag in clint args, None without it
+    if '--profile' not in args.grouped:
+        return None
+    fmt = next(iter(args.grouped.get('--profile', [])), 'text')
+    # clint groups a following currency or subcommand with the flag
+    return fmt if fmt in EXPORTS else 'text'
+
+
+def export(fmt):
+    # The collected spans as 'text', 'json' or 'prometheus'
+    if fmt == 'json':
+        return json.dumps(TRACER.to_json(), indent=2, sort_keys=True)
+    if fmt == 'prometheus':
+        return TRACER.to_prometheus()
+    return TRACER.report()
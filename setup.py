@@ -34,10 +34,11 @@ setup(
 
     install_requires=[
         'clint',
-        'coinmarketcap',
         'krakenex',
+        'numpy',
         'requests',
         'tabulate',
+        'websocket-client',
     ],
     python_requires='~=3.4',
 
@@ -45,6 +46,7 @@ setup(
         'console_scripts': [
             'kraken_limits=madcc.entrypoints.kraken_limits:main',
             'crypto_assets=madcc.entrypoints.crypto_assets:main',
+            'kraken_history=madcc.entrypoints.kraken_history:main',
         ],
     },
     setup_requires=[
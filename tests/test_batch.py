@@ -0,0 +1,77 @@
+import pytest
+
+from madcc.utils import batch
+from madcc.utils.batch import find_crypto_files, parse_crypto_files, value_crypto_files
+from madcc.utils.crypto_assets import CryptoAssets
+
+config = {'currency_api': 'https://free.currencyconverterapi.com/api/v6/convert'}
+
+ticker_data = [
+    {'website_slug': 'bitcoin', 'quotes': {'EUR': {'price': 100.0}}},
+    {'website_slug': 'ethereum', 'quotes': {'EUR': {'price': 10.0}}},
+]
+
+
+@pytest.fixture
+def crypto_dir(tmpdir):
+    tmpdir.join('alice.txt').write('# cryptocurrency\n- bitcoin 1\n- eur 50\n')
+    tmpdir.join('bob.txt').write('# cryptocurrency\n- bitcoin 2\n- ethereum 5\n    - on a ledger\n')
+    tmpdir.join('carol.txt').write('# cryptocurrency\n- dogecoin 100\n')
+    tmpdir.join('dave.txt').write('just notes\n')
+    tmpdir.mkdir('archive')
+    return tmpdir
+
+
+def test_find_crypto_files(crypto_dir):
+    names = ['alice.txt', 'bob.txt', 'carol.txt', 'dave.txt']
+    assert find_crypto_files(str(crypto_dir)) == [str(crypto_dir.join(x)) for x in names]
+    assert find_crypto_files(str(crypto_dir.join('[ab]*.txt'))) == [str(crypto_dir.join(x)) for x in names[:2]]
+
+
+def test_parse_crypto_files_pool(crypto_dir, mocker):
+    mocker.patch.object(batch, 'POOL_MIN_FILES', 0)
+    paths = find_crypto_files(str(crypto_dir)) + [str(crypto_dir.join('missing.txt'))]
+
+    assert parse_crypto_files(paths, processes=2) == parse_crypto_files(paths, processes=1) == [
+        [['bitcoin', '1'], ['eur', '50']],
+        [['bitcoin', '2'], ['ethereum', '5']],
+        [['dogecoin', '100']],
+        [],
+        None,
+    ]
+
+
+def test_value_crypto_files(crypto_dir, mocker):
+    source = mocker.Mock()
+    source.quotes.return_value = dict((x['website_slug'], x) for x in ticker_data)
+    fiat_rates = mocker.Mock()
+    ca = CryptoAssets(config, 'eur', 2, price_source=source, fiat_rates=fiat_rates)
+    paths = find_crypto_files(str(crypto_dir)) + [str(crypto_dir.join('missing.txt'))]
+    result = value_crypto_files(ca, paths)
+
+    # the prices of all coins of all files are retrieved at once
+    source.quotes.assert_called_once()
+    assert sorted(source.quotes.call_args[0][0]) == ['bitcoin', 'dogecoin', 'ethereum']
+    fiat_rates.fetch.assert_called_once_with([('eur', 'eur')])
+
+    assert list(result.portfolios) == paths[:2]
+    assert result.portfolios[paths[0]].total == 150.0
+    assert result.portfolios[paths[1]].total == 250.0
+    assert result.total.symbols == ['bitcoin', 'eur', 'ethereum']
+    assert result.total.amounts.tolist() == [3.0, 50.0, 5.0]
+    assert result.total.total == 400.0
+    assert result.errors == {
+        paths[2]: 'Unable to price dogecoin',
+        paths[3]: 'No assets found',
+        paths[4]: 'Unable to open crypto_data file',
+    }
+
+
+def test_value_crypto_files_nothing_held(crypto_dir, mocker):
+    source = mocker.Mock()
+    ca = CryptoAssets(config, 'eur', 2, price_source=source, fiat_rates=mocker.Mock())
+    result = value_crypto_files(ca, [str(crypto_dir.join('dave.txt'))])
+
+    source.quotes.assert_not_called()
+    assert result.portfolios == {}
+    assert result.total is None
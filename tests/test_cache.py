@@ -0,0 +1,67 @@
+from madcc.utils import cache as cache_module
+from madcc.utils.cache import DiskCache
+
+
+def test_disk_cache_roundtrip(tmpdir):
+    path = str(tmpdir.join('cache.json'))
+    cache = DiskCache(path)
+    cache.set('bitcoin', {'price': 1})
+    cache.save()
+
+    assert DiskCache(path).get('bitcoin') == {'price': 1}
+
+
+def test_disk_cache_max_age(tmpdir, mocker):
+    cache = DiskCache(str(tmpdir.join('cache.json')))
+    mocker.patch.object(cache_module.time, 'time', return_value=1000)
+    cache.set('bitcoin', 1)
+    cache_module.time.time.return_value = 1100
+
+    assert cache.get('bitcoin', max_age=200) == 1
+    assert cache.get('bitcoin', max_age=50) is None
+    assert cache.get('bitcoin', max_age=50, default=False) is False
+    assert cache.get('bitcoin') == 1
+
+
+def test_disk_cache_lru_eviction(tmpdir):
+    cache = DiskCache(str(tmpdir.join('cache.json')), max_entries=2)
+    cache.set('bitcoin', 1)
+    cache.set('ethereum', 2)
+    cache.get('bitcoin')
+    cache.set('litecoin', 3)
+
+    assert cache.get('ethereum') is None
+    assert cache.get('bitcoin') == 1
+    assert cache.get('litecoin') == 3
+
+
+def test_disk_cache_missing_or_corrupt_file(tmpdir):
+    tmpdir.join('cache.json').write('{not json')
+
+    assert DiskCache(str(tmpdir.join('cache.json'))).get('bitcoin') is None
+    assert DiskCache(str(tmpdir.join('nothing.json'))).get('bitcoin') is None
+
+
+def test_disk_cache_reads_do_not_rewrite(tmpdir, mocker):
+    path = str(tmpdir.join('cache.json'))
+    cache = DiskCache(path)
+    cache.set('bitcoin', 1)
+    cache.save()
+    cache = DiskCache(path)
+    replace = mocker.spy(cache_module.os, 'replace')
+    cache.get('bitcoin')
+    cache.save()
+
+    replace.assert_not_called()
+
+
+def test_disk_cache_concurrent_saves(tmpdir):
+    path = str(tmpdir.join('cache.json'))
+    caches = [DiskCache(path) for _ in range(3)]
+    for index, cache in enumerate(caches):
+        cache.set('bitcoin', index)
+    for cache in caches:
+        cache.save()
+
+    assert DiskCache(path).get('bitcoin') == 2
+    assert tmpdir.listdir() == [tmpdir.join('cache.json')]
@@ -1,7 +1,14 @@
+import json
+from urllib.parse import urlsplit
+
 import pytest
+import requests_mock
+from clint.arguments import Args
 
-from madcc.utils import crypto_assets
-from madcc.utils.crypto_assets import CryptoAssets
+from madcc import kraken
+from madcc.utils import crypto_assets, tracing
+from madcc.utils.cache import DiskCache
+from madcc.utils.crypto_assets import AsyncCryptoAssets, CryptoAssets
 from madcc.entrypoints import crypto_assets as crypto_assets_cli
 
 
@@ -59,15 +66,21 @@ eur         500.00   0.33         1.00       500.00
 total                                     152261.37"""
 
 
-def test_convert(mocker):
+def public_params(request):
+    # krakenex sends public calls as GET since 2.2, as POST before that
+    return request.text if request.method == 'POST' else urlsplit(request.url).query
+
+
+def test_convert():
     ca = CryptoAssets(config, 'USD', '')
-    mocker.patch('requests.get')
-    ca.convert('eur', 10)
+    with requests_mock.Mocker() as mock:
+        mock.get(config['currency_api'], json={'EUR_USD': {'val': 1.25}})
+        result = ca.convert('eur', 10)
+        ca.convert('eur', 20)
 
-    crypto_assets.requests.get.assert_called_with(
-        config['currency_api'],
-        params={'q': 'EUR_USD', 'compact': 'y'}
-    )
+    assert result == ['eur', 10, 1.25, 12.5]
+    assert mock.call_count == 1
+    assert mock.last_request.qs == {'q': ['eur_usd'], 'compact': ['y']}
 
 
 def test_convert_same():
@@ -84,6 +97,44 @@ def test_parse_crypto_file(mocker):
     assert result == parsed_crypto_file
 
 
+def test_iter_crypto_sections():
+    lines = [
+        '# cryptocurrency\n', '- bitcoin 1\n', '# cryptocurrency cold\n', '- ethereum 2\n',
+        '    - comment\n', '# other\n', '- dogecoin 3\n', '# cryptocurrency hot\n', '- litecoin 4\n'
+    ]
+
+    assert list(crypto_assets.iter_crypto_sections(lines)) == [('', ['bitcoin', '1'])]
+    assert list(crypto_assets.iter_crypto_sections(lines, ['hot', 'cold'])) == [
+        ('cold', ['ethereum', '2']), ('hot', ['litecoin', '4'])
+    ]
+
+
+def test_iter_crypto_sections_stops_at_closing_heading():
+    def lines():
+        yield '# cryptocurrency\n'
+        yield '- bitcoin 1\n'
+        yield '# closing hash\n'
+        raise AssertionError('read past the closing heading')
+
+    assert list(crypto_assets.iter_crypto_sections(lines())) == [('', ['bitcoin', '1'])]
+
+
+def test_parse_crypto_file_cached(tmpdir, mocker):
+    crypto_file = tmpdir.join('crypto.txt')
+    crypto_file.write(raw_crypto_file)
+    cache = DiskCache(str(tmpdir.join('cache.json')))
+    ca = CryptoAssets(dict(config, crypto_file=str(crypto_file)), 'eur', '', cache=cache)
+
+    assert ca.parse_crypto_file() == parsed_crypto_file
+    mocker.patch.object(crypto_assets, 'iter_crypto_sections')
+    assert ca.parse_crypto_file() == parsed_crypto_file
+    crypto_assets.iter_crypto_sections.assert_not_called()
+
+    crypto_file.write(raw_crypto_file.replace('12.05', '13'))
+    crypto_assets.iter_crypto_sections.return_value = iter([('', ['bitcoin', '13'])])
+    assert ca.parse_crypto_file() == [['bitcoin', '13']]
+
+
 def test_parse_crypto_file_fail_open(mocker):
     ca = CryptoAssets(config, 'eur', '')
     with mocker.mock_module.patch('builtins.open', mocker.mock_open()) as m:
@@ -95,11 +146,13 @@ def test_parse_crypto_file_fail_open(mocker):
 
 
 def test_retrieve_ticker_data(mocker):
-    ca = CryptoAssets(config, 'eur', '')
-    mocker.patch('coinmarketcap.Market.ticker')
+    source = mocker.Mock()
+    source.quotes.return_value = {x['website_slug']: x for x in full_ticker_data}
+    ca = CryptoAssets(config, 'eur', '', price_source=source)
     result = ca.retrieve_ticker_data(parsed_crypto_file)
 
-    crypto_assets.Market.ticker.assert_called_with(1027, convert='eur')
+    source.quotes.assert_called_once_with(['bitcoin', 'ethereum', 'litecoin'], 'eur')
+    assert result == full_ticker_data
 
 
 def test_generate_crypto_table(mocker):
@@ -110,6 +163,81 @@ def test_generate_crypto_table(mocker):
     assert result == generated_crypto_table
 
 
+def test_generate_crypto_table_aggregates_holdings(mocker):
+    ca = CryptoAssets(config, 'eur', '')
+    mocker.patch.object(ca, 'retrieve_ticker_data', return_value=full_ticker_data)
+    split_crypto_file = [['bitcoin', '10'], ['ethereum', '80.2'], ['bitcoin', '2.05'], ['eur', '500']]
+    headers, table = ca.generate_crypto_table(split_crypto_file)
+
+    assert [x[0] for x in table] == ['bitcoin', 'ethereum', 'eur', 'total']
+    assert table[0][1] == pytest.approx(12.05)
+
+
+def test_aggregate_holdings():
+    ca = CryptoAssets(config, 'eur', '')
+    result = ca.aggregate_holdings([['bitcoin', '1'], ['eur', '5'], ['bitcoin', '0.5']])
+
+    assert list(result.items()) == [('bitcoin', 1.5), ('eur', 5.0)]
+
+
+def test_generate_multi_currency_table(mocker):
+    def quotes(slugs, currency):
+        return dict(
+            (x['website_slug'], dict(x, quotes={'USD': {'price': 2.0}, currency.upper(): {'price': 4.0}}))
+            for x in full_ticker_data
+        )
+
+    source = mocker.Mock()
+    source.quotes.side_effect = quotes
+    fiat_rates = mocker.Mock()
+    fiat_rates.rate.return_value = 0.5
+    ca = CryptoAssets(config, 'eur', '', price_source=source, fiat_rates=fiat_rates)
+    headers, table = ca.generate_multi_currency_table(
+        [['bitcoin', '1'], ['ethereum', '3'], ['eur', '4']], ['eur', 'usd', 'btc']
+    )
+
+    assert sorted(x[0][1] for x in source.quotes.call_args_list) == ['btc', 'eur']
+    fiat_rates.fetch.assert_called_once()
+    assert headers == ['symbol', 'amount', '%', 'eur price', 'eur total', 'usd price', 'usd total',
+                       'btc price', 'btc total']
+    assert table == [
+        ['ethereum', 3.0, 60.0, 4.0, 12.0, 2.0, 6.0, 4.0, 12.0],
+        ['bitcoin', 1.0, 20.0, 4.0, 4.0, 2.0, 2.0, 4.0, 4.0],
+        ['eur', 4.0, 20.0, 1, 4.0, 0.5, 2.0, 0.5, 2.0],
+        ['total', None, None, None, 20.0, None, 10.0, None, 18.0],
+    ]
+
+
+def test_generate_multi_currency_table_fetches_missing_usd(mocker):
+    # like Kraken, the source only quotes the currency asked for
+    def quotes(slugs, currency):
+        return dict(
+            (x['website_slug'], dict(x, quotes={currency.upper(): {'price': 4.0 if currency == 'eur' else 2.0}}))
+            for x in full_ticker_data
+        )
+
+    source = mocker.Mock()
+    source.quotes.side_effect = quotes
+    fiat_rates = mocker.Mock()
+    fiat_rates.rate.return_value = 0.5
+    ca = CryptoAssets(config, 'eur', '', price_source=source, fiat_rates=fiat_rates)
+    headers, table = ca.generate_multi_currency_table([['bitcoin', '1']], ['eur', 'usd'])
+
+    assert sorted(x[0][1] for x in source.quotes.call_args_list) == ['eur', 'usd']
+    assert table[0] == ['bitcoin', 1.0, 100.0, 4.0, 4.0, 2.0, 2.0]
+
+
+def test_async_generate_crypto_table(mocker):
+    source = mocker.Mock()
+    source.quotes.return_value = {x['website_slug']: x for x in full_ticker_data}
+    fiat_rates = mocker.Mock()
+    ca = AsyncCryptoAssets(config, 'eur', '', price_source=source, fiat_rates=fiat_rates)
+    result = ca.generate_crypto_table(parsed_crypto_file)
+
+    fiat_rates.fetch.assert_called_once_with([('eur', 'eur')])
+    assert result == generated_crypto_table
+
+
 def test_demo(mocker):
     mocker.patch.object(crypto_assets.CryptoAssets, 'generate_crypto_table', return_value=generated_crypto_table)
 
@@ -151,8 +279,8 @@ def test_crypto_assets_cli_with_data(mocker, config_dir):
     crypto_assets_cli.resources.user.read.return_value = None
     crypto_assets_cli.resources.user.path = str(config_dir)
     crypto_assets_cli.resources.user.open.return_value = config_dir.join('config.json')
-    mocker.patch.object(crypto_assets_cli.CryptoAssets, 'generate_crypto_table')
-    crypto_assets_cli.CryptoAssets.generate_crypto_table.return_value = generated_crypto_table
+    mocker.patch.object(CryptoAssets, 'generate_crypto_table')
+    CryptoAssets.generate_crypto_table.return_value = generated_crypto_table
     config_dir.join('crypto.txt').write(raw_crypto_file)
 
     assert crypto_assets_cli.main() == crypto_output
@@ -163,13 +291,13 @@ def test_crypto_assets_cli_currency_eur(mocker, config_dir):
     crypto_assets_cli.resources.user.read.return_value = None
     crypto_assets_cli.resources.user.path = str(config_dir)
     crypto_assets_cli.resources.user.open.return_value = config_dir.join('config.json')
-    mocker.patch.object(crypto_assets_cli.CryptoAssets, 'generate_crypto_table')
-    crypto_assets_cli.CryptoAssets.generate_crypto_table.return_value = generated_crypto_table
+    mocker.patch.object(CryptoAssets, 'generate_crypto_table')
+    CryptoAssets.generate_crypto_table.return_value = generated_crypto_table
     mocker.patch.object(crypto_assets_cli, 'Args')
     crypto_assets_cli.Args.return_value.last = 'eur'
     crypto_assets_cli.main()
 
-    crypto_assets_cli.CryptoAssets.generate_crypto_table.assert_called_with(parsed_crypto_file)
+    CryptoAssets.generate_crypto_table.assert_called_with(parsed_crypto_file)
 
 
 def test_crypto_assets_cli_currency_usd(mocker, config_dir):
@@ -177,13 +305,13 @@ def test_crypto_assets_cli_currency_usd(mocker, config_dir):
     crypto_assets_cli.resources.user.read.return_value = None
     crypto_assets_cli.resources.user.path = str(config_dir)
     crypto_assets_cli.resources.user.open.return_value = config_dir.join('config.json')
-    mocker.patch.object(crypto_assets_cli.CryptoAssets, 'generate_crypto_table')
-    crypto_assets_cli.CryptoAssets.generate_crypto_table.return_value = generated_crypto_table
+    mocker.patch.object(CryptoAssets, 'generate_crypto_table')
+    CryptoAssets.generate_crypto_table.return_value = generated_crypto_table
     mocker.patch.object(crypto_assets_cli, 'Args')
     crypto_assets_cli.Args.return_value.last = 'usd'
     crypto_assets_cli.main()
 
-    crypto_assets_cli.CryptoAssets.generate_crypto_table.assert_called_with(parsed_crypto_file)
+    CryptoAssets.generate_crypto_table.assert_called_with(parsed_crypto_file)
 
 
 def test_crypto_assets_cli_currency_btc(mocker, config_dir):
@@ -191,13 +319,13 @@ def test_crypto_assets_cli_currency_btc(mocker, config_dir):
     crypto_assets_cli.resources.user.read.return_value = None
     crypto_assets_cli.resources.user.path = str(config_dir)
     crypto_assets_cli.resources.user.open.return_value = config_dir.join('config.json')
-    mocker.patch.object(crypto_assets_cli.CryptoAssets, 'generate_crypto_table')
-    crypto_assets_cli.CryptoAssets.generate_crypto_table.return_value = generated_crypto_table
+    mocker.patch.object(CryptoAssets, 'generate_crypto_table')
+    CryptoAssets.generate_crypto_table.return_value = generated_crypto_table
     mocker.patch.object(crypto_assets_cli, 'Args')
     crypto_assets_cli.Args.return_value.last = 'btc'
     crypto_assets_cli.main()
 
-    crypto_assets_cli.CryptoAssets.generate_crypto_table.assert_called_with(parsed_crypto_file)
+    CryptoAssets.generate_crypto_table.assert_called_with(parsed_crypto_file)
 
 
 def test_crypto_assets_cli_currency_unknown(mocker, config_dir):
@@ -205,10 +333,306 @@ def test_crypto_assets_cli_currency_unknown(mocker, config_dir):
     crypto_assets_cli.resources.user.read.return_value = None
     crypto_assets_cli.resources.user.path = str(config_dir)
     crypto_assets_cli.resources.user.open.return_value = config_dir.join('config.json')
-    mocker.patch.object(crypto_assets_cli.CryptoAssets, 'generate_crypto_table')
-    crypto_assets_cli.CryptoAssets.generate_crypto_table.return_value = generated_crypto_table
+    mocker.patch.object(CryptoAssets, 'generate_crypto_table')
+    CryptoAssets.generate_crypto_table.return_value = generated_crypto_table
     mocker.patch.object(crypto_assets_cli, 'Args')
     crypto_assets_cli.Args.return_value.last = 'abc'
     crypto_assets_cli.main()
 
-    crypto_assets_cli.CryptoAssets.generate_crypto_table.assert_called_with(parsed_crypto_file)
+    CryptoAssets.generate_crypto_table.assert_called_with(parsed_crypto_file)
+
+
+def test_crypto_assets_cli_watch(mocker, capsys):
+    ca = mocker.Mock(decimals=2)
+    ca.parse_crypto_file.return_value = parsed_crypto_file
+    changed_table = [list(x) for x in generated_crypto_table[1]]
+    changed_table[1][3] = 500.0
+    ca.generate_crypto_table.side_effect = [
+        generated_crypto_table,
+        generated_crypto_table,
+        (generated_crypto_table[0], changed_table),
+    ]
+    mocker.patch.object(crypto_assets_cli.time, 'sleep')
+    crypto_assets_cli.watch(ca, 60, iterations=3)
+    output = capsys.readouterr().out.splitlines()
+
+    crypto_assets_cli.time.sleep.assert_called_with(60)
+    assert ca.cache.save.call_count == 3
+    # full table, nothing on the unchanged refresh, then the changed row
+    assert len(output) == 8 + 4
+    assert output[-1].startswith('ethereum')
+
+
+def test_crypto_assets_cli_watch_survives_errors(mocker, capsys):
+    ca = mocker.Mock(decimals=2)
+    ca.parse_crypto_file.return_value = parsed_crypto_file
+    ca.generate_crypto_table.side_effect = [
+        ValueError('No exchange rate for EUR_USD'),
+        KeyError('ethereum'),
+        generated_crypto_table,
+    ]
+    mocker.patch.object(crypto_assets_cli.time, 'sleep')
+    crypto_assets_cli.watch(ca, 60, iterations=3)
+    output = capsys.readouterr().out.splitlines()
+
+    assert output[:2] == [
+        'Unable to refresh prices: No exchange rate for EUR_USD',
+        'Unable to refresh prices: no price for ethereum',
+    ]
+    assert ca.cache.save.call_count == 1
+
+
+def test_crypto_assets_cli_multi_currency(mocker, config_dir):
+    mocker.patch.object(crypto_assets_cli, 'resources')
+    crypto_assets_cli.resources.user.read.return_value = None
+    crypto_assets_cli.resources.user.path = str(config_dir)
+    crypto_assets_cli.resources.user.open.return_value = config_dir.join('config.json')
+    mocker.patch.object(CryptoAssets, 'generate_multi_currency_table')
+    CryptoAssets.generate_multi_currency_table.return_value = (
+        ['symbol', 'amount', '%', 'eur price', 'eur total', 'btc price', 'btc total'],
+        [['bitcoin', 1.0, 100.0, 5000.0, 5000.0, 1.0, 1.0]]
+    )
+    mocker.patch.object(crypto_assets_cli, 'Args')
+    crypto_assets_cli.Args.return_value.grouped = {'--currency': ['eur,btc']}
+    config_dir.join('crypto.txt').write(raw_crypto_file)
+    result = crypto_assets_cli.main()
+
+    CryptoAssets.generate_multi_currency_table.assert_called_with(
+        parsed_crypto_file, ['eur', 'btc']
+    )
+    assert result.splitlines()[-1].split() == [
+        'bitcoin', '1.0000000000', '100.00', '5000.00', '5000.00', '1.0000000000', '1.0000000000'
+    ]
+
+
+def test_crypto_assets_cli_kraken(mocker, config_dir):
+    mocker.patch.object(crypto_assets_cli, 'resources')
+    crypto_assets_cli.resources.user.read.return_value = None
+    crypto_assets_cli.resources.user.path = str(config_dir)
+    crypto_assets_cli.resources.user.open.return_value = config_dir.join('config.json')
+    mocker.patch('madcc.kraken.KrakenUtils')
+    mocker.patch('madcc.kraken.KrakenStore')
+    kraken.KrakenStore.return_value.holdings.return_value = [['bitcoin', '1.5']]
+    mocker.patch.object(CryptoAssets, 'generate_crypto_table')
+    CryptoAssets.generate_crypto_table.return_value = generated_crypto_table
+    mocker.patch.object(crypto_assets_cli, 'Args')
+    crypto_assets_cli.Args.return_value.grouped = {'--kraken': []}
+    crypto_assets_cli.main()
+
+    kraken.KrakenUtils.return_value.sync.assert_called_once_with(
+        kraken.KrakenStore.return_value
+    )
+    CryptoAssets.generate_crypto_table.assert_called_with([['bitcoin', '1.5']])
+
+
+def test_crypto_assets_cli_kraken_unpriced(mocker, config_dir):
+    mocker.patch.object(crypto_assets_cli, 'resources')
+    crypto_assets_cli.resources.user.read.return_value = None
+    crypto_assets_cli.resources.user.path = str(config_dir)
+    crypto_assets_cli.resources.user.open.return_value = config_dir.join('config.json')
+    mocker.patch('madcc.kraken.KrakenUtils')
+    mocker.patch('madcc.kraken.KrakenStore')
+    kraken.KrakenStore.return_value.holdings.return_value = [['new.s', '1.5']]
+    mocker.patch.object(CryptoAssets, 'generate_crypto_table')
+    CryptoAssets.generate_crypto_table.side_effect = KeyError('new.s')
+    mocker.patch.object(crypto_assets_cli, 'Args')
+    crypto_assets_cli.Args.return_value.grouped = {'--kraken': []}
+
+    assert crypto_assets_cli.main() == 'Unable to price new.s'
+
+
+def test_crypto_assets_cli_record_and_history(mocker, config_dir):
+    mocker.patch.object(crypto_assets_cli, 'resources')
+    crypto_assets_cli.resources.user.read.return_value = None
+    crypto_assets_cli.resources.user.path = str(config_dir)
+    crypto_assets_cli.resources.user.open.return_value = config_dir.join('config.json')
+    mocker.patch.object(CryptoAssets, 'generate_crypto_table')
+    CryptoAssets.generate_crypto_table.return_value = generated_crypto_table
+    mocker.patch.object(crypto_assets_cli, 'Args')
+    args = crypto_assets_cli.Args.return_value
+    config_dir.join('crypto.txt').write(raw_crypto_file)
+    mocker.patch('madcc.utils.history.time').time.side_effect = [0, 3600]
+
+    args.get.return_value = 'history'
+    args.grouped = {'--period': ['hourly']}
+    assert crypto_assets_cli.main().startswith('No history recorded yet')
+
+    args.get.return_value = None
+    args.grouped = {'--record': []}
+    crypto_assets_cli.main()
+    crypto_assets_cli.main()
+
+    args.get.return_value = 'history'
+    args.grouped = {}
+    assert crypto_assets_cli.main() == 'Not enough daily snapshots to compare'
+    args.grouped = {'--period': ['hourly']}
+    result = crypto_assets_cli.main().splitlines()
+    assert result[2].split() == ['start', 'value', '152261.37']
+    assert result[4].split() == ['return', '%', '0.00']
+    assert result[-4].split()[0] == 'bitcoin'
+
+
+def test_iter_valuations(mocker):
+    source = mocker.Mock()
+    source.iter_quotes.return_value = iter((x['website_slug'], x) for x in full_ticker_data)
+    fiat_rates = mocker.Mock()
+    ca = CryptoAssets(config, 'eur', '', price_source=source, fiat_rates=fiat_rates)
+    result = list(ca.iter_valuations(parsed_crypto_file))
+
+    source.iter_quotes.assert_called_once_with(['bitcoin', 'ethereum', 'litecoin'], 'eur')
+    fiat_rates.fetch.assert_called_once_with([('eur', 'eur')])
+    assert result[0] == ['eur', 500.0, 1.0, 500.0]
+    assert type(result[0][2]) is float
+    assert [x[0] for x in result[1:]] == ['bitcoin', 'litecoin', 'ethereum']
+
+
+def test_iter_valuations_unknown_coin(mocker):
+    source = mocker.Mock()
+    source.iter_quotes.return_value = iter([])
+    ca = CryptoAssets(config, 'eur', '', price_source=source, fiat_rates=mocker.Mock())
+
+    with pytest.raises(KeyError):
+        list(ca.iter_valuations([['unknown-coin', '1']]))
+
+
+def test_crypto_assets_cli_format(mocker, config_dir, capsys):
+    mocker.patch.object(crypto_assets_cli, 'resources')
+    crypto_assets_cli.resources.user.read.return_value = None
+    crypto_assets_cli.resources.user.path = str(config_dir)
+    crypto_assets_cli.resources.user.open.return_value = config_dir.join('config.json')
+    mocker.patch.object(CryptoAssets, 'iter_valuations')
+    CryptoAssets.iter_valuations.return_value = iter([['bitcoin', 1.5, 2.0, 3.0]])
+    tabulate = mocker.patch('tabulate.tabulate')
+    mocker.patch.object(crypto_assets_cli, 'Args')
+    crypto_assets_cli.Args.return_value.grouped = {'--format': ['csv']}
+    config_dir.join('crypto.txt').write(raw_crypto_file)
+
+    assert crypto_assets_cli.main() is None
+    assert capsys.readouterr().out.splitlines() == [
+        'symbol,currency,amount,price,total', 'bitcoin,eur,1.5,2.0,3.0', 'total,eur,,,3.0'
+    ]
+    tabulate.assert_not_called()
+
+    crypto_assets_cli.Args.return_value.grouped = {'--format': ['xml']}
+    assert crypto_assets_cli.main() == crypto_assets_cli.USAGE
+
+
+@pytest.mark.parametrize('fmt', ['json', 'ndjson', 'csv'])
+def test_crypto_assets_cli_format_unknown_coin(mocker, config_dir, capsys, fmt):
+    def valuations(crypto_data):
+        yield ['bitcoin', 1.5, 2.0, 3.0]
+        raise KeyError('unknown')
+
+    mocker.patch.object(crypto_assets_cli, 'resources')
+    crypto_assets_cli.resources.user.read.return_value = None
+    crypto_assets_cli.resources.user.path = str(config_dir)
+    crypto_assets_cli.resources.user.open.return_value = config_dir.join('config.json')
+    mocker.patch.object(CryptoAssets, 'iter_valuations', side_effect=valuations)
+    save = mocker.patch.object(DiskCache, 'save')
+    mocker.patch.object(crypto_assets_cli, 'Args')
+    crypto_assets_cli.Args.return_value.grouped = {'--format': [fmt]}
+    config_dir.join('crypto.txt').write(raw_crypto_file)
+
+    assert crypto_assets_cli.main() is None
+    output = capsys.readouterr()
+    if fmt == 'json':
+        assert json.loads(output.out)['total'] == 3.0
+    elif fmt == 'ndjson':
+        assert [json.loads(x)['symbol'] for x in output.out.splitlines()] == ['bitcoin', 'total']
+    else:
+        assert output.out.splitlines()[-1] == 'total,eur,,,3.0'
+    assert output.err == 'Unable to price unknown\n'
+    save.assert_called_once()
+
+
+def test_crypto_assets_cli_profile(mocker, config_dir, capsys):
+    mocker.patch.object(crypto_assets_cli, 'resources')
+    crypto_assets_cli.resources.user.read.return_value = None
+    crypto_assets_cli.resources.user.path = str(config_dir)
+    crypto_assets_cli.resources.user.open.return_value = config_dir.join('config.json')
+    mocker.patch.object(CryptoAssets, 'retrieve_ticker_data')
+    CryptoAssets.retrieve_ticker_data.return_value = full_ticker_data
+    mocker.patch.object(tracing, 'TRACER', tracing.Tracer())
+    mocker.patch.object(crypto_assets_cli, 'Args')
+    crypto_assets_cli.Args.return_value.grouped = {'--profile': ['json']}
+    crypto_assets_cli.Args.return_value.last = 'json'
+    config_dir.join('crypto.txt').write(raw_crypto_file)
+
+    crypto_assets_cli.main()
+
+    spans = json.loads(capsys.readouterr().err)['spans']
+    assert spans['parse_crypto_file']['calls'] == 1
+    assert spans['generate_crypto_table']['calls'] == 1
+    assert spans['render_table']['calls'] == 1
+
+
+def test_crypto_assets_cli_batch(mocker, config_dir):
+    mocker.patch.object(crypto_assets_cli, 'resources')
+    crypto_assets_cli.resources.user.read.return_value = None
+    crypto_assets_cli.resources.user.path = str(config_dir)
+    crypto_assets_cli.resources.user.open.return_value = config_dir.join('config.json')
+    mocker.patch.object(CryptoAssets, 'retrieve_ticker_data')
+    CryptoAssets.retrieve_ticker_data.return_value = full_ticker_data
+    clients = config_dir.mkdir('clients')
+    clients.join('a.txt').write(raw_crypto_file)
+    clients.join('b.txt').write('# cryptocurrency\n- bitcoin 1\n')
+    mocker.patch.object(crypto_assets_cli, 'Args', return_value=Args(
+        ['batch', str(clients), str(clients.join('a.*')), 'eur']
+    ))
+
+    result = crypto_assets_cli.main().split('\n\n')
+
+    CryptoAssets.retrieve_ticker_data.assert_called_once()
+    assert [x.splitlines()[0] for x in result] == [str(clients.join('a.txt')), str(clients.join('b.txt')),
+                                                  'all 2 files']
+    assert result[0].splitlines()[1:] == crypto_output.splitlines()
+    assert result[2].splitlines()[3].split()[:2] == ['bitcoin', '13.05']
+
+
+def test_crypto_assets_cli_price_errors(mocker, config_dir):
+    mocker.patch.object(crypto_assets_cli, 'resources')
+    crypto_assets_cli.resources.user.read.return_value = None
+    crypto_assets_cli.resources.user.path = str(config_dir)
+    crypto_assets_cli.resources.user.open.return_value = config_dir.join('config.json')
+    mocker.patch.object(CryptoAssets, 'retrieve_ticker_data', side_effect=ValueError('No quotes for ethereum'))
+    config_dir.join('crypto.txt').write(raw_crypto_file)
+    mocker.patch.object(crypto_assets_cli, 'Args', return_value=Args(['eur']))
+    assert crypto_assets_cli.main() == 'Unable to retrieve prices: No quotes for ethereum'
+
+    crypto_assets_cli.Args.return_value = Args(['batch', str(config_dir.join('crypto.txt')), 'eur'])
+    assert crypto_assets_cli.main() == 'Unable to retrieve prices: No quotes for ethereum'
+
+
+def test_crypto_assets_cli_liquidation(mocker, config_dir):
+    mocker.patch.object(crypto_assets_cli, 'resources')
+    crypto_assets_cli.resources.user.read.return_value = None
+    crypto_assets_cli.resources.user.path = str(config_dir)
+    crypto_assets_cli.resources.user.open.return_value = config_dir.join('config.json')
+    mocker.patch.object(CryptoAssets, 'retrieve_ticker_data')
+    CryptoAssets.retrieve_ticker_data.return_value = full_ticker_data
+    config_dir.join('crypto.txt').write(raw_crypto_file)
+    mocker.patch.object(crypto_assets_cli, 'Args', return_value=Args(['--liquidation', '--currency', 'eur']))
+    asset_pairs = {'error': [], 'result': {
+        'XXBTZEUR': {'base': 'XXBT', 'quote': 'ZEUR'},
+        'XETHZEUR': {'base': 'XETH', 'quote': 'ZEUR'},
+    }}
+    books = {
+        'XXBTZEUR': {'bids': [['6600.0', '10.0', 1], ['6500.0', '10.0', 2]], 'asks': []},
+        'XETHZEUR': {'bids': [['490.0', '100.0', 1]], 'asks': []},
+    }
+
+    with requests_mock.Mocker() as mock:
+        mock.register_uri(requests_mock.ANY, 'https://api.kraken.com/0/public/AssetPairs', json=asset_pairs)
+        mock.register_uri(requests_mock.ANY, 'https://api.kraken.com/0/public/Depth', json=lambda request, context: {
+            'error': [], 'result': dict((x, books[x]) for x in books if 'pair=' + x in public_params(request))
+        })
+        result = crypto_assets_cli.main().splitlines()
+
+    assert result[0].split() == ['symbol', 'amount', '%', 'eur', 'price', 'eur', 'total',
+                                 'eur', 'liquidation', 'slippage', '%']
+    assert result[2].split()[5:] == ['79325.00', '0.49']
+    assert result[3].split()[5:] == ['39298.00', '0.28']
+    # litecoin has no Kraken market, eur is cash
+    assert result[4].split()[5:] == []
+    assert result[5].split()[5:] == ['500.00', '0.00']
+    assert result[-1].split()[-2:] == ['151760.68', '0.33']
@@ -0,0 +1,94 @@
+import pytest
+import requests_mock
+
+from madcc.utils import cache as cache_module
+from madcc.utils.cache import DiskCache
+from madcc.utils.fiat_rates import FiatRates
+
+
+api_url = 'https://free.currencyconverterapi.com/api/v6/convert'
+
+
+def test_fiat_rates_batched_fetch():
+    rates = FiatRates(api_url)
+    with requests_mock.Mocker() as mock:
+        mock.get(api_url, json={'EUR_BTC': {'val': 0.0002}, 'USD_BTC': {'val': 0.0001}})
+        rates.fetch([('eur', 'btc'), ('usd', 'btc'), ('eur', 'btc'), ('btc', 'btc')])
+
+        assert rates.rate('eur', 'btc') == 0.0002
+        assert rates.rate('btc', 'usd') == 10000
+
+    assert mock.call_count == 1
+    assert mock.last_request.qs['q'] == ['eur_btc,usd_btc']
+
+
+def test_fiat_rates_cross_through_usd():
+    rates = FiatRates(api_url)
+    with requests_mock.Mocker() as mock:
+        mock.get(api_url, [
+            {'json': {}},
+            {'json': {'EUR_USD': {'val': 1.2}, 'USD_BTC': {'val': 0.0001}}},
+        ])
+        rate = rates.rate('eur', 'btc')
+        rates.rate('eur', 'btc')
+
+    assert rate == pytest.approx(0.00012)
+    assert mock.call_count == 2
+
+
+def test_fiat_rates_unknown_pair():
+    rates = FiatRates(api_url)
+    with requests_mock.Mocker() as mock:
+        mock.get(api_url, json={})
+        with pytest.raises(ValueError):
+            rates.rate('eur', 'abc')
+
+
+def test_fiat_rates_disk_cache(tmpdir):
+    cache = DiskCache(str(tmpdir.join('cache.json')))
+    with requests_mock.Mocker() as mock:
+        mock.get(api_url, json={'EUR_USD': {'val': 1.2}})
+        FiatRates(api_url, cache=cache).rate('eur', 'usd')
+        rate = FiatRates(api_url, cache=cache).rate('usd', 'eur')
+
+    assert rate == pytest.approx(1 / 1.2)
+    assert mock.call_count == 1
+
+
+def test_fiat_rates_offline(tmpdir):
+    cache = DiskCache(str(tmpdir.join('cache.json')))
+    cache.set('rate:EUR_USD', 1.2)
+    rates = FiatRates(api_url, cache=cache, ttl=0, offline=True)
+    with requests_mock.Mocker() as mock:
+        assert rates.rate('eur', 'usd') == 1.2
+        with pytest.raises(ValueError):
+            rates.rate('eur', 'gbp')
+
+    assert mock.call_count == 0
+
+
+def test_fiat_rates_expire_in_memory(mocker):
+    mocker.patch.object(cache_module.time, 'time', return_value=1000)
+    rates = FiatRates(api_url, ttl=60)
+    with requests_mock.Mocker() as mock:
+        mock.get(api_url, [
+            {'json': {'EUR_USD': {'val': 1.2}}},
+            {'json': {'EUR_USD': {'val': 1.3}}},
+        ])
+        assert rates.rate('eur', 'usd') == 1.2
+        cache_module.time.time.return_value = 1030
+        assert rates.rate('eur', 'usd') == 1.2
+        cache_module.time.time.return_value = 1100
+        assert rates.rate('eur', 'usd') == 1.3
+
+
+def test_fiat_rates_fallback(mocker):
+    fallback = mocker.Mock()
+    fallback.rates.return_value = {'EUR_USD': 1.25}
+    rates = FiatRates(api_url, fallback=fallback)
+    with requests_mock.Mocker() as mock:
+        mock.get(api_url, status_code=503)
+        result = rates.rate('eur', 'usd')
+
+    fallback.rates.assert_called_once_with([('EUR', 'USD')])
+    assert result == 1.25
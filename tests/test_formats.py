@@ -0,0 +1,73 @@
+import csv
+import io
+import json
+
+import pytest
+
+from madcc.utils.formats import write_rows
+
+
+rows = [['eur', 500.0, 1.0, 500.0], ['bitcoin', 0.1, 6615.31631639, 661.531631639]]
+
+
+def test_write_ndjson():
+    out = io.StringIO()
+    total = write_rows(iter(rows), 'ndjson', 'eur', out)
+    lines = [json.loads(x) for x in out.getvalue().splitlines()]
+
+    assert total == 500.0 + 661.531631639
+    assert lines[1] == {'symbol': 'bitcoin', 'currency': 'eur', 'amount': 0.1,
+                        'price': 6615.31631639, 'total': 661.531631639}
+    assert lines[-1] == {'symbol': 'total', 'currency': 'eur', 'amount': None,
+                         'price': None, 'total': total}
+
+
+@pytest.mark.parametrize('assets', [rows, []])
+def test_write_json(assets):
+    out = io.StringIO()
+    write_rows(iter(assets), 'json', 'eur', out)
+    result = json.loads(out.getvalue())
+
+    assert result['currency'] == 'eur'
+    assert [x['symbol'] for x in result['assets']] == [x[0] for x in assets]
+    assert result['total'] == sum(x[3] for x in assets)
+
+
+def test_write_csv():
+    out = io.StringIO()
+    write_rows(iter(rows), 'csv', 'eur', out)
+    result = list(csv.reader(io.StringIO(out.getvalue())))
+
+    assert result[0] == ['symbol', 'currency', 'amount', 'price', 'total']
+    assert float(result[2][3]) == 6615.31631639
+    assert result[-1][:4] == ['total', 'eur', '', '']
+
+
+def test_write_rows_streams(mocker):
+    out = mocker.Mock()
+
+    def assets():
+        yield rows[0]
+        # the first row is out before the second one is priced
+        assert out.flush.call_count == 1
+        yield rows[1]
+
+    write_rows(assets(), 'ndjson', 'eur', out)
+
+
+@pytest.mark.parametrize('fmt', ['json', 'ndjson', 'csv'])
+def test_write_rows_finishes_output_on_error(fmt):
+    def assets():
+        yield rows[0]
+        raise KeyError('bitcoin')
+
+    out = io.StringIO()
+    with pytest.raises(KeyError):
+        write_rows(assets(), fmt, 'eur', out)
+
+    if fmt == 'json':
+        assert json.loads(out.getvalue())['total'] == 500.0
+    elif fmt == 'ndjson':
+        assert json.loads(out.getvalue().splitlines()[-1])['total'] == 500.0
+    else:
+        assert list(csv.reader(io.StringIO(out.getvalue())))[-1] == ['total', 'eur', '', '', '500.0']
@@ -0,0 +1,88 @@
+import struct
+
+import numpy as np
+import pytest
+
+from madcc.utils.history import ROW_FORMAT, HistoryStore, analyze, resample
+
+
+table_1 = [
+    ['bitcoin', 1.0, 80.0, 800.0, 800.0],
+    ['eur', 200.0, 20.0, 1, 200.0],
+    ['total', None, None, None, 1000.0],
+]
+table_2 = [
+    ['bitcoin', 1.0, 85.71, 1200.0, 1200.0],
+    ['eur', 200.0, 14.29, 1, 200.0],
+    ['total', None, None, None, 1400.0],
+]
+table_3 = [
+    ['ethereum', 2.0, 50.0, 350.0, 700.0],
+    ['bitcoin', 1.0, 50.0, 700.0, 700.0],
+    ['total', None, None, None, 1400.0],
+]
+
+
+def test_history_store_record_and_read(tmpdir):
+    store = HistoryStore(str(tmpdir.join('history')))
+    assert len(store) == 0
+    store.record(table_1, timestamp=100)
+    store.record(table_3, timestamp=200)
+
+    times, symbols, columns = HistoryStore(str(tmpdir.join('history'))).read()
+    assert list(times) == [100, 200]
+    assert symbols == ['bitcoin', 'eur', 'ethereum']
+    assert columns['total'].tolist() == [[800.0, 200.0, 0.0], [700.0, 0.0, 700.0]]
+    assert columns['price'][1].tolist() == [700.0, 0.0, 350.0]
+
+
+def test_history_store_ignores_unfinished_snapshot(tmpdir):
+    store = HistoryStore(str(tmpdir))
+    store.record(table_1, timestamp=100)
+    # rows written without their timestamp, as after an interrupted record
+    with open(store.rows_path, 'ab') as f:
+        f.write(open(store.rows_path, 'rb').read())
+
+    times, symbols, columns = store.read()
+    assert columns['total'].tolist() == [[800.0, 200.0]]
+
+
+def test_history_store_drops_interrupted_rows(tmpdir):
+    store = HistoryStore(str(tmpdir))
+    store.record(table_3, timestamp=100)
+    store.record(table_1, timestamp=200)
+    # ethereum rows of a third snapshot whose timestamp never got written
+    with open(store.rows_path, 'ab') as f:
+        f.write(struct.pack(ROW_FORMAT, 2, 0, 2.0, 350.0, 700.0))
+    store.record(table_2, timestamp=300)
+
+    times, symbols, columns = store.read()
+    assert list(times) == [100, 200, 300]
+    assert columns['total'][2].tolist() == [0.0, 1200.0, 200.0]
+
+
+def test_resample():
+    times = np.array([0, 1800, 3600, 7300, 7400], dtype=float)
+    matrix = np.arange(5, dtype=float)[:, None]
+
+    times, matrix = resample(times, matrix, 'hourly')
+    assert times.tolist() == [1800, 3600, 7400]
+    assert matrix[:, 0].tolist() == [1, 2, 4]
+
+
+def test_analyze():
+    times = np.array([0, 86400, 172800], dtype=float)
+    totals = np.array([[800.0, 200.0], [1200.0, 200.0], [600.0, 200.0]])
+    stats, allocation = analyze(times, ['bitcoin', 'eur'], totals)
+
+    assert stats['return %'] == pytest.approx(-20)
+    assert stats['max drawdown %'] == pytest.approx((800 / 1400 - 1) * 100)
+    assert stats['current drawdown %'] == stats['max drawdown %']
+    assert allocation[0][0] == 'bitcoin'
+    assert allocation[0][1:] == pytest.approx((80, 75, -5, 1200 / 1400 * 100 - 80))
+    assert allocation[1][1:] == pytest.approx((20, 25, 5, 20 - 200 / 1400 * 100))
+
+
+def test_analyze_not_enough_snapshots():
+    assert analyze(np.array([0.0]), ['bitcoin'], np.array([[1.0]])) is None
+    assert analyze(np.array([0.0, 10.0]), ['bitcoin'], np.ones((2, 1)), since=5) is None
@@ -0,0 +1,92 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+import requests
+
+from madcc.kraken import KrakenUtils
+from madcc.utils.http import pooled_session, use_cassette
+
+
+def test_pooled_session():
+    session = pooled_session(pool_size=4, retries=2)
+    adapter = session.get_adapter('https://api.kraken.com')
+
+    assert adapter._pool_maxsize == 4
+    assert adapter.max_retries.total == 2
+    assert 503 in adapter.max_retries.status_forcelist
+
+
+class CountingHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def _send(self):
+        self.server.count += 1
+        payload = json.dumps({'error': [], 'result': {'count': self.server.count}}).encode()
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        self._send()
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers['Content-Length']))
+        self._send()
+
+
+@pytest.fixture
+def server():
+    server = HTTPServer(('127.0.0.1', 0), CountingHandler)
+    server.count = 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_cassette_record_and_replay(server, tmpdir):
+    url = 'http://127.0.0.1:{}/ticker/'.format(server.server_address[1])
+    path = str(tmpdir.join('cassette.json'))
+    session = pooled_session()
+    cassette = use_cassette(session, path, 'record')
+    recorded = [session.get(url, params={'start': 1}).json() for _ in range(2)]
+    cassette.save()
+
+    session = requests.Session()
+    use_cassette(session, path)
+    replayed = [session.get(url, params={'start': 1}).json() for _ in range(3)]
+
+    assert server.count == 2
+    assert replayed == recorded + recorded[-1:]
+    with pytest.raises(requests.ConnectionError):
+        session.get(url, params={'start': 2})
+
+
+def test_cassette_replays_krakenex_without_nonce(server, tmpdir, config_dir):
+    config_dir.join('kraken.auth').write('some_api_key\nc29tZV9hcGlfc2VjcmV0Cg==')
+    url = 'http://127.0.0.1:{}'.format(server.server_address[1])
+    path = str(tmpdir.join('kraken.json'))
+    kraken = KrakenUtils(str(config_dir.join('kraken.auth')), session=requests.Session(), api_url=url)
+    cassette = use_cassette(kraken.api.session, path, 'record')
+    recorded = kraken.query_private('Balance')
+    cassette.save()
+
+    kraken = KrakenUtils(str(config_dir.join('kraken.auth')), session=requests.Session(), api_url=url)
+    use_cassette(kraken.api.session, path)
+
+    assert kraken.query_private('Balance') == recorded
+    assert server.count == 1
+
+
+def test_cassette_unknown_mode(tmpdir):
+    with pytest.raises(ValueError):
+        use_cassette(requests.Session(), str(tmpdir.join('x.json')), 'rewind')
+
+
+@pytest.fixture
+def config_dir(tmpdir):
+    return tmpdir
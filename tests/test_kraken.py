@@ -1,7 +1,13 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs
+
 import pytest
 import requests_mock
 
-from madcc.kraken import KrakenUtils
+from madcc.kraken import KrakenStore, KrakenUtils
+from madcc.kraken import kraken as kraken_module
+from madcc.kraken.kraken import KrakenScheduler, query_limits
 from madcc.entrypoints import kraken_limits
 
 
@@ -18,6 +24,12 @@ def config_dir(tmpdir_factory):
     return tmpdir_factory.mktemp('madcc')
 
 
+@pytest.fixture(autouse=True)
+def schedulers(mocker):
+    # every test starts with an empty call counter for the test key
+    mocker.patch.dict(kraken_module._schedulers, clear=True)
+
+
 def test_kraken_utils_set_auth(config_dir):
     config_dir.join('kraken.auth').write(raw_kraken_auth)
     kraken = KrakenUtils(str(config_dir.join('kraken.auth')))
@@ -35,7 +47,7 @@ def test_kraken_utils_set_auth(config_dir):
 def test_kraken_utils_api_live(config_dir):
     kraken = KrakenUtils(str(config_dir.join('kraken.auth')))
     with requests_mock.Mocker() as mock:
-        mock.post('https://api.kraken.com/0/public/Time', json={'error': []})
+        mock.register_uri(requests_mock.ANY, 'https://api.kraken.com/0/public/Time', json={'error': []})
 
         assert kraken.api_live() is True
 
@@ -43,14 +55,14 @@ def test_kraken_utils_api_live(config_dir):
 def test_kraken_utils_api_dead(config_dir):
     kraken = KrakenUtils(str(config_dir.join('kraken.auth')))
     with requests_mock.Mocker() as mock:
-        mock.post('https://api.kraken.com/0/public/Time', json={'error': ['something']})
+        mock.register_uri(requests_mock.ANY, 'https://api.kraken.com/0/public/Time', json={'error': ['something']})
 
         assert kraken.api_live() is False
 
 
 def test_kraken_limits(config_dir):
     with requests_mock.Mocker() as mock:
-        mock.post('https://api.kraken.com/0/public/Time', json={'error': []})
+        mock.register_uri(requests_mock.ANY, 'https://api.kraken.com/0/public/Time', json={'error': []})
         mock.post('https://api.kraken.com/0/private/DepositMethods', json={
             'error': [],
             'result': [{'limit': 100}]
@@ -62,3 +74,241 @@ def test_kraken_limits(config_dir):
         result = kraken_limits.main(str(config_dir.join('kraken.auth')))
 
     assert result == kraken_limits_result
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = list()
+
+    def clock(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+def test_kraken_scheduler_paces_private_calls():
+    fake = FakeClock()
+    scheduler = KrakenScheduler(tier='pro', clock=fake.clock, sleep=fake.sleep)
+    for _ in range(20):
+        scheduler.acquire('Balance')
+    scheduler.acquire('Ledgers')
+
+    assert fake.sleeps == [pytest.approx(2.0)]
+
+
+def test_kraken_scheduler_retries_with_backoff(mocker):
+    fake = FakeClock()
+    scheduler = KrakenScheduler(clock=fake.clock, sleep=fake.sleep)
+    query = mocker.Mock(side_effect=[
+        ValueError('no json'),
+        {'error': ['EService:Unavailable']},
+        {'error': [], 'result': 1},
+    ])
+    res = scheduler.call(query, 'Balance', {'a': 1})
+
+    assert res == {'error': [], 'result': 1}
+    assert len(fake.sleeps) == 2
+    assert fake.sleeps[0] <= 1 and fake.sleeps[1] <= 2
+    assert scheduler.stats['Balance']['calls'] == 3
+    assert scheduler.stats['Balance']['retries'] == 2
+    assert scheduler.stats['Balance']['errors'] == 2
+    query.assert_called_with('Balance', {'a': 1})
+
+
+def test_kraken_scheduler_stats_from_threads():
+    scheduler = KrakenScheduler()
+    with ThreadPoolExecutor(8) as pool:
+        list(pool.map(
+            lambda x: scheduler.call(lambda method, data: {'error': []}, 'Depth', private=False), range(800)
+        ))
+
+    assert scheduler.stats['Depth']['calls'] == 800
+
+
+def test_kraken_scheduler_does_not_retry_permanent_errors(mocker):
+    fake = FakeClock()
+    scheduler = KrakenScheduler(clock=fake.clock, sleep=fake.sleep)
+    query = mocker.Mock(return_value={'error': ['EAPI:Invalid key']})
+
+    assert scheduler.call(query, 'Balance') == {'error': ['EAPI:Invalid key']}
+    assert query.call_count == 1
+
+
+def test_kraken_scheduler_rate_limit_fills_counter(mocker):
+    fake = FakeClock()
+    scheduler = KrakenScheduler(tier='pro', clock=fake.clock, sleep=fake.sleep, backoff=0)
+    query = mocker.Mock(side_effect=[{'error': ['EAPI:Rate limit exceeded']}, {'error': [], 'result': 1}])
+    scheduler.call(query, 'Balance')
+
+    assert fake.sleeps[-1] == pytest.approx(1.0)
+
+
+def test_kraken_utils_deposit_limit_failure(config_dir):
+    config_dir.join('kraken.auth').write(raw_kraken_auth)
+    with requests_mock.Mocker() as mock:
+        mock.register_uri(requests_mock.ANY, 'https://api.kraken.com/0/public/Time', json={'error': []})
+        mock.post('https://api.kraken.com/0/private/DepositMethods', json={'error': ['EAPI:Invalid key']})
+        kraken = KrakenUtils(str(config_dir.join('kraken.auth')))
+
+        assert kraken.deposit_limit() is False
+        assert mock.call_count == 2
+
+
+def test_kraken_nonces_and_scheduler_shared_per_api_key(config_dir, mocker):
+    config_dir.join('kraken.auth').write(raw_kraken_auth)
+    config_dir.join('other.auth').write(raw_kraken_auth)
+    first = KrakenUtils(str(config_dir.join('kraken.auth')))
+    second = KrakenUtils(str(config_dir.join('other.auth')))
+    mocker.patch('madcc.kraken.kraken.time.time', return_value=1000.0)
+    nonces = [first.api._nonce(), second.api._nonce(), first.api._nonce()]
+
+    assert first.api._nonce is second.api._nonce
+    assert first.scheduler is second.scheduler
+    assert nonces == [nonces[0], nonces[0] + 1, nonces[0] + 2]
+
+
+def mock_limits(mock):
+    def deposit_methods(request, context):
+        return {'error': [], 'result': [{'method': 'SEPA', 'limit': 100}, {'method': 'SWIFT', 'limit': 200}]}
+
+    def withdraw_info(request, context):
+        return {'error': [], 'result': {'limit': 5}}
+
+    mock.register_uri(requests_mock.ANY, 'https://api.kraken.com/0/public/Time', json={'error': []})
+    mock.post('https://api.kraken.com/0/private/DepositMethods', json=deposit_methods)
+    mock.post('https://api.kraken.com/0/private/WithdrawInfo', json=withdraw_info)
+
+
+def test_query_limits_parallel_accounts(config_dir):
+    config_dir.join('kraken.auth').write(raw_kraken_auth)
+    # a second auth file of the same key, whose nonces must not collide
+    config_dir.join('other.auth').write(raw_kraken_auth)
+    authfiles = [str(config_dir.join('kraken.auth')), str(config_dir.join('other.auth'))]
+    with requests_mock.Mocker() as mock:
+        mock_limits(mock)
+        rows = query_limits(authfiles, ['ZEUR'], [('XXBT', 'gdax')])
+
+    assert rows == [
+        (authfiles[0], 'deposit', 'ZEUR', 'SEPA', 100),
+        (authfiles[0], 'deposit', 'ZEUR', 'SWIFT', 200),
+        (authfiles[0], 'withdraw', 'XXBT', 'gdax', 5),
+        (authfiles[1], 'deposit', 'ZEUR', 'SEPA', 100),
+        (authfiles[1], 'deposit', 'ZEUR', 'SWIFT', 200),
+        (authfiles[1], 'withdraw', 'XXBT', 'gdax', 5),
+    ]
+    # both files hold the same key, so their calls are made one at a time
+    # and the nonces arrive in increasing order
+    nonces = [int(parse_qs(x.text)['nonce'][0]) for x in mock.request_history if 'nonce' in (x.text or '')]
+    assert len(nonces) == 4
+    assert nonces == sorted(set(nonces))
+
+
+def test_query_limits_concurrency(config_dir, mocker):
+    def slow(*args):
+        time.sleep(0.2)
+        return [('SEPA', 1)]
+
+    config_dir.join('kraken.auth').write(raw_kraken_auth)
+    config_dir.join('other.auth').write('other_key\n' + raw_kraken_auth.splitlines()[1])
+    authfiles = [str(config_dir.join('kraken.auth')), str(config_dir.join('other.auth'))]
+    mocker.patch.object(KrakenUtils, 'api_live', return_value=True)
+    mocker.patch.object(KrakenUtils, 'deposit_limits', side_effect=slow)
+    mocker.patch.object(KrakenUtils, 'withdraw_limit', side_effect=slow)
+
+    start = time.time()
+    query_limits(authfiles, ['ZEUR'], [('XXBT', 'gdax')], account_concurrency=2)
+    # four 0.2s calls, all running at the same time
+    assert time.time() - start < 0.6
+
+    start = time.time()
+    query_limits(authfiles, ['ZEUR'], [('XXBT', 'gdax')])
+    # one call at a time per account, the two accounts side by side
+    assert 0.4 <= time.time() - start < 0.6
+
+    start = time.time()
+    query_limits([authfiles[0]] * 2, ['ZEUR'], [('XXBT', 'gdax')], account_concurrency=2)
+    # one key, so the accounts take turns
+    assert time.time() - start >= 0.4
+
+
+def test_kraken_limits_table(config_dir, mocker):
+    config_dir.join('kraken.auth').write(raw_kraken_auth)
+    mocker.patch.object(kraken_limits, 'Args')
+    kraken_limits.Args.return_value.grouped = {
+        '--auth': [str(config_dir.join('kraken.auth'))],
+        '--deposit': ['ZEUR,ZUSD'],
+    }
+    with requests_mock.Mocker() as mock:
+        mock_limits(mock)
+        result = kraken_limits.main()
+
+    assert result.splitlines()[0].split() == ['account', 'type', 'asset', 'method', 'limit']
+    assert len(result.splitlines()) == 2 + 5
+
+
+def test_kraken_utils_no_liveness_probe_on_success(config_dir):
+    config_dir.join('kraken.auth').write(raw_kraken_auth)
+    with requests_mock.Mocker() as mock:
+        mock_limits(mock)
+        kraken = KrakenUtils(str(config_dir.join('kraken.auth')))
+
+        assert kraken.withdraw_limit() == 5
+        assert [x.path for x in mock.request_history] == ['/0/private/withdrawinfo']
+
+
+def test_kraken_utils_api_down(config_dir):
+    config_dir.join('kraken.auth').write(raw_kraken_auth)
+    kraken = KrakenUtils(str(config_dir.join('kraken.auth')), scheduler=KrakenScheduler(backoff=0))
+    with requests_mock.Mocker() as mock:
+        mock.register_uri(requests_mock.ANY, 'https://api.kraken.com/0/public/Time', status_code=503)
+        mock.post('https://api.kraken.com/0/private/WithdrawInfo', status_code=503)
+
+        with pytest.raises(SystemExit):
+            kraken.withdraw_limit()
+
+
+def test_kraken_limits_help(mocker):
+    mocker.patch.object(kraken_limits, 'Args')
+    kraken_limits.Args.return_value.grouped = {'--help': []}
+
+    assert kraken_limits.main().startswith('usage: kraken_limits')
+
+
+def test_kraken_utils_sync(config_dir):
+    ledger = dict(
+        ('L{}'.format(i), {'time': float(i), 'asset': 'XXBT', 'amount': '1', 'balance': str(i)})
+        for i in range(1, 6)
+    )
+
+    def ledgers(request, context):
+        params = parse_qs(request.text)
+        start = params.get('start', ['L0'])[0]
+        ofs = int(params['ofs'][0])
+        newer = sorted((x for x in ledger if x > start), reverse=True)
+        return {'error': [], 'result': {
+            'ledger': dict((x, ledger[x]) for x in newer[ofs:ofs + 2]), 'count': len(newer)
+        }}
+
+    config_dir.join('kraken.auth').write(raw_kraken_auth)
+    kraken = KrakenUtils(str(config_dir.join('kraken.auth')))
+    store = KrakenStore(':memory:')
+    with requests_mock.Mocker() as mock:
+        mock.post('https://api.kraken.com/0/private/Balance', json={'error': [], 'result': {'XXBT': '5'}})
+        mock.post('https://api.kraken.com/0/private/Ledgers', json=ledgers)
+        mock.post('https://api.kraken.com/0/private/TradesHistory', json={
+            'error': [], 'result': {'trades': {}, 'count': 0}
+        })
+        first = kraken.sync(store)
+        ledger['L6'] = {'time': 6.0, 'asset': 'XXBT', 'amount': '1', 'balance': '6'}
+        second = kraken.sync(store)
+
+    assert first == {'ledger': 5, 'trades': 0}
+    assert second == {'ledger': 1, 'trades': 0}
+    assert store.cursor('ledger') == 'L6'
+    assert store.holdings() == [['bitcoin', '5.0']]
+    ledger_requests = [parse_qs(x.text) for x in mock.request_history if x.path.endswith('ledgers')]
+    # three pages on the first sync, one page after L5 on the second
+    assert [x.get('start') for x in ledger_requests] == [None, None, None, ['L5']]
@@ -0,0 +1,97 @@
+from urllib.parse import urlsplit
+
+import numpy as np
+import requests_mock
+
+from madcc.kraken.kraken import KrakenScheduler
+from madcc.kraken.market import KrakenDownloader
+
+TRADES_URL = 'https://api.kraken.com/0/public/Trades'
+OHLC_URL = 'https://api.kraken.com/0/public/OHLC'
+
+
+def trades_page(start, count):
+    trades = [['{}.0'.format(100 + x), '0.5', 1000.0 + x, 'bs'[x % 2], 'l', '', x + 1]
+              for x in range(start, start + count)]
+    return {'error': [], 'result': {'XXBTZEUR': trades, 'last': str(int((1000 + start + count) * 1e9))}}
+
+
+def candles(start, count):
+    return [[60 * x, '1.0', '2.0', '0.5', '1.5', '1.2', '10.0', 3] for x in range(start, start + count)]
+
+
+def downloader(tmpdir, **kwargs):
+    return KrakenDownloader(str(tmpdir), scheduler=KrakenScheduler('public', sleep=lambda x: None), **kwargs)
+
+
+def public_params(request):
+    # krakenex sends public calls as GET since 2.2, as POST before that
+    return request.text if request.method == 'POST' else urlsplit(request.url).query
+
+
+def test_download_trades_pages_and_resumes(tmpdir):
+    with requests_mock.Mocker() as mock:
+        mock.register_uri(requests_mock.ANY, TRADES_URL, [{'json': trades_page(0, 1000)}, {'json': trades_page(1000, 5)}])
+        assert downloader(tmpdir).trades('XBTEUR') == 1005
+
+        mock.register_uri(requests_mock.ANY, TRADES_URL, json=trades_page(1005, 2))
+        assert downloader(tmpdir).trades('XBTEUR') == 2
+
+    # the first run pages from the first trade, every later call starts at
+    # the cursor of the last stored page
+    assert [public_params(x) for x in mock.request_history] == [
+        'pair=XBTEUR&since=0', 'pair=XBTEUR&since=2000000000000', 'pair=XBTEUR&since=2005000000000'
+    ]
+    trades = downloader(tmpdir).store('XBTEUR', 'trades').read()
+    assert len(trades) == 1007
+    assert list(trades[-1]) == [2006.0, 1106.0, 0.5, 1007, 0, 1]
+    assert len(downloader(tmpdir).store('XBTEUR', 'trades').read(1500, 1600)) == 100
+
+
+def test_download_trades_since(tmpdir):
+    with requests_mock.Mocker() as mock:
+        mock.register_uri(requests_mock.ANY, TRADES_URL, json=trades_page(0, 5))
+        assert downloader(tmpdir, since=1500000000).trades('XBTEUR') == 5
+
+    assert public_params(mock.request_history[0]) == 'pair=XBTEUR&since=1500000000'
+
+
+def test_download_trades_interrupted(tmpdir):
+    with requests_mock.Mocker() as mock:
+        mock.register_uri(requests_mock.ANY, TRADES_URL, [{'json': trades_page(0, 1000)}, {'json': {'error': ['EGeneral:Invalid arguments']}}])
+        result = downloader(tmpdir).download(['XBTEUR'], intervals=())
+        assert result == {'XBTEUR': {'trades': 'EGeneral:Invalid arguments'}}
+
+        mock.register_uri(requests_mock.ANY, TRADES_URL, json=trades_page(1000, 5))
+        assert downloader(tmpdir).download(['XBTEUR'], intervals=()) == {'XBTEUR': {'trades': 5}}
+
+    assert public_params(mock.request_history[-1]) == 'pair=XBTEUR&since=2000000000000'
+    assert len(downloader(tmpdir).store('XBTEUR', 'trades')) == 1005
+
+
+def test_download_ohlc(tmpdir):
+    with requests_mock.Mocker() as mock:
+        mock.register_uri(requests_mock.ANY, OHLC_URL, json={'error': [], 'result': {'XXBTZEUR': candles(0, 5), 'last': 240}})
+        assert downloader(tmpdir).ohlc('XBTEUR') == 4
+
+        # candles up to the stored one come again, the open one is skipped
+        mock.register_uri(requests_mock.ANY, OHLC_URL, json={'error': [], 'result': {'XXBTZEUR': candles(3, 4), 'last': 360}})
+        assert downloader(tmpdir).ohlc('XBTEUR') == 2
+
+    assert public_params(mock.request_history[-1]) == 'pair=XBTEUR&interval=1&since=180'
+    ohlc = downloader(tmpdir).store('XBTEUR', 'ohlc-1').read()
+    np.testing.assert_array_equal(ohlc['time'], [0, 60, 120, 180, 240, 300])
+    assert list(ohlc[0])[1:] == [1.0, 2.0, 0.5, 1.5, 1.2, 10.0, 3]
+
+
+def test_download_pairs(tmpdir):
+    with requests_mock.Mocker() as mock:
+        mock.register_uri(requests_mock.ANY, TRADES_URL, json=trades_page(0, 3))
+        mock.register_uri(requests_mock.ANY, OHLC_URL, json={'error': [], 'result': {'XXBTZEUR': candles(0, 3), 'last': 120}})
+        result = downloader(tmpdir, concurrency=2).download(['XBTEUR', 'ETHEUR'], intervals=(1, 60))
+
+    assert result == {
+        'XBTEUR': {'trades': 3, 'ohlc-1': 2, 'ohlc-60': 2},
+        'ETHEUR': {'trades': 3, 'ohlc-1': 2, 'ohlc-60': 2},
+    }
+    assert sorted(x.basename for x in tmpdir.join('ETHEUR').listdir()) == ['ohlc-1', 'ohlc-60', 'trades']
@@ -0,0 +1,46 @@
+from madcc.kraken import KrakenStore
+
+
+ledger_page = {
+    'L1': {'refid': 'R1', 'time': 100.0, 'type': 'deposit', 'subtype': '', 'aclass': 'currency',
+           'asset': 'XXBT', 'amount': '1.5', 'fee': '0', 'balance': '1.5'},
+    'L2': {'refid': 'R2', 'time': 200.0, 'type': 'trade', 'subtype': '', 'aclass': 'currency',
+           'asset': 'ZEUR', 'amount': '-100', 'fee': '0.2', 'balance': '400'},
+}
+
+
+def test_kraken_store_add_and_query():
+    store = KrakenStore(':memory:')
+
+    assert store.add('ledger', ledger_page) == 2
+    assert store.add('ledger', ledger_page) == 0
+    assert [x[0] for x in store.ledger()] == ['L1', 'L2']
+    assert list(store.ledger(asset='ZEUR')) == [('L2', 200.0, 'trade', 'ZEUR', -100.0, 0.2, 400.0)]
+    assert [x[0] for x in store.ledger(since=150)] == ['L2']
+
+
+def test_kraken_store_cursor(tmpdir):
+    store = KrakenStore(str(tmpdir.join('kraken.sqlite')))
+    assert store.cursor('ledger') is None
+    store.set_cursor('ledger', 'L2')
+    store.close()
+
+    assert KrakenStore(str(tmpdir.join('kraken.sqlite'))).cursor('ledger') == 'L2'
+
+
+def test_kraken_store_holdings():
+    store = KrakenStore(':memory:')
+    store.set_balances({'XXBT': '1.5', 'ZEUR': '400.0', 'XNEW': '3', 'XETH': '0.0'})
+
+    assert store.holdings({'XNEW': 'new-coin'}) == [
+        ['new-coin', '3.0'], ['bitcoin', '1.5'], ['eur', '400.0']
+    ]
+
+
+def test_kraken_store_holdings_staked_and_untraded():
+    store = KrakenStore(':memory:')
+    store.set_balances({'DOT.S': '10', 'ETH2.S': '2', 'XBT.M': '0.5', 'KFEE': '100', 'FOO.S': '1'})
+
+    assert store.holdings() == [
+        ['polkadot', '10.0'], ['ethereum', '2.0'], ['foo.s', '1.0'], ['bitcoin', '0.5']
+    ]
@@ -0,0 +1,183 @@
+import base64
+import hashlib
+import json
+import socket
+import socketserver
+import struct
+import threading
+import time
+
+import pytest
+import requests_mock
+
+from madcc.kraken.stream import KrakenTickerStream
+from madcc.utils.price_sources import KrakenSource, KrakenStreamSource
+
+
+class WebSocketHandler(socketserver.StreamRequestHandler):
+    # Just enough of RFC 6455 and the Kraken ticker feed for the tests
+    def handle(self):
+        key = None
+        for line in iter(self.rfile.readline, b'\r\n'):
+            if line.lower().startswith(b'sec-websocket-key:'):
+                key = line.split(b':', 1)[1].strip()
+        accept = base64.b64encode(hashlib.sha1(key + b'258EAFA5-E914-47DA-95CA-C5AB0DC85B11').digest())
+        self.wfile.write(b'HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\n'
+                         b'Connection: Upgrade\r\nSec-WebSocket-Accept: ' + accept + b'\r\n\r\n')
+        self.pairs = set()
+        with self.server.lock:
+            self.server.clients.append(self)
+        try:
+            while True:
+                head = self.rfile.read(2)
+                if len(head) < 2 or head[0] & 0x0f == 8:
+                    return
+                length = head[1] & 0x7f
+                if length == 126:
+                    length = struct.unpack('>H', self.rfile.read(2))[0]
+                mask = self.rfile.read(4)
+                payload = bytes(x ^ mask[i % 4] for i, x in enumerate(self.rfile.read(length)))
+                self.subscribe(json.loads(payload.decode())['pair'])
+        finally:
+            with self.server.lock:
+                self.server.clients.remove(self)
+
+    def send(self, message):
+        payload = json.dumps(message).encode()
+        head = struct.pack('>BB', 0x81, len(payload)) if len(payload) < 126 else \
+            struct.pack('>BBH', 0x81, 126, len(payload))
+        with self.server.lock:
+            self.wfile.write(head + payload)
+
+    def subscribe(self, pairs):
+        for pair in pairs:
+            if pair not in self.server.prices:
+                self.send({'event': 'subscriptionStatus', 'status': 'error', 'pair': pair,
+                           'errorMessage': 'Currency pair not supported'})
+                continue
+            self.pairs.add(pair)
+            self.send({'event': 'subscriptionStatus', 'status': 'subscribed', 'pair': pair})
+            self.send([1, {'c': [self.server.prices[pair], '0.1']}, 'ticker', pair])
+
+
+class WebSocketStub(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, prices):
+        socketserver.ThreadingTCPServer.__init__(self, ('127.0.0.1', 0), WebSocketHandler)
+        self.prices = prices
+        self.clients = list()
+        self.lock = threading.RLock()
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    @property
+    def url(self):
+        return 'ws://127.0.0.1:{}'.format(self.server_address[1])
+
+    def push(self, pair, price):
+        self.prices[pair] = price
+        with self.lock:
+            for client in list(self.clients):
+                if pair in client.pairs:
+                    client.send([1, {'c': [price, '0.1']}, 'ticker', pair])
+
+    def drop(self):
+        with self.lock:
+            for client in list(self.clients):
+                client.connection.shutdown(socket.SHUT_RDWR)
+
+
+@pytest.fixture
+def stub():
+    server = WebSocketStub({'XBT/EUR': '20000.0', 'ETH/EUR': '1000.0'})
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition() and time.time() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def test_ticker_stream(stub):
+    stream = KrakenTickerStream(stub.url, backoff=0.01)
+    stream.subscribe(['XBT/EUR'])
+    assert stream.wait(['XBT/EUR'], 5) == {'XBT/EUR': 20000.0}
+
+    stream.subscribe(['XBT/EUR', 'ETH/EUR', 'FOO/EUR'])
+    assert stream.wait(['ETH/EUR', 'FOO/EUR'], 5) == {'ETH/EUR': 1000.0}
+    assert stream.errors == {'FOO/EUR': 'Currency pair not supported'}
+
+    start = time.time()
+    stub.push('XBT/EUR', '21000.0')
+    assert stream.wait_update(start, 5) is True
+    assert stream.prices['XBT/EUR'][0] == 21000.0
+    assert stream.wait_update(time.time(), 0.01) is False
+    assert stream.connects == 1
+    stream.stop()
+
+
+def test_ticker_stream_reconnect(stub):
+    stream = KrakenTickerStream(stub.url, backoff=0.01)
+    stream.subscribe(['XBT/EUR', 'ETH/EUR'])
+    stream.wait(['XBT/EUR', 'ETH/EUR'], 5)
+
+    stub.prices['ETH/EUR'] = '1100.0'
+    stub.drop()
+    # all pairs are subscribed again after reconnecting
+    assert wait_for(lambda: stream.prices['ETH/EUR'][0] == 1100.0)
+    assert stream.connects == 2
+    stream.stop()
+
+
+def test_ticker_stream_max_age(stub):
+    stream = KrakenTickerStream(stub.url, backoff=0.01)
+    stream.subscribe(['XBT/EUR'])
+    stream.wait(['XBT/EUR'], 5)
+    stream.stop()
+    # the feed is gone, so the last price it sent only gets older
+    stream.prices['XBT/EUR'] = (20000.0, time.time() - 120)
+
+    assert stream.wait(['XBT/EUR'], 0.01, max_age=60) == {}
+    assert stream.wait(['XBT/EUR'], 0.01) == {'XBT/EUR': 20000.0}
+
+
+def test_ticker_stream_unreachable():
+    stream = KrakenTickerStream('ws://127.0.0.1:1', backoff=0.01, max_backoff=0.02)
+    stream.subscribe(['XBT/EUR'])
+
+    assert stream.wait(['XBT/EUR'], 0.1) == {}
+    assert stream.connects == 0
+    stream.stop()
+
+
+def test_kraken_stream_source(stub):
+    asset_pairs = {'error': [], 'result': {
+        'XXBTZEUR': {'base': 'XXBT', 'quote': 'ZEUR', 'wsname': 'XBT/EUR'},
+        'XETHZEUR': {'base': 'XETH', 'quote': 'ZEUR', 'wsname': 'ETH/EUR'},
+        'XXBTZEUR.d': {'base': 'XXBT', 'quote': 'ZEUR'},
+    }}
+    stream = KrakenTickerStream(stub.url, backoff=0.01)
+    source = KrakenStreamSource(KrakenSource(), stream)
+    with requests_mock.Mocker() as mock:
+        mock.register_uri(requests_mock.ANY, 'https://api.kraken.com/0/public/AssetPairs', json=asset_pairs)
+        result = source.quotes(['bitcoin', 'ethereum', 'unknown'], 'eur')
+        stub.push('XBT/EUR', '22000.0')
+        assert wait_for(lambda: stream.prices['XBT/EUR'][0] == 22000.0)
+        again = source.quotes(['bitcoin'], 'eur')
+        usd = source.quotes(['bitcoin'], 'usd')
+
+    assert result == {
+        'bitcoin': {'website_slug': 'bitcoin', 'quotes': {'EUR': {'price': 20000.0}}},
+        'ethereum': {'website_slug': 'ethereum', 'quotes': {'EUR': {'price': 1000.0}}},
+    }
+    assert again['bitcoin']['quotes']['EUR']['price'] == 22000.0
+    # without a cache the asset pairs are looked up for every quote, the
+    # prices themselves never take a request
+    assert [x.path for x in mock.request_history] == ['/0/public/assetpairs'] * 3
+    assert usd == {}
+    stream.stop()
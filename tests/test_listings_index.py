@@ -0,0 +1,58 @@
+from madcc.utils.listings_index import Coin, ListingsIndex
+
+listings = [
+    {'id': 1, 'name': 'Bitcoin', 'symbol': 'BTC', 'website_slug': 'bitcoin'},
+    {'id': 1027, 'name': 'Ethereum', 'symbol': 'ETH', 'website_slug': 'ethereum'},
+    {'id': 2, 'name': 'Litecoin', 'symbol': 'LTC', 'website_slug': 'litecoin'},
+    {'id': 3000, 'name': 'Bitcoin Token', 'symbol': 'BTC', 'website_slug': 'bitcoin-token'},
+]
+
+
+def test_listings_index_empty(tmpdir):
+    index = ListingsIndex(str(tmpdir.join('listings.idx')))
+
+    assert len(index) == 0
+    assert index.lookup('bitcoin') is None
+    assert index.updated == 0.0
+
+
+def test_listings_index_lookup(tmpdir):
+    path = str(tmpdir.join('listings.idx'))
+    assert ListingsIndex(path).update(listings) is True
+    index = ListingsIndex(path)
+
+    assert len(index) == 4
+    assert index.by_slug('litecoin') == Coin(2, 'litecoin', 'LTC', 0)
+    assert index.by_symbol('eth').id == 1027
+    # shared symbols resolve to the oldest listing without ranks
+    assert index.lookup('btc').slug == 'bitcoin'
+    assert index.lookup('bitcoin-token').id == 3000
+    assert index.lookup('dogecoin') is None
+    assert index.age() < 60
+
+
+def test_listings_index_many(tmpdir):
+    index = ListingsIndex(str(tmpdir.join('listings.idx')))
+    index.update(
+        {'id': i, 'symbol': 'C{}'.format(i), 'website_slug': 'coin-{}'.format(i)} for i in range(1, 5001)
+    )
+
+    assert all(index.by_slug('coin-{}'.format(i)).id == i for i in range(1, 5001))
+    assert all(index.by_symbol('c{}'.format(i)).id == i for i in range(1, 5001))
+
+
+def test_listings_index_merge(tmpdir):
+    index = ListingsIndex(str(tmpdir.join('listings.idx')))
+    index.update(listings)
+    updated = index.updated
+
+    assert index.update([dict(listings[3], rank=5), dict(listings[0], rank=7)], complete=False) is True
+    assert index.lookup('btc').slug == 'bitcoin-token'
+    assert index.update([dict(listings[3], rank=5)], complete=False) is False
+    assert index.update([{'id': 4, 'symbol': 'NEW', 'website_slug': 'new-coin'}], complete=False) is True
+    assert len(index) == 5
+    assert index.updated == updated
+
+    # a complete update drops delisted coins and keeps known ranks
+    index.update(listings[:1])
+    assert list(index) == [Coin(1, 'bitcoin', 'BTC', 7)]
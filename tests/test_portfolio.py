@@ -0,0 +1,69 @@
+import numpy as np
+import pytest
+from tabulate import tabulate
+
+from madcc.utils.portfolio import Portfolio, render_table, walk_bids
+
+
+def test_portfolio_columns():
+    portfolio = Portfolio(
+        'eur', ['litecoin', 'bitcoin', 'eur', 'dogecoin'],
+        np.array([250.0, 12.05, 500.0, 0.0]), np.array([130.55, 6615.31, 1.0, 0.1])
+    )
+
+    assert len(portfolio) == 4
+    assert portfolio.symbols == ['bitcoin', 'litecoin', 'eur', 'dogecoin']
+    assert portfolio.total == pytest.approx(12.05 * 6615.31 + 250 * 130.55 + 500)
+    assert portfolio.percentages.sum() == pytest.approx(100, abs=0.02)
+    assert portfolio.headers[3:] == ['eur price', 'eur total']
+    assert portfolio.table()[-1] == ['total', None, None, None, portfolio.total]
+    assert [type(x) for x in portfolio.rows()[0]] == [str, float, float, float, float]
+
+
+def test_walk_bids():
+    books = [
+        (np.array([100.0, 99.0, 90.0]), np.array([1.0, 2.0, 3.0])),
+        (np.array([1e-5, 0.9e-5]), np.array([1e9, 1e9])),
+        (np.array([]), np.array([])),
+        (np.array([10.0]), np.array([1.0])),
+    ]
+    values, sold = walk_bids([2.5, 1.5e9, 1.0, 4.0], books)
+
+    assert values.tolist() == pytest.approx([100 + 1.5 * 99, 1e4 + 0.5e9 * 0.9e-5, 0, 10])
+    # the empty book sells nothing, the last one only its single coin
+    assert sold.tolist() == pytest.approx([2.5, 1.5e9, 0, 1])
+
+
+def test_portfolio_liquidate():
+    portfolio = Portfolio(
+        'eur', ['bitcoin', 'eur', 'dogecoin'], np.array([2.0, 500.0, 10.0]), np.array([20000.0, 1.0, 0.1])
+    )
+    portfolio.liquidate({'bitcoin': (np.array([20000.0, 19000.0]), np.array([1.0, 5.0]))}, cash=['eur'])
+
+    assert portfolio.headers[5:] == ['eur liquidation', 'slippage %']
+    assert portfolio.rows() == [
+        ['bitcoin', 2.0, 98.76, 20000.0, 40000.0, 39000.0, 2.5],
+        ['eur', 500.0, 1.23, 1.0, 500.0, 500.0, 0.0],
+        ['dogecoin', 10.0, 0.0, 0.1, 1.0, None, None],
+    ]
+    # coins without a book count at their total
+    assert portfolio.table()[-1] == ['total', None, None, None, 40501.0, 39501.0, 2.47]
+
+
+def test_portfolio_keeps_order_of_equal_totals():
+    portfolio = Portfolio('usd', ['b', 'a', 'c'], np.ones(3), np.array([1.0, 1.0, 2.0]))
+
+    assert portfolio.symbols == ['c', 'b', 'a']
+
+
+@pytest.mark.parametrize('floatfmt', ['.2f', '.10f', ['', '.10f', '.2f', '.2f', '.2f']])
+def test_render_table_matches_tabulate(floatfmt):
+    headers = ['symbol', 'amount', '%', 'eur price', 'eur total']
+    table = [
+        ['bitcoin', 12.05, 52.35, 6615.31631639, 79714.5616124995],
+        ['a-very-long-coin-name', 0.001, 0.0, 0.00000123, 0.0],
+        ['eur', 500.0, 0.33, 1, 500.0],
+        ['total', None, None, None, 152261.3705894465],
+    ]
+
+    assert render_table(headers, table, floatfmt) == tabulate(table, headers=headers, floatfmt=floatfmt)
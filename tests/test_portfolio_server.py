@@ -0,0 +1,88 @@
+import threading
+import time
+
+import pytest
+import requests
+
+from madcc.utils.portfolio_server import PortfolioServer, PortfolioService
+
+
+table = (['symbol', 'amount', '%', 'eur price', 'eur total'], [['total', None, None, None, 10.0]])
+
+
+def make_factory(mocker, delay=0):
+    def generate_crypto_table(crypto_data):
+        time.sleep(delay)
+        return table
+
+    ca = mocker.Mock()
+    ca.parse_crypto_file.return_value = [['bitcoin', '1']]
+    ca.generate_crypto_table.side_effect = generate_crypto_table
+    return mocker.Mock(return_value=ca), ca
+
+
+def test_portfolio_service_coalesces_requests(mocker):
+    factory, ca = make_factory(mocker, delay=0.2)
+    service = PortfolioService(factory)
+    threads = [threading.Thread(target=service.table, args=('eur',)) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    service.table('eur')
+    metrics = service.metrics()
+
+    assert ca.generate_crypto_table.call_count == 1
+    assert ca.cache.save.call_count == 1
+    assert metrics['requests'] == 6
+    assert metrics['fetches'] == 1
+    assert metrics['coalesced'] + metrics['hits'] == 5
+    assert metrics['hit_rate'] == pytest.approx(5 / 6)
+    assert metrics['latency']['max'] >= 0.2
+
+
+def test_portfolio_service_max_age(mocker):
+    factory, ca = make_factory(mocker)
+    service = PortfolioService(factory, max_age=0)
+    service.table('eur')
+    time.sleep(0.01)
+    result = service.table('eur')
+
+    assert ca.generate_crypto_table.call_count == 2
+    assert result == {'currency': 'eur', 'headers': table[0], 'rows': table[1]}
+
+
+def test_portfolio_service_error(mocker):
+    factory, ca = make_factory(mocker)
+    ca.parse_crypto_file.return_value = False
+    service = PortfolioService(factory)
+
+    with pytest.raises(ValueError):
+        service.table('eur')
+    assert service.metrics()['errors'] == 1
+
+
+def test_portfolio_server(mocker):
+    factory, ca = make_factory(mocker)
+    server = PortfolioServer(('127.0.0.1', 0), PortfolioService(factory), 'eur')
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = 'http://127.0.0.1:{}'.format(server.server_address[1])
+    try:
+        default = requests.get(url + '/portfolio')
+        usd = requests.get(url + '/portfolio/USD')
+        unknown = requests.get(url + '/portfolio/abc')
+        metrics = requests.get(url + '/metrics').json()
+        trace = requests.get(url + '/trace').json()
+        prometheus = requests.get(url + '/trace?format=prometheus')
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    assert default.json()['currency'] == 'eur'
+    assert usd.status_code == 200
+    factory.assert_called_with('usd')
+    assert unknown.status_code == 404
+    assert metrics['requests'] == 2
+    assert set(trace) == {'spans', 'http'}
+    assert prometheus.headers['Content-Type'].startswith('text/plain')
+    assert '# TYPE madcc_span_calls_total counter' in prometheus.text
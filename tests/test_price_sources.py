@@ -0,0 +1,356 @@
+import json
+import threading
+from urllib.parse import urlsplit
+
+import pytest
+import requests_mock
+
+from madcc.utils.cache import DiskCache
+from madcc.utils.listings_index import ListingsIndex
+from madcc.utils.price_sources import (CachedPriceSource, CoinMarketCapSource, FileSource,
+                                       HedgedPriceSource, KrakenSource, PriceSource)
+
+
+base_url = 'http://stub/v2/'
+
+listings = {'data': [
+    {'id': 1, 'name': 'Bitcoin', 'symbol': 'BTC', 'website_slug': 'bitcoin'},
+    {'id': 1027, 'name': 'Ethereum', 'symbol': 'ETH', 'website_slug': 'ethereum'},
+    {'id': 2, 'name': 'Litecoin', 'symbol': 'LTC', 'website_slug': 'litecoin'},
+]}
+
+
+def ticker_page(request, context):
+    data = dict()
+    start = int(request.qs['start'][0])
+    limit = int(request.qs['limit'][0])
+    for rank, coin in enumerate(listings['data'][start - 1:start - 1 + limit], start):
+        data[str(coin['id'])] = dict(coin, rank=rank, quotes={'EUR': {'price': float(rank)}})
+    return {'data': data}
+
+
+def test_coinmarketcap_source_quotes():
+    source = CoinMarketCapSource(base_url=base_url)
+    with requests_mock.Mocker() as mock:
+        mock.get(base_url + 'listings/', json=listings)
+        mock.get(base_url + 'ticker/', json=ticker_page)
+        result = source.quotes(['bitcoin', 'litecoin', 'eur'], 'eur')
+
+    assert sorted(result) == ['bitcoin', 'litecoin']
+    assert result['litecoin']['quotes']['EUR']['price'] == 3.0
+    assert mock.call_count == 2
+
+
+def test_coinmarketcap_source_paging():
+    source = CoinMarketCapSource(base_url=base_url)
+    source.PAGE_SIZE = 1
+    with requests_mock.Mocker() as mock:
+        mock.get(base_url + 'listings/', json=listings)
+        mock.get(base_url + 'ticker/', json=ticker_page)
+        result = source.quotes(['ethereum'], 'eur')
+
+    assert list(result) == ['ethereum']
+    # listings plus two pages, the third page is never requested
+    assert mock.call_count == 3
+    assert mock.request_history[-1].qs['start'] == ['2']
+
+
+def test_coinmarketcap_source_concurrent_pages():
+    source = CoinMarketCapSource(base_url=base_url, concurrency=2)
+    source.PAGE_SIZE = 1
+    with requests_mock.Mocker() as mock:
+        mock.get(base_url + 'listings/', json=listings)
+        mock.get(base_url + 'ticker/', json=ticker_page)
+        result = source.quotes(['litecoin'], 'eur')
+
+    assert list(result) == ['litecoin']
+    assert sorted(x.qs['start'][0] for x in mock.request_history[1:]) == ['1', '2', '3']
+
+
+def test_coinmarketcap_source_nothing_held():
+    source = CoinMarketCapSource(base_url=base_url)
+    with requests_mock.Mocker() as mock:
+        mock.get(base_url + 'listings/', json=listings)
+        result = source.quotes(['eur'], 'eur')
+
+    assert result == {}
+    assert mock.call_count == 1
+
+
+def test_coinmarketcap_source_cached_slug_ids(tmpdir):
+    source = CoinMarketCapSource(base_url=base_url, cache=DiskCache(str(tmpdir.join('cache.json'))))
+    with requests_mock.Mocker() as mock:
+        mock.get(base_url + 'listings/', json=listings)
+        source.slug_ids()
+        result = source.slug_ids()
+
+    assert result == {'bitcoin': 1, 'ethereum': 1027, 'litecoin': 2}
+    assert mock.call_count == 1
+
+
+def test_coinmarketcap_source_index(tmpdir):
+    path = str(tmpdir.join('listings.idx'))
+    source = CoinMarketCapSource(base_url=base_url, index=ListingsIndex(path))
+    with requests_mock.Mocker() as mock:
+        mock.get(base_url + 'listings/', json=listings)
+        mock.get(base_url + 'ticker/', json=ticker_page)
+        source.quotes(['bitcoin'], 'eur')
+        # a new run only requests the ticker page, and resolves symbols
+        source = CoinMarketCapSource(base_url=base_url, index=ListingsIndex(path))
+        result = source.quotes(['ltc', 'ethereum'], 'eur')
+
+    assert [x.url.split('?')[0] for x in mock.request_history] == [
+        base_url + 'listings/', base_url + 'ticker/', base_url + 'ticker/'
+    ]
+    assert sorted(result) == ['ethereum', 'ltc']
+    assert result['ltc']['website_slug'] == 'ltc'
+    assert result['ltc']['quotes']['EUR']['price'] == 3.0
+    # ranks of the ticker pages were merged into the index
+    assert ListingsIndex(path).by_slug('litecoin').rank == 3
+
+
+def test_coinmarketcap_source_index_refresh(tmpdir, mocker):
+    index = ListingsIndex(str(tmpdir.join('listings.idx')))
+    index.update(listings['data'][:1])
+    mocker.patch.object(index, 'age', return_value=100000)
+    source = CoinMarketCapSource(base_url=base_url, index=index)
+    with requests_mock.Mocker() as mock:
+        mock.get(base_url + 'listings/', json=listings)
+        mock.get(base_url + 'ticker/', json=ticker_page)
+        # the stale index is used while the listings are downloaded
+        result = source.quotes(['bitcoin'], 'eur')
+        source._refresh.join()
+
+    assert list(result) == ['bitcoin']
+    assert sorted(x.url.split('?')[0] for x in mock.request_history) == [
+        base_url + 'listings/', base_url + 'ticker/'
+    ]
+    assert len(index) == 3
+
+
+def test_cached_price_source(tmpdir, mocker):
+    upstream = mocker.Mock()
+    upstream.iter_quotes.return_value = iter([('bitcoin', {'website_slug': 'bitcoin'})])
+    source = CachedPriceSource(upstream, DiskCache(str(tmpdir.join('cache.json'))))
+    source.quotes(['bitcoin', 'unknown'], 'eur')
+    result = source.quotes(['bitcoin', 'unknown'], 'eur')
+
+    upstream.iter_quotes.assert_called_once()
+    assert result == {'bitcoin': {'website_slug': 'bitcoin'}}
+
+
+def test_cached_price_source_offline(tmpdir, mocker):
+    upstream = mocker.Mock()
+    cache = DiskCache(str(tmpdir.join('cache.json')))
+    cache.set('quote:eur:bitcoin', {'website_slug': 'bitcoin'})
+    source = CachedPriceSource(upstream, cache, ttl=0, offline=True)
+    result = source.quotes(['bitcoin', 'ethereum'], 'eur')
+
+    upstream.iter_quotes.assert_not_called()
+    assert result == {'bitcoin': {'website_slug': 'bitcoin'}}
+
+
+def test_coinmarketcap_source_iter_quotes_streams_pages():
+    source = CoinMarketCapSource(base_url=base_url)
+    source.PAGE_SIZE = 1
+    with requests_mock.Mocker() as mock:
+        mock.get(base_url + 'listings/', json=listings)
+        mock.get(base_url + 'ticker/', json=ticker_page)
+        quotes = source.iter_quotes(['bitcoin', 'litecoin'], 'eur')
+        first = next(quotes)
+        # listings and the first page only
+        assert mock.call_count == 2
+        rest = list(quotes)
+
+    assert first[0] == 'bitcoin'
+    assert [x[0] for x in rest] == ['litecoin']
+
+
+kraken_url = 'https://api.kraken.com/0/public/'
+asset_pairs = {'error': [], 'result': {
+    'XXBTZEUR': {'base': 'XXBT', 'quote': 'ZEUR'},
+    'XXBTZEUR.d': {'base': 'XXBT', 'quote': 'ZEUR'},
+    'DOTEUR': {'base': 'DOT', 'quote': 'ZEUR'},
+    'ZEURZUSD': {'base': 'ZEUR', 'quote': 'ZUSD'},
+}}
+
+
+def public_params(request):
+    # krakenex sends public calls as GET since 2.2, as POST before that
+    return request.text if request.method == 'POST' else urlsplit(request.url).query
+
+
+def kraken_ticker(request, context):
+    prices = {'XXBTZEUR': '20000.0', 'DOTEUR': '5.5', 'ZEURZUSD': '1.25'}
+    pairs = public_params(request).split('pair=')[1].split('&')[0].replace('%2C', ',').split(',')
+    return {'error': [], 'result': dict((x, {'c': [prices[x], '0.1']}) for x in pairs)}
+
+
+def test_kraken_source_quotes(tmpdir):
+    source = KrakenSource(cache=DiskCache())
+    with requests_mock.Mocker() as mock:
+        mock.register_uri(requests_mock.ANY, kraken_url + 'AssetPairs', json=asset_pairs)
+        mock.register_uri(requests_mock.ANY, kraken_url + 'Ticker', json=kraken_ticker)
+        result = source.quotes(['bitcoin', 'polkadot', 'unknown'], 'eur')
+        source.quotes(['bitcoin'], 'eur')
+
+    assert result == {
+        'bitcoin': {'website_slug': 'bitcoin', 'quotes': {'EUR': {'price': 20000.0}}},
+        'polkadot': {'website_slug': 'polkadot', 'quotes': {'EUR': {'price': 5.5}}},
+    }
+    # the asset pairs are only looked up once
+    assert [x.path for x in mock.request_history] == ['/0/public/assetpairs', '/0/public/ticker',
+                                                      '/0/public/ticker']
+
+
+def test_kraken_source_rates_and_unknown_currency():
+    source = KrakenSource()
+    with requests_mock.Mocker() as mock:
+        mock.register_uri(requests_mock.ANY, kraken_url + 'AssetPairs', json=asset_pairs)
+        mock.register_uri(requests_mock.ANY, kraken_url + 'Ticker', json=kraken_ticker)
+        rates = source.rates([('EUR', 'USD'), ('USD', 'EUR'), ('EUR', 'KRW')])
+
+        assert source.quotes(['bitcoin'], 'krw') == {}
+
+    assert rates == {'EUR_USD': 1.25, 'USD_EUR': 0.8}
+
+
+def test_kraken_source_error():
+    source = KrakenSource()
+    with requests_mock.Mocker() as mock:
+        mock.register_uri(requests_mock.ANY, kraken_url + 'AssetPairs', json={'error': ['EService:Unavailable']})
+        with pytest.raises(ValueError):
+            source.quotes(['bitcoin'], 'eur')
+
+
+def kraken_depth(request, context):
+    books = {
+        'XXBTZEUR': {'bids': [['20000.0', '0.5', 1], ['19900.0', '2.0', 2]], 'asks': []},
+        'ZEURZUSD': {'bids': [], 'asks': [['1.25', '100', 1], ['1.3', '1000', 2]]},
+    }
+    pair = public_params(request).split('pair=')[1].split('&')[0]
+    if pair not in books:
+        return {'error': ['EQuery:Unknown asset pair']}
+    return {'error': [], 'result': {pair: books[pair]}}
+
+
+def test_kraken_source_books():
+    source = KrakenSource()
+    with requests_mock.Mocker() as mock:
+        mock.register_uri(requests_mock.ANY, kraken_url + 'AssetPairs', json=asset_pairs)
+        mock.register_uri(requests_mock.ANY, kraken_url + 'Depth', json=kraken_depth)
+        books = source.books(['bitcoin', 'polkadot', 'usd', 'unknown'], 'eur')
+        assert sorted(source.books(['bitcoin'], 'eur')) == ['bitcoin']
+
+    assert sorted(books) == ['bitcoin', 'usd']
+    assert books['bitcoin'][0].tolist() == [20000.0, 19900.0]
+    assert books['bitcoin'][1].tolist() == [0.5, 2.0]
+    # usd is sold for eur at the asks of the EUR/USD market
+    assert books['usd'][0].tolist() == pytest.approx([0.8, 1 / 1.3])
+    assert books['usd'][1].tolist() == pytest.approx([125.0, 1300.0])
+    # the failed polkadot book is left out, books are kept for book_ttl
+    assert sorted(public_params(x) for x in mock.request_history if x.path == '/0/public/depth') == [
+        'pair=DOTEUR&count=500', 'pair=XXBTZEUR&count=500', 'pair=ZEURZUSD&count=500'
+    ]
+
+
+def test_file_source(tmpdir):
+    assert FileSource(str(tmpdir.join('prices.json'))).quotes(['bitcoin'], 'eur') == {}
+    tmpdir.join('prices.json').write(json.dumps({'EUR': {'bitcoin': 2.5}}))
+
+    assert FileSource(str(tmpdir.join('prices.json'))).quotes(['bitcoin', 'ethereum'], 'eur') == {
+        'bitcoin': {'website_slug': 'bitcoin', 'quotes': {'EUR': {'price': 2.5}}}
+    }
+
+
+class StaticSource(PriceSource):
+    def __init__(self, prices, error=None, block=None):
+        self.prices = prices
+        self.error = error
+        self.block = block
+        self.asked = list()
+
+    def quotes(self, slugs, currency):
+        self.asked.append(slugs)
+        if self.block is not None:
+            self.block.wait(5)
+        if self.error is not None:
+            raise self.error
+        return dict((x, {'website_slug': x, 'price': self.prices[x]}) for x in slugs if x in self.prices)
+
+
+class SlowSource(StaticSource):
+    pass
+
+
+class FailingSource(StaticSource):
+    pass
+
+
+def test_hedged_price_source_failover():
+    failing = FailingSource({}, error=ValueError('down'))
+    working = StaticSource({'bitcoin': 1.0})
+    source = HedgedPriceSource([failing, working])
+    result = source.quotes(['bitcoin'], 'eur')
+
+    assert result['bitcoin']['price'] == 1.0
+    assert source.stats['FailingSource']['failures'] == 1
+    # the failed source is ranked last during its cooldown
+    assert source.ranked() == [working, failing]
+
+
+def test_hedged_price_source_hedges_slow_source():
+    release = threading.Event()
+    slow = SlowSource({'bitcoin': 1.0}, block=release)
+    fast = StaticSource({'bitcoin': 2.0})
+    source = HedgedPriceSource([slow, fast], hedge_after=0.01)
+    result = source.quotes(['bitcoin'], 'eur')
+    release.set()
+
+    assert result['bitcoin']['price'] == 2.0
+    assert source.stats['StaticSource']['hedges'] == 1
+    assert source.stats['StaticSource']['wins'] == 1
+
+
+def test_hedged_price_source_asks_others_for_missing_coins():
+    partial = SlowSource({'bitcoin': 1.0})
+    full = StaticSource({'bitcoin': 2.0, 'ethereum': 3.0})
+    source = HedgedPriceSource([partial, full])
+    result = source.quotes(['bitcoin', 'ethereum'], 'eur')
+
+    assert result['bitcoin']['price'] == 1.0
+    assert result['ethereum']['price'] == 3.0
+    assert full.asked == [['ethereum']]
+
+
+def test_hedged_price_source_all_failing():
+    source = HedgedPriceSource([FailingSource({}, error=ValueError('down'))])
+    with pytest.raises(ValueError):
+        source.quotes(['bitcoin'], 'eur')
+
+
+def test_hedged_price_source_partial_answer_after_failure(tmpdir):
+    failing = FailingSource({}, error=ValueError('down'))
+    partial = StaticSource({'bitcoin': 1.0})
+    cache = DiskCache(str(tmpdir.join('cache.json')))
+    source = CachedPriceSource(HedgedPriceSource([failing, partial]), cache)
+    with pytest.raises(ValueError):
+        source.quotes(['bitcoin', 'ethereum'], 'eur')
+
+    # the failed source may know ethereum, so it is not cached as unknown
+    assert cache.get('quote:eur:ethereum', default='missing') == 'missing'
+
+
+def test_hedged_price_source_waits_for_hedged_source_for_missing_coins():
+    release = threading.Event()
+    slow = SlowSource({'bitcoin': 1.0, 'ethereum': 2.0}, block=release)
+    fast = StaticSource({'bitcoin': 3.0})
+    source = HedgedPriceSource([slow, fast], hedge_after=0.01)
+    threading.Timer(0.1, release.set).start()
+    result = source.quotes(['bitcoin', 'ethereum'], 'eur')
+
+    assert result['bitcoin']['price'] == 3.0
+    assert result['ethereum']['price'] == 2.0
+    # the hedged source is not asked a second time
+    assert slow.asked == [['bitcoin', 'ethereum']]
+    assert fast.asked == [['bitcoin', 'ethereum']]
@@ -0,0 +1,66 @@
+import json
+import os
+
+import numpy as np
+
+from madcc.utils.series import SeriesStore
+
+DTYPE = np.dtype([('time', '<f8'), ('price', '<f8'), ('count', '<u4')])
+
+
+def rows(start, count):
+    result = np.zeros(count, DTYPE)
+    result['time'] = np.arange(start, start + count)
+    result['price'] = 100 + result['time'] / 7
+    result['count'] = result['time']
+    return result
+
+
+def test_series_store_append_and_read(tmpdir):
+    store = SeriesStore(str(tmpdir.join('trades')), DTYPE, chunk_rows=10)
+    assert len(store) == 0
+    assert store.last_time() is None
+    assert len(store.read()) == 0
+
+    start = 0
+    for count in (3, 4, 15, 1, 30, 2):
+        store.append(rows(start, count), cursor=str(start + count))
+        start += count
+    expected = rows(0, start)
+
+    assert len(store) == 55
+    assert store.cursor == '55'
+    assert store.last_time() == 54
+    # 5 compressed chunks and a tail of the 5 newest rows
+    assert sorted(os.listdir(str(tmpdir.join('trades')))) == [
+        'chunks.bin', 'chunks.idx', 'meta.json', 'tail.5.bin'
+    ]
+    np.testing.assert_array_equal(store.read(), expected)
+    np.testing.assert_array_equal(store.read(12, 33), expected[12:33])
+    np.testing.assert_array_equal(store.read(48), expected[48:])
+    np.testing.assert_array_equal(store.read(end=5), expected[:5])
+    assert len(store.read(100)) == 0
+
+
+def test_series_store_interrupted_append(tmpdir):
+    path = str(tmpdir.join('trades'))
+    store = SeriesStore(path, DTYPE, chunk_rows=10)
+    store.append(rows(0, 15), cursor='15')
+    with open(os.path.join(path, 'meta.json')) as f:
+        committed = json.load(f)
+    with open(os.path.join(path, 'tail.1.bin'), 'rb') as f:
+        tail = f.read()
+
+    # an append that wrote its chunks but died before committing them,
+    # leaving the committed tail in place
+    store.append(rows(15, 12), cursor='27')
+    with open(os.path.join(path, 'meta.json'), 'w') as f:
+        json.dump(committed, f)
+    with open(os.path.join(path, 'tail.1.bin'), 'wb') as f:
+        f.write(tail)
+
+    assert store.cursor == '15'
+    np.testing.assert_array_equal(store.read(), rows(0, 15))
+    # the leftovers are overwritten by the next append
+    store.append(rows(15, 12), cursor='27')
+    np.testing.assert_array_equal(SeriesStore(path, DTYPE, chunk_rows=10).read(), rows(0, 27))
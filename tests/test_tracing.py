@@ -0,0 +1,99 @@
+import json
+
+import pytest
+import requests
+import requests_mock
+
+from madcc.utils import tracing
+from madcc.utils.tracing import Tracer, instrument, traced
+
+
+@pytest.fixture
+def tracer(mocker):
+    tracer = Tracer(enabled=True)
+    mocker.patch.object(tracing, 'TRACER', tracer)
+    return tracer
+
+
+def test_span(tracer):
+    with tracer.span('work'):
+        pass
+    with tracer.span('work'):
+        pass
+
+    assert tracer.spans['work']['calls'] == 2
+    assert tracer.spans['work']['seconds'] >= tracer.spans['work']['max'] >= 0
+
+
+def test_span_error(tracer):
+    with pytest.raises(ValueError):
+        with tracer.span('fails'):
+            raise ValueError()
+
+    assert tracer.spans['fails']['calls'] == 1
+
+
+def test_traced(tracer):
+    @traced('double')
+    def double(x):
+        return 2 * x
+
+    assert double(2) == 4
+    assert double.__name__ == 'double'
+    assert tracer.spans['double']['calls'] == 1
+
+
+def test_disabled(tracer):
+    tracer.enabled = False
+
+    @traced('double')
+    def double(x):
+        return 2 * x
+
+    assert double(2) == 4
+    with tracer.span('work'):
+        pass
+    assert tracer.to_json() == {'spans': {}, 'http': {}}
+
+
+def test_instrument(tracer):
+    session = instrument(instrument(requests.Session()))
+    assert len(session.hooks['response']) == 1
+
+    with requests_mock.Mocker() as mock:
+        mock.post('https://api.example.com/ok', text='0123456789')
+        mock.get('https://api.example.com/missing', status_code=404, text='')
+        session.post('https://api.example.com/ok', data={'a': 'b'})
+        session.get('https://api.example.com/missing')
+
+    host = tracer.http['api.example.com']
+    assert host['requests'] == 2
+    assert host['errors'] == 1
+    assert host['bytes_sent'] == 3
+    assert host['bytes_received'] == 10
+
+
+def test_export(tracer):
+    tracer.record('convert', 0.5)
+    tracer.record('convert', 1.5)
+
+    assert json.loads(tracing.export('json'))['spans'] == {
+        'convert': {'calls': 2, 'seconds': 2.0, 'max': 1.5}
+    }
+    prometheus = tracing.export('prometheus').splitlines()
+    assert '# TYPE madcc_span_seconds_total counter' in prometheus
+    assert 'madcc_span_calls_total{span="convert"} 2' in prometheus
+    assert 'madcc_span_seconds_max{span="convert"} 1.5' in prometheus
+    assert 'convert' in tracing.export('text')
+
+
+def test_profile_format(mocker):
+    args = mocker.Mock()
+    args.grouped = {}
+    assert tracing.profile_format(args) is None
+    args.grouped = {'--profile': []}
+    assert tracing.profile_format(args) == 'text'
+    args.grouped = {'--profile': ['prometheus']}
+    assert tracing.profile_format(args) == 'prometheus'
+    args.grouped = {'--profile': ['eur']}
+    assert tracing.profile_format(args) == 'text'